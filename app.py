@@ -11,7 +11,6 @@ from psycopg2.pool import ThreadedConnectionPool
 
 from psycopg2.extras import RealDictCursor
 import os
-from datetime import datetime
 import uuid
 from contextlib import contextmanager
 
@@ -136,34 +135,23 @@ def get_user_preferences(session_id):
         print(f"Error getting preferences: {e}")
         return "No hay preferencias del usuario."
 
-# Database functions
-def load_chat_history(session_id):
-    try:
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT role, content FROM chat_messages 
-                    WHERE session_id = %s 
-                    ORDER BY created_at
-                """, (session_id,))
-                messages = cur.fetchall()
-                
-                return [
-                    AIMessage(content=msg['content']) if msg['role'] == 'assistant'
-                    else HumanMessage(content=msg['content'])
-                    for msg in messages
-                ]
-    except Exception as e:
-        st.error(f"Error loading chat history: {e}")
-        return []
+from backend.db import load_chat_history_page
+
+# Mensajes por página en la vista de historial (paginación keyset en la base)
+HISTORY_PAGE_SIZE = 50
+
+def load_recent_history(session_id):
+    """Load the last page of a session and remember the cursor for older messages"""
+    messages, st.session_state.history_cursor = load_chat_history_page(session_id, page_size=HISTORY_PAGE_SIZE)
+    return messages
 
 def save_message(session_id, role, content):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO chat_messages (session_id, role, content, created_at, status)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (session_id, role, content, datetime.now(), "en_proceso"))
+                VALUES (%s, %s, %s, clock_timestamp(), %s)
+            """, (session_id, role, content, "en_proceso"))
             conn.commit()
 
 def get_all_sessions():
@@ -184,9 +172,10 @@ if "session_id" not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
 
 if "messages" not in st.session_state:
-    st.session_state.messages = load_chat_history(st.session_state.session_id)
+    st.session_state.messages = load_recent_history(st.session_state.session_id)
 
-from backend.db import load_cart, load_preferences, load_summaries, load_old_carts
+from backend.db import load_cart, load_preferences, load_session_context
+from backend.session import HISTORY_WINDOW
 if "my_cart" not in st.session_state:
     st.session_state.my_cart = load_cart(st.session_state.session_id)
 
@@ -203,6 +192,7 @@ with st.sidebar:
         #Update session state
         st.session_state.session_id = new_session_id
         st.session_state.messages = []
+        st.session_state.history_cursor = None
         st.rerun()
 
     # Get all sessions and create buttons
@@ -235,7 +225,7 @@ with st.sidebar:
                 type="primary" if is_current else "secondary"
             ):
                 st.session_state.session_id = session['session_id']
-                st.session_state.messages = load_chat_history(session['session_id'])
+                st.session_state.messages = load_recent_history(session['session_id'])
                 st.rerun()
         
         # Delete button in second column
@@ -254,7 +244,7 @@ with st.sidebar:
                         """, (session['session_id'],))
                         conn.commit()                
                         cur.execute("""
-                            DELETE FROM user_cart 
+                            DELETE FROM carts 
                             WHERE user_id = %s
                         """, (session['session_id'],))
                         conn.commit()                
@@ -263,6 +253,7 @@ with st.sidebar:
                 if session['session_id'] == st.session_state.session_id:
                     st.session_state.session_id = str(uuid.uuid4())
                     st.session_state.messages = []
+                    st.session_state.history_cursor = None
                 st.rerun()
 
     # Add delete all button at the bottom
@@ -271,15 +262,27 @@ with st.sidebar:
             with conn.cursor() as cur:
                 cur.execute("DELETE FROM chat_messages")
                 cur.execute("DELETE FROM ai_memory")
-                cur.execute("DELETE FROM user_cart")
+                cur.execute("DELETE FROM carts")
                 conn.commit()
         st.session_state.session_id = str(uuid.uuid4())
         st.session_state.messages = []
+        st.session_state.history_cursor = None
         st.rerun()
 
 # Main chat interface
 user_query = st.chat_input('En que te puedo ayudar?')
 
+# Older messages are only loaded on demand
+if st.session_state.get("history_cursor") is not None:
+    if st.button("Cargar mensajes anteriores"):
+        older, st.session_state.history_cursor = load_chat_history_page(
+            st.session_state.session_id,
+            before=st.session_state.history_cursor,
+            page_size=HISTORY_PAGE_SIZE,
+        )
+        st.session_state.messages = older + st.session_state.messages
+        st.rerun()
+
 # Display chat messages
 for msg in st.session_state.messages:
     if isinstance(msg, AIMessage):
@@ -292,23 +295,19 @@ if user_query:
     # Save user message
     st.chat_message("user", avatar=USER_AVATAR).write(user_query)
 
-    save_message(st.session_state.session_id, "user", user_query)
+    # Guarda el mensaje y trae carrito, preferencias, resúmenes, carritos anteriores y clave en un solo round trip
+    context = load_session_context(st.session_state.session_id, new_message=user_query)
     st.session_state.messages.append(HumanMessage(content=user_query))
 
+    st.session_state.my_cart = context.cart
+    st.session_state.user_preferences = context.preferences
+    st.session_state.summaries = context.summaries
+    st.session_state.old_carts = context.old_carts
 
-    st.session_state.my_cart = load_cart(st.session_state.session_id)
-    st.session_state.user_preferences = load_preferences(st.session_state.session_id)
-    st.session_state.summaries = load_summaries(st.session_state.session_id)
-    st.session_state.old_carts = load_old_carts(st.session_state.session_id)
-
-    state = {
-        "messages": st.session_state.messages,
-        "cart": st.session_state.my_cart,
-        "user_id": st.session_state.session_id,
-        "preferences": st.session_state.user_preferences,
-        "summaries": st.session_state.summaries,
-        "old_carts": st.session_state.old_carts
-    }
+    state = context.to_state()
+    # El grafo solo necesita los mensajes recientes, aunque la vista tenga más páginas cargadas
+    state["messages"] = st.session_state.messages[-HISTORY_WINDOW:]
+    state["cart"] = st.session_state.my_cart
 
     placeholder = st.container()
     response = asyncio.run(invoke_our_graph(state, BOT_AVATAR))
@@ -321,9 +320,15 @@ if user_query:
     )
     st.session_state.messages.append(response["messages"])
 
+    from backend.db import save_cart_changes, save_preferences
+    from backend.cart_store import diff
+    # El carrito es parte del estado del grafo: solo se guardan los items que cambiaron en el turno
+    save_cart_changes(st.session_state.session_id, diff(st.session_state.my_cart, response["cart"]))
     st.session_state.my_cart = response["cart"]
-    from backend.db import save_cart, save_preferences
-    save_cart(st.session_state.session_id, st.session_state.my_cart)
 
     st.session_state.user_preferences = response["preferences"]
-    save_preferences(st.session_state.session_id, st.session_state.user_preferences)
\ No newline at end of file
+    save_preferences(st.session_state.session_id, st.session_state.user_preferences)
+
+    # Resumen incremental de la conversación, en background
+    from backend import summarizer
+    summarizer.schedule(st.session_state.session_id)
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""
+Async Database Layer
+
+Version async de backend/db.py para usar desde los nodos de LangGraph y desde los dos frontends
+sin bloquear el event loop. Tiene las mismas funciones (load_cart, load_preferences,
+save_message, etc.) pero con await.
+
+Características principales:
+- Usa psycopg 3 con AsyncConnectionPool (no depende de Streamlit)
+- Un pool por event loop: los frontends corren el grafo con asyncio.run, que crea un loop
+  nuevo cada vez, y las conexiones async no se pueden compartir entre loops
+- El tamaño del pool se configura con DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE y DB_POOL_TIMEOUT
+"""
+import os
+import asyncio
+import logging
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from backend.session import (
+    HISTORY_WINDOW, CHAT_HISTORY_QUERY, SESSION_CONTEXT_QUERY,
+    SessionContext, session_context_params, history_page_query, history_page, to_messages,
+)
+from backend import cart_store
+from backend.cart import from_json
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+
+
+def pool_settings():
+    return {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 20)),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+    }
+
+
+def _discard_pool(pool):
+    """
+    Close the connections of a pool whose event loop is already closed. pool.close() needs that
+    loop, so the sockets are closed directly (libpq's finish() is synchronous)
+    """
+    logger.warning("Discarding the connection pool of a closed event loop (close_pool() was not called)")
+    for conn in list(getattr(pool, '_pool', ())):
+        try:
+            conn.pgconn.finish()
+        except Exception:
+            pass
+
+
+async def get_pool():
+    """Return the connection pool of the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        # Los pools de loops que ya se cerraron no se pueden reutilizar
+        for closed_loop in [l for l in _pools if l.is_closed()]:
+            _discard_pool(_pools.pop(closed_loop))
+
+        pool = AsyncConnectionPool(
+            conninfo=os.getenv('DATABASE_URL'),
+            kwargs={'autocommit': True, 'row_factory': dict_row},
+            open=False,
+            **pool_settings(),
+        )
+        _pools[loop] = pool
+    # open() es idempotente, asi que no importa si otra tarea ya lo abrio
+    await pool.open()
+    return pool
+
+
+async def close_pool():
+    """Close the pool of the running event loop (call it before the loop shuts down)"""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+
+def pool_stats():
+    return {id(loop): pool.get_stats() for loop, pool in _pools.items() if not loop.is_closed()}
+
+
+async def fetchone(query, params=()):
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchone()
+
+
+async def fetchall(query, params=()):
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchall()
+
+
+async def execute(query, params=()):
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cur = await conn.execute(query, params)
+        return cur.rowcount
+
+
+async def complete_cart(user_id):
+    """Mark the active cart as completed (the next one is created with the first product)"""
+    await execute(cart_store.COMPLETE_CART_QUERY, {'user_id': user_id})
+
+
+async def change_messages_status(user_id):
+    """Mark chat messages as completed"""
+    await execute("""
+        UPDATE chat_messages
+        SET status = 'completado',
+            updated_at = CURRENT_TIMESTAMP
+        WHERE session_id = %s AND status = 'en_proceso'
+    """, (user_id,))
+
+
+async def save_cart_changes(user_id, changes):
+    """Apply a cart_store.diff() to the active cart (creating it if needed) in one transaction"""
+    if not changes:
+        return
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        async with conn.transaction():
+            if changes.removed:
+                await conn.execute(cart_store.DELETE_ITEMS_QUERY, {'user_id': user_id, 'product_ids': changes.removed})
+            if changes.upserts:
+                cur = await conn.execute(cart_store.ENSURE_ACTIVE_CART_QUERY, {'user_id': user_id})
+                cart_id = (await cur.fetchone())['cart_id']
+                async with conn.cursor() as cur:
+                    await cur.executemany(cart_store.UPSERT_ITEM_QUERY, cart_store.upsert_params(cart_id, changes))
+
+
+async def load_cart(user_id):
+    """Items of the active cart"""
+    result = await fetchone(cart_store.ACTIVE_CART_QUERY, {'user_id': user_id})
+    return from_json(result['items'])
+
+
+async def load_preferences(user_id: str) -> str:
+    """
+    Load user preferences from the database.
+    Args:
+        user_id: The user's ID
+    Returns:
+        String containing user preferences
+    """
+    memory = await fetchone("""
+        SELECT content
+        FROM ai_memory
+        WHERE user_id = %s AND type = 'preferences'
+        ORDER BY created_at DESC
+        LIMIT 1
+    """, (user_id,))
+
+    if not memory:
+        # Insert a new row if no preferences are found
+        memory = await fetchone("""
+            INSERT INTO ai_memory (user_id, content, type, created_at, updated_at)
+            VALUES (%s, %s, 'preferences',CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            RETURNING content
+        """, (user_id, ''))
+    return memory['content']
+
+
+async def save_preferences(user_id, preferences):
+    await execute("""
+    UPDATE ai_memory
+        SET content = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = %s AND type = 'preferences'
+    """, (preferences, user_id))
+
+
+async def load_messages_en_proceso(session_id):
+    try:
+        messages = await fetchall("""
+            SELECT role, content FROM chat_messages
+            WHERE session_id = %s AND status = 'en_proceso'
+            ORDER BY created_at, id
+        """, (session_id,))
+        return to_messages(messages)
+    except Exception as e:
+        logger.error(f"Error loading chat history: {e}")
+        return []
+
+
+async def add_summary_db(user_id, summary_content):
+    await execute("""
+        INSERT INTO ai_memory (user_id, content, type, created_at, updated_at)
+        VALUES (%s, %s, 'summary', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    """, (user_id, summary_content))
+
+
+async def load_summaries(user_id):
+    return await fetchall("""
+        SELECT content, created_at FROM ai_memory
+        WHERE user_id = %s AND type = 'summary'
+        ORDER BY created_at DESC
+    """, (user_id,))
+
+
+async def load_old_carts(user_id, limit=None):
+    """Completed carts, most recent first"""
+    rows = await fetchall(cart_store.COMPLETED_CARTS_QUERY, {'user_id': user_id, 'limit': limit})
+    return [cart_store.completed_cart(row) for row in rows]
+
+
+async def load_last_completed_cart(user_id):
+    """The last completed cart, or None"""
+    carts = await load_old_carts(user_id, limit=1)
+    return carts[0] if carts else None
+
+
+async def save_message(session_id, role, content, msg_id):
+    await execute("""
+        INSERT INTO chat_messages (session_id, role, content, created_at, status, msg_id)
+        VALUES (%s, %s, %s, clock_timestamp(), %s, %s)
+    """, (session_id, role, content, "en_proceso", msg_id))
+
+
+async def load_chat_history(session_id, limit=None):
+    """Load the chat history in chronological order. With limit, only the last `limit` messages"""
+    try:
+        messages = await fetchall(CHAT_HISTORY_QUERY, {'session_id': session_id, 'limit': limit})
+        return to_messages(messages)
+    except Exception as e:
+        logger.error(f"Error loading chat history: {e}")
+        return []
+
+
+async def load_chat_history_page(session_id, before=None, page_size=50):
+    """
+    Keyset-paginated history for the UI.
+    Returns (messages, cursor): pass cursor as `before` to get the previous page, None when there are no more.
+    """
+    try:
+        rows = await fetchall(*history_page_query(session_id, before, page_size))
+        return history_page(rows, page_size)
+    except Exception as e:
+        logger.error(f"Error loading chat history: {e}")
+        return [], None
+
+
+async def check_duplicated(session_id, msg_id):
+    try:
+        message = await fetchone("""
+            SELECT session_id FROM chat_messages
+            WHERE session_id = %s and msg_id = %s
+        """, (session_id, msg_id))
+        return message is not None  # Retorna True si hay un duplicado
+    except Exception as e:
+        logger.error(f"Error checking duplicated message: {e}")
+        return False
+
+
+async def load_reply(session_id, msg_id):
+    """
+    The assistant message that answered the user message msg_id, or None if the turn did not
+    finish (the assistant message is the last thing a turn saves)
+    """
+    reply = await fetchone("""
+        SELECT a.content FROM chat_messages u
+        JOIN chat_messages a
+          ON a.session_id = u.session_id AND a.role = 'assistant'
+         AND (a.created_at, a.id) > (u.created_at, u.id)
+        WHERE u.session_id = %s AND u.msg_id = %s
+        ORDER BY a.created_at, a.id
+        LIMIT 1
+    """, (session_id, msg_id))
+    return reply['content'] if reply else None
+
+
+async def update_key(session_id, key):
+    try:
+        updated = await execute("""
+            UPDATE keys
+            SET updated_at = CURRENT_TIMESTAMP, key= %s
+            WHERE user_id = %s
+        """, (key, session_id))
+
+        if updated == 0:
+            # Si no existe la clave, crear una nueva fila
+            await execute("""
+                INSERT INTO keys (user_id, key,created_at, updated_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            """, (session_id, key))
+    except Exception as e:
+        logger.error(f"Error updating key: {e}")
+
+
+async def load_key(user_id):
+    try:
+        key = await fetchone("""
+            SELECT key FROM keys
+            WHERE user_id = %s
+        """, (user_id,))
+
+        if key is None:
+            # Si no se encuentra la clave, crear una nueva clave vacía
+            key = await fetchone("""
+                INSERT INTO keys (user_id, key, created_at, updated_at)
+                VALUES (%s, '', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                RETURNING key
+            """, (user_id,))
+        return key
+    except Exception as e:
+        logger.error(f"Error loading key: {e}")
+        return {'key': ''}
+
+
+async def load_key_message(user_id):
+    try:
+        return await fetchone("""
+            SELECT cart FROM keys
+            WHERE user_id = %s
+        """, (user_id,))
+    except Exception as e:
+        logger.error(f"Error loading key message: {e}")
+        return None
+
+
+async def load_session_context(user_id, new_message=None, msg_id=None, history_limit=HISTORY_WINDOW):
+    """
+    Load history, preferences, summaries, old carts, active cart and key in a single round trip.
+    If new_message is given it is saved in the same statement (and is not part of the returned history).
+    """
+    row = await fetchone(SESSION_CONTEXT_QUERY, session_context_params(user_id, new_message, msg_id, history_limit))
+    return SessionContext.from_row(user_id, row)
@@ -0,0 +1,194 @@
+"""
+Structured cart
+
+El carrito es parte del estado del grafo (GraphsState["cart"]): una lista de items tipados que
+modifican las tools add_product, remove_product y change_quantity. Así el checkout lo serializa
+directamente, sin pedirle al LLM que lo reconstruya a partir de los últimos mensajes.
+
+Las tools reciben el handle del producto que devolvió la búsqueda (ver
+backend/tools/product_table.py) y nombre, precio y link salen de la tabla de productos.
+
+En la base se guarda una fila por item en cart_items (ver backend/cart_store.py); to_json/from_json
+quedan para el formato {"carrito": [{"nombre", "precio", "cantidad", "link", "product_id"}]}.
+"""
+import re
+import json
+import numbers
+from dataclasses import dataclass, asdict
+from typing import Annotated
+
+from langchain_core.tools import tool
+
+from backend.tools.catalog import product_id
+from backend.tools.product_table import product_table
+
+
+@dataclass
+class CartItem:
+    product_id: str
+    nombre: str
+    precio: float
+    cantidad: int
+    link: str
+
+    @property
+    def subtotal(self):
+        return round(self.precio * self.cantidad, 2)
+
+    @classmethod
+    def from_dict(cls, item):
+        link = item.get('link', '')
+        return cls(
+            product_id=item.get('product_id') or product_id(link),
+            nombre=item.get('nombre', ''),
+            precio=parse_price(item.get('precio', 0)),
+            cantidad=max(int(item.get('cantidad', 1) or 1), 1),
+            link=link,
+        )
+
+
+def parse_price(value):
+    """2024.25 or '$2.024,25' -> 2024.25 (same rule as catalog.parse_prices for text)"""
+    if isinstance(value, numbers.Number):
+        return float(value)
+    # formato argentino: el punto siempre es de miles y la coma es decimal ('$2.024' son 2024)
+    text = re.sub(r'[^\d,]', '', str(value)).replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0
+
+
+def from_json(value):
+    """Cart items from a list, {"carrito": [...]} or a JSON string"""
+    if isinstance(value, str):
+        value = json.loads(value) if value else []
+    if isinstance(value, dict):
+        value = value.get('carrito', [])
+    return [asdict(CartItem.from_dict(item)) for item in value or []]
+
+
+def to_json(cart):
+    return json.dumps({"carrito": cart}, ensure_ascii=False)
+
+
+def total(cart):
+    return round(sum(CartItem.from_dict(item).subtotal for item in cart), 2)
+
+
+def format_price(value):
+    """2024.25 -> '$2.024,25'"""
+    return "$" + f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def format_cart(cart, links=True):
+    """Cart as text. With links=False (for the prompt) each product shows its [handle] instead of the link"""
+    if not cart:
+        return "El carrito está vacío."
+    lines = [
+        f"- {item['nombre']} x{item['cantidad']}: {format_price(item['precio'] * item['cantidad'])} "
+        + (f"({item['link']})" if links else f"[{product_table.register_cart_item(item)}]")
+        for item in cart
+    ]
+    lines.append(f"Total: {format_price(total(cart))}")
+    return "\n".join(lines)
+
+
+def _find(cart, ref):
+    # ref es el handle del producto (o el link)
+    product = product_table.get(ref)
+    pid = product_id(product['link'] if product else ref)
+    for i, item in enumerate(cart):
+        if item['product_id'] == pid:
+            return i
+    # Si el modelo mandó el nombre en vez del handle
+    for i, item in enumerate(cart):
+        if item['nombre'].strip().lower() == str(ref).strip().lower():
+            return i
+    return None
+
+
+def add_item(cart, nombre, precio, link, cantidad=1):
+    if int(cantidad) <= 0:
+        return cart, f"ERROR: la cantidad a agregar tiene que ser mayor a 0 (para quitar {nombre} usa remove_product)"
+    cart = [dict(item) for item in cart]
+    i = _find(cart, link)
+    if i is not None:
+        # El precio es el del catálogo de ahora, no el de cuando se agregó la primera vez
+        cart[i]['precio'] = parse_price(precio)
+        cart[i]['cantidad'] += int(cantidad)
+        return cart, f"Ahora hay {cart[i]['cantidad']} de {cart[i]['nombre']} en el carrito. Total: {format_price(total(cart))}"
+    item = CartItem.from_dict({'nombre': nombre, 'precio': precio, 'link': link, 'cantidad': cantidad})
+    cart.append(asdict(item))
+    return cart, f"Agregado: {item.nombre} x{item.cantidad}. Total: {format_price(total(cart))}"
+
+
+def remove_item(cart, ref):
+    i = _find(cart, ref)
+    if i is None:
+        return cart, f"No hay ningún producto {ref} en el carrito"
+    removed = cart[i]
+    cart = cart[:i] + cart[i + 1:]
+    return cart, f"Quitado: {removed['nombre']}. Total: {format_price(total(cart))}"
+
+
+def change_item_quantity(cart, ref, cantidad):
+    if int(cantidad) <= 0:
+        return remove_item(cart, ref)
+    i = _find(cart, ref)
+    if i is None:
+        return cart, f"No hay ningún producto {ref} en el carrito"
+    cart = [dict(item) for item in cart]
+    cart[i]['cantidad'] = int(cantidad)
+    return cart, f"Ahora hay {cart[i]['cantidad']} de {cart[i]['nombre']} en el carrito. Total: {format_price(total(cart))}"
+
+
+# Las tools solo definen el esquema que ve el modelo: handle_shopping_tools aplica cada llamada
+# al carrito del estado con apply_tool_call, en orden
+@tool("add_product")
+def add_product(
+    producto: Annotated[str, "Id del producto tal como lo devolvió la búsqueda, por ejemplo p3f9a2c1b"],
+    cantidad: Annotated[int, "Cantidad de unidades a agregar"] = 1,
+) -> str:
+    """Agrega un producto encontrado con product_lookup_tool al carrito (si ya está, suma la cantidad)"""
+    return f"Agregado: {producto} x{cantidad}"
+
+
+@tool("remove_product")
+def remove_product(
+    producto: Annotated[str, "Id del producto a quitar"],
+) -> str:
+    """Quita un producto del carrito"""
+    return f"Quitado: {producto}"
+
+
+@tool("change_quantity")
+def change_quantity(
+    producto: Annotated[str, "Id del producto"],
+    cantidad: Annotated[int, "Nueva cantidad total (0 lo quita del carrito)"],
+) -> str:
+    """Cambia la cantidad de un producto que ya está en el carrito"""
+    return f"Cantidad de {producto}: {cantidad}"
+
+
+cart_tools = [add_product, remove_product, change_quantity]
+CART_TOOLS = {tool.name for tool in cart_tools}
+
+
+def apply_tool_call(cart, tool_call):
+    """Apply a cart tool call to the cart. Returns (new cart, message for the model)"""
+    name, args = tool_call["name"], tool_call["args"]
+    try:
+        if name == "add_product":
+            # handle_shopping_tools ya trajo del índice lo que faltaba (product_table.resolve)
+            product = product_table.get(args["producto"])
+            if product is None or not product['catalog']:
+                return cart, f"ERROR: no hay ningún producto {args['producto']}, búscalo de nuevo con product_lookup_tool"
+            return add_item(cart, product["nombre"], product["precio"], product["link"], args.get("cantidad", 1))
+        if name == "remove_product":
+            return remove_item(cart, args["producto"])
+        if name == "change_quantity":
+            return change_item_quantity(cart, args["producto"], args["cantidad"])
+    except (KeyError, TypeError, ValueError) as e:
+        return cart, f"ERROR: argumentos inválidos para {name}: {e}"
+    return cart, f"ERROR: tool desconocida {name}"
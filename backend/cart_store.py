@@ -0,0 +1,130 @@
+"""
+Cart store
+
+Los carritos se guardan normalizados (backend/migrations/004_carts.sql):
+- carts: una fila por carrito, con status (en_proceso / completado), total e item_count
+  materializados por un trigger sobre cart_items
+- cart_items: una fila por producto, con clave (cart_id, product_id)
+
+En vez de reescribir el carrito entero después de cada turno, diff() compara el carrito de antes
+con el de después y save_cart_changes solo hace upsert de los items que cambiaron y borra los que
+se quitaron. El carrito activo se crea recién cuando se agrega el primer producto.
+
+Las queries las usan backend/db.py (sync, Streamlit) y backend/async_db.py (async, WhatsApp /
+nodos del grafo).
+"""
+from dataclasses import dataclass, field
+
+from backend.cart import from_json
+
+CART_ITEM_JSON = (
+    "json_build_object('product_id', i.product_id, 'nombre', i.nombre, 'precio', i.precio, "
+    "'cantidad', i.cantidad, 'link', i.link)"
+)
+
+ACTIVE_CART_QUERY = f"""
+    SELECT COALESCE(json_agg({CART_ITEM_JSON} ORDER BY i.created_at), '[]'::json) AS items
+    FROM carts c
+    JOIN cart_items i ON i.cart_id = c.cart_id
+    WHERE c.user_id = %(user_id)s AND c.status = 'en_proceso'
+"""
+
+# El INSERT no hace nada si ya hay un carrito activo (índice único parcial) y en ese caso lo
+# devuelve el SELECT: en el mismo statement el SELECT no ve la fila recién insertada
+ENSURE_ACTIVE_CART_QUERY = """
+    WITH new_cart AS (
+        INSERT INTO carts (user_id) VALUES (%(user_id)s)
+        ON CONFLICT (user_id) WHERE status = 'en_proceso' DO NOTHING
+        RETURNING cart_id
+    )
+    SELECT cart_id FROM new_cart
+    UNION ALL
+    SELECT cart_id FROM carts WHERE user_id = %(user_id)s AND status = 'en_proceso'
+    LIMIT 1
+"""
+
+UPSERT_ITEM_QUERY = """
+    INSERT INTO cart_items (cart_id, product_id, nombre, precio, cantidad, link)
+    VALUES (%(cart_id)s, %(product_id)s, %(nombre)s, %(precio)s, %(cantidad)s, %(link)s)
+    ON CONFLICT (cart_id, product_id) DO UPDATE
+    SET nombre = EXCLUDED.nombre,
+        precio = EXCLUDED.precio,
+        cantidad = EXCLUDED.cantidad,
+        link = EXCLUDED.link,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Si no hay carrito activo (p. ej. ya se completó la compra) no borra nada
+DELETE_ITEMS_QUERY = """
+    DELETE FROM cart_items i
+    USING carts c
+    WHERE i.cart_id = c.cart_id
+      AND c.user_id = %(user_id)s AND c.status = 'en_proceso'
+      AND i.product_id = ANY(%(product_ids)s)
+"""
+
+COMPLETE_CART_QUERY = """
+    UPDATE carts
+    SET status = 'completado',
+        completed_at = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE user_id = %(user_id)s AND status = 'en_proceso'
+"""
+
+# Carritos completados, el más reciente primero (LIMIT NULL = todos). Usa el índice
+# (user_id, completed_at DESC) de los completados
+COMPLETED_CARTS_QUERY = f"""
+    SELECT c.cart_id, c.total, c.item_count, c.completed_at,
+           (SELECT COALESCE(json_agg({CART_ITEM_JSON} ORDER BY i.created_at), '[]'::json)
+              FROM cart_items i WHERE i.cart_id = c.cart_id) AS items
+    FROM carts c
+    WHERE c.user_id = %(user_id)s AND c.status = 'completado' AND c.item_count > 0
+    ORDER BY c.completed_at DESC
+    LIMIT %(limit)s
+"""
+
+
+@dataclass
+class CartChanges:
+    upserts: list[dict] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.upserts or self.removed)
+
+
+def diff(before, after):
+    """Items to upsert (new or changed) and product_ids to delete to go from `before` to `after`"""
+    before = {item['product_id']: item for item in before or []}
+    after_ids = set()
+    changes = CartChanges()
+    for item in after or []:
+        after_ids.add(item['product_id'])
+        if before.get(item['product_id']) != item:
+            changes.upserts.append(item)
+    changes.removed = [pid for pid in before if pid not in after_ids]
+    return changes
+
+
+def upsert_params(cart_id, changes):
+    return [
+        {
+            'cart_id': cart_id,
+            'product_id': item['product_id'],
+            'nombre': item['nombre'],
+            'precio': item['precio'],
+            'cantidad': item['cantidad'],
+            'link': item['link'],
+        }
+        for item in changes.upserts
+    ]
+
+
+def completed_cart(row):
+    return {
+        'cart_id': row['cart_id'],
+        'cart_items': from_json(row['items']),
+        'total': float(row['total']),
+        'item_count': row['item_count'],
+        'completed_at': row['completed_at'],
+    }
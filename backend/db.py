@@ -6,35 +6,53 @@ Proporciona una forma eficiente y segura de compartir conexiones entre diferente
 
 Características principales:
 - Usa ThreadedConnectionPool para manejar múltiples conexiones concurrentes
-- Cachea el pool de conexiones usando st.cache_resource
+- Un solo pool por proceso, creado la primera vez que se usa (no depende de Streamlit,
+  así el servidor de WhatsApp lo puede usar igual)
+- El tamaño del pool se configura con DB_POOL_MIN_SIZE y DB_POOL_MAX_SIZE
 - Implementa context manager para manejo seguro de conexiones
 - Configura autocommit para optimizar queries de lectura
+
+Para los nodos async del grafo ver backend/async_db.py, que tiene las mismas funciones.
 """
 import os
+import logging
+import threading
 from contextlib import contextmanager
-import psycopg2
 from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import RealDictCursor
-import streamlit as st
-import json
-from psycopg2.extras import Json
 from langchain_core.messages import AIMessage, HumanMessage
+from backend.session import (
+    HISTORY_WINDOW, CHAT_HISTORY_QUERY, SESSION_CONTEXT_QUERY,
+    SessionContext, session_context_params, history_page_query, history_page, to_messages,
+)
+from backend import cart_store
+from backend.cart import from_json
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
 
-@st.cache_resource
 def init_connection_pool():
-    """Initialize and cache the database connection pool"""
+    """Initialize the process-wide database connection pool"""
     return ThreadedConnectionPool(
-        minconn=1,
-        maxconn=20,
+        minconn=int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+        maxconn=int(os.getenv('DB_POOL_MAX_SIZE', 20)),
         dsn=os.getenv('DATABASE_URL')
     )
 
-# Get connection pool on startup
-pool = init_connection_pool()
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = init_connection_pool()
+    return _pool
 
 @contextmanager
 def get_db_connection():
-    """Get a connection from the cached pool"""
+    """Get a connection from the process-wide pool"""
+    pool = get_pool()
     conn = None
     try:
         conn = pool.getconn()
@@ -45,24 +63,10 @@ def get_db_connection():
             pool.putconn(conn)
 
 def complete_cart(user_id):
-    """Mark current cart as completed and create a new one"""
+    """Mark the active cart as completed (the next one is created with the first product)"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Mark current cart as completed
-            cur.execute("""
-                UPDATE user_cart 
-                SET status = 'completado',
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = %s AND status = 'en_proceso'
-            """, (user_id,))
-            
-            cur.execute("""
-                INSERT INTO user_cart
-                (user_id, cart_items, status, created_at, updated_at)
-                VALUES 
-                (%s, %s::jsonb, 'en_proceso', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            """, (user_id, '[]'))
-            
+            cur.execute(cart_store.COMPLETE_CART_QUERY, {'user_id': user_id})
             conn.commit()
 
 def change_messages_status(user_id):
@@ -78,40 +82,35 @@ def change_messages_status(user_id):
             """, (user_id,)) 
             conn.commit()
 
-def save_cart(user_id, cart_items):
+def save_cart_changes(user_id, changes):
+    """Apply a cart_store.diff() to the active cart (creating it if needed) in one transaction"""
+    if not changes:
+        return
     with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO user_cart
-                (user_id, cart_items, status, created_at, updated_at)
-                VALUES 
-                (%s, %s::jsonb, 'completado', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                RETURNING cart_items
-            """, (user_id, cart_items))
+        # El pool entrega las conexiones en autocommit
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                if changes.removed:
+                    cur.execute(cart_store.DELETE_ITEMS_QUERY, {'user_id': user_id, 'product_ids': changes.removed})
+                if changes.upserts:
+                    cur.execute(cart_store.ENSURE_ACTIVE_CART_QUERY, {'user_id': user_id})
+                    cart_id = cur.fetchone()[0]
+                    cur.executemany(cart_store.UPSERT_ITEM_QUERY, cart_store.upsert_params(cart_id, changes))
             conn.commit()
-            
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+
 
 def load_cart(user_id):
+    """Items of the active cart"""
     with get_db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT cart_items FROM user_cart 
-                WHERE user_id = %s AND status = 'en_proceso'
-            """, (user_id,))
-            result = cur.fetchone()
-
-            if not result:
-                # Si no existe un carrito activo, crear uno nuevo
-                cur.execute("""
-                    INSERT INTO user_cart
-                    (user_id, cart_items, status, created_at, updated_at)
-                    VALUES 
-                    (%s, %s::jsonb, 'en_proceso', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    RETURNING cart_items
-                """, (user_id, '[]'))
-                result = cur.fetchone()
-            
-            return result['cart_items']
+            cur.execute(cart_store.ACTIVE_CART_QUERY, {'user_id': user_id})
+            return from_json(cur.fetchone()['items'])
 
 
 def load_preferences(user_id: str) -> str:
@@ -164,7 +163,7 @@ def load_messages_en_proceso(session_id):
                 cur.execute("""
                     SELECT role, content FROM chat_messages 
                     WHERE session_id = %s AND status = 'en_proceso' 
-                    ORDER BY created_at
+                    ORDER BY created_at, id
                 """, (session_id,))
                 messages = cur.fetchall()
                 
@@ -174,7 +173,7 @@ def load_messages_en_proceso(session_id):
                     for msg in messages
                 ]
     except Exception as e:
-        st.error(f"Error loading chat history: {e}")
+        logger.error(f"Error loading chat history: {e}")
         return []
 
 def add_summary_db(user_id, summary_content):
@@ -199,51 +198,56 @@ def load_summaries(user_id):
             
             return results
 
-def load_old_carts(user_id):
+def load_old_carts(user_id, limit=None):
+    """Completed carts, most recent first"""
     with get_db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT cart_items, updated_at FROM user_cart 
-                WHERE user_id = %s AND status = 'completado' AND cart_items != '[]'::jsonb
-                ORDER BY updated_at DESC
-            """, (user_id,))
-            results = cur.fetchall() # list of summaries
-            conn.commit()
-            
-            return results
+            cur.execute(cart_store.COMPLETED_CARTS_QUERY, {'user_id': user_id, 'limit': limit})
+            return [cart_store.completed_cart(row) for row in cur.fetchall()]
+
 
-from datetime import datetime
+def load_last_completed_cart(user_id):
+    """The last completed cart, or None"""
+    carts = load_old_carts(user_id, limit=1)
+    return carts[0] if carts else None
 
 def save_message(session_id, role, content, msg_id):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO chat_messages (session_id, role, content, created_at, status, msg_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (session_id, role, content, datetime.now(), "en_proceso", msg_id))
+                VALUES (%s, %s, %s, clock_timestamp(), %s, %s)
+            """, (session_id, role, content, "en_proceso", msg_id))
             conn.commit()
 
 # Database functions
-def load_chat_history(session_id):
+def load_chat_history(session_id, limit=None):
+    """Load the chat history in chronological order. With limit, only the last `limit` messages"""
     try:
         with get_db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT role, content FROM chat_messages 
-                    WHERE session_id = %s 
-                    ORDER BY created_at
-                """, (session_id,))
+                cur.execute(CHAT_HISTORY_QUERY, {'session_id': session_id, 'limit': limit})
                 messages = cur.fetchall()
-                
-                return [
-                    AIMessage(content=msg['content']) if msg['role'] == 'assistant'
-                    else HumanMessage(content=msg['content'])
-                    for msg in messages
-                ]
+
+                return to_messages(messages)
     except Exception as e:
-        st.error(f"Error loading chat history: {e}")
+        logger.error(f"Error loading chat history: {e}")
         return []
 
+def load_chat_history_page(session_id, before=None, page_size=50):
+    """
+    Keyset-paginated history for the UI.
+    Returns (messages, cursor): pass cursor as `before` to get the previous page, None when there are no more.
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(*history_page_query(session_id, before, page_size))
+                return history_page(cur.fetchall(), page_size)
+    except Exception as e:
+        logger.error(f"Error loading chat history: {e}")
+        return [], None
+
 # Database functions
 def check_duplicated(session_id, msg_id):
     try:
@@ -258,8 +262,8 @@ def check_duplicated(session_id, msg_id):
                 return messages is not None # Retorna True si hay un duplicado 
                 
     except Exception as e:
-        st.error(f"Error loading chat history: {e}")
-        return []
+        logger.error(f"Error checking duplicated message: {e}")
+        return False
 
 
 def update_key(session_id, key):
@@ -282,8 +286,7 @@ def update_key(session_id, key):
                     conn.commit()
                 
     except Exception as e:
-        st.error(f"Error loading chat history: {e}")
-        return []
+        logger.error(f"Error updating key: {e}")
 
 
 def load_key(user_id):
@@ -308,8 +311,8 @@ def load_key(user_id):
                 return key 
                 
     except Exception as e:
-        st.error(f"Error loading chat history: {e}")
-        return []
+        logger.error(f"Error loading key: {e}")
+        return {'key': ''}
 
 
 def load_key_message(user_id):
@@ -325,6 +328,18 @@ def load_key_message(user_id):
                 return key 
                 
     except Exception as e:
-        st.error(f"Error loading chat history: {e}")
-        return []
+        logger.error(f"Error loading key message: {e}")
+        return None
     
+
+
+def load_session_context(user_id, new_message=None, msg_id=None, history_limit=HISTORY_WINDOW):
+    """
+    Load history, preferences, summaries, old carts, active cart and key in a single round trip.
+    If new_message is given it is saved in the same statement (and is not part of the returned history).
+    """
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SESSION_CONTEXT_QUERY, session_context_params(user_id, new_message, msg_id, history_limit))
+            row = cur.fetchone()
+            return SessionContext.from_row(user_id, row)
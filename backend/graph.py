@@ -6,10 +6,14 @@ from langchain_core.tools import tool, StructuredTool
 from langgraph.graph import START, END, StateGraph
 from langgraph.graph.message import AnyMessage, add_messages
 from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
-from langchain_openai import ChatOpenAI
+from backend.models import get_chat_model
+from backend.router import fast_route, record_decision
+from backend import speculation
 from langchain_core.messages import BaseMessage, ToolMessage, SystemMessage, AIMessage
 
-from backend.tools.tool import product_lookup_tool
+from backend.tools.tool import product_lookup_tool, product_batch_lookup_tool
+from backend.tools.product_table import product_table
+from backend import cart as cart_ops
 
 from contextlib import contextmanager
 import psycopg2
@@ -32,6 +36,7 @@ class GraphsState(TypedDict):
     summaries: str
     old_carts: str
     key: str
+    cart: list
 
 graph = StateGraph(GraphsState)
 
@@ -51,36 +56,51 @@ async def save_to_memory(user_id: str, content: str, context: str):
     except Exception as e:
         return f"ERROR|{str(e)}"
 
-# Shopping tools (main flow)
-tools = [product_lookup_tool]
-tools_by_name = {tool.name: tool for tool in tools}
+# Shopping tools (main flow). Las del carrito las aplica handle_shopping_tools sobre state["cart"]
+lookup_tools = [product_lookup_tool, product_batch_lookup_tool]
+tools = lookup_tools + cart_ops.cart_tools
+tools_by_name = {tool.name: tool for tool in lookup_tools}
 
 # Preferences tools
 preferences_tools = [save_to_memory]
 preferences_tools_by_name = {tool.name: tool for tool in preferences_tools}
 
-model = ChatOpenAI(model="gpt-4o-mini")
-llm = model.bind_tools(tools)
+# Los clientes de los modelos salen de backend/models.py: uno por configuración, con el pool HTTP compartido
 
 import asyncio
 
 async def handle_shopping_tools(state: dict):
     result = []
     tasks = []
-
-    # Crear todas las tareas primero para ejecución paralela
+    cart = state.get("cart") or []
+
+    # Los productos que add_product no encuentra en la tabla (links, productos del carrito o de
+    # otro worker) se traen del índice con un solo fetch
+    refs = [tc["args"].get("producto") for tc in state["messages"][-1].tool_calls if tc["name"] == "add_product"]
+    if refs:
+        try:
+            await asyncio.to_thread(product_table.resolve, [ref for ref in refs if ref])
+        except Exception as e:
+            # add_product le avisa al modelo que busque el producto de nuevo
+            print(f"Error resolving products: {e}")
+
+    # Crear todas las tareas primero para ejecución paralela; los cambios al carrito se aplican en orden
     for tool_call in state["messages"][-1].tool_calls:
         tool_name = tool_call["name"]
+        if tool_name in cart_ops.CART_TOOLS:
+            cart, observation = cart_ops.apply_tool_call(cart, tool_call)
+            tasks.append((observation, tool_call["id"], tool_name))
+            continue
         tool = tools_by_name[tool_name]
         task = asyncio.create_task(tool.ainvoke(tool_call["args"]))
         tasks.append((task, tool_call["id"], tool_name))
 
     # Esperar todas las tareas y procesar resultados
     for task, tool_call_id, tool_name in tasks:
-        observation = await task
+        observation = task if isinstance(task, str) else await task
         result.append(ToolMessage(content=observation, tool_call_id=tool_call_id, type='tool'))
    
-    return {"messages": result}
+    return {"messages": result, "cart": cart}
 
 async def save_memory(state: dict):
     """
@@ -119,6 +139,7 @@ def determine_tool_node(state: GraphsState) -> Literal["handle_shopping_tools",
     
     shopping_tools = {
         "product_lookup_tool",
+        "product_batch_lookup_tool",
         "add_product",
         "remove_product",
         "change_quantity"
@@ -139,7 +160,7 @@ def determine_preferences_tool(state: GraphsState):
     tool_name = state["messages"][-1].tool_calls[0]["name"]
     return "save_memory" if tool_name == "save_to_memory" else "__end__"   
 
-def determine_initial_node(state:GraphsState):
+async def determine_initial_node(state:GraphsState):
     """
     Use LLM to decide whether to go to add_preferences or shopping node based on the conversation history
     """
@@ -150,10 +171,8 @@ def determine_initial_node(state:GraphsState):
     key = key['key']
     print(key)
     print(input)
-    if input != '' and input == key:
-        return "create_summary"
 
-    from backend.prompts import get_determine_initial_node_prompt
+    from backend.prompts import get_determine_initial_node_prompt, get_function_call_prompt
 
     old_carts = state["old_carts"]
 
@@ -162,25 +181,35 @@ def determine_initial_node(state:GraphsState):
     else:
         prompt = "prompt1"
 
+    tools = get_function_call_prompt(prompt)
+    allowed = tools[0]["function"]["parameters"]["properties"]["decision"]["enum"]
+
+    # Los turnos obvios (clave de compra, "quiero pagar", mensajes que nombran productos) no
+    # necesitan pasar por el LLM. Corre en un thread: la primera vez lee el catálogo y el log de
+    # decisiones del disco
+    next_node = await asyncio.to_thread(fast_route, input, key, allowed)
+    if next_node is not None:
+        print(f"fast route: {next_node}")
+        return next_node
+
     # prompt puede ser prompt1, prompt2, prompt3
     prompt_content= get_determine_initial_node_prompt(prompt)
     system_prompt = SystemMessage(content=prompt_content)
 
-        # Create a simple model for decision (doesn't need tools)
-    decision_model = ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0,
-    )
+        # Simple model for decision (doesn't need tools)
+    decision_model = get_chat_model("gpt-4o-mini", temperature=0)
 
     recent_messages = state["messages"][-4:] if len(state["messages"]) > 4 else state["messages"]
     conversation = [system_prompt] + recent_messages
 
     decision = None
 
-    from backend.prompts import get_function_call_prompt
-    tools = get_function_call_prompt(prompt) 
+    # Modo especulativo: el modelo de compras arranca mientras el router decide
+    speculative = speculation.enabled() and "shopping" in allowed
+    if speculative:
+        speculation.start(state, _invoke_shopping_model(state), prefetch=_prefetch_lookups)
 
-    response = decision_model.invoke(
+    response = await decision_model.ainvoke(
         conversation, 
         tools = tools,
         tool_choice={"type": "function", "function": {"name": "determine_next_node"}}  # Added tool_choice
@@ -192,14 +221,22 @@ def determine_initial_node(state:GraphsState):
         function_args = tool_calls[0].get('function', {}).get('arguments', '{}')
         decision = json.loads(function_args).get('decision')
         print(f"decision: {decision}")
+        await asyncio.to_thread(record_decision, input, decision, prompt)
+        if speculative and decision != "shopping":
+            speculation.cancel(state)
         if decision == "shopping":
             return "modelNode"
         if decision =="long":
             return "add_preferences"
         if decision == "end":
             return "create_key"
+        if decision == "reorder":
+            return "reorder_last_cart"
+
+    if speculative:
+        speculation.cancel(state)
 
-def add_preferences(state: GraphsState):
+async def add_preferences(state: GraphsState):
     """
     Node that handles saving user preferences and manages preference-related conversation.
     Returns to shopping node once preferences are collected.
@@ -243,34 +280,51 @@ def add_preferences(state: GraphsState):
 
     ''')
 
-    preferences_model = ChatOpenAI(
-        model = "gpt-4o-mini",
-        temperature=0.7
-    ).bind_tools([save_to_memory])
+    preferences_model = get_chat_model("gpt-4o-mini", temperature=0.7, tools=[save_to_memory])
 
     conversation = [system_prompt] + state["messages"]
-    response = preferences_model.invoke(conversation)
+    response = await preferences_model.ainvoke(conversation)
 
     return {"messages": [response], "preferences": state["preferences"]}
 
 from backend.prompts import get_shopping_assistant_prompt 
 
-# Core invocation of the model
-def _call_model(state: GraphsState):
+def _shopping_conversation(state: GraphsState):
     user_id = state["user_id"]
     user_preferences = state["preferences"]
     summaries= state["summaries"]
-    old_carts= state["old_carts"][-1] if state["old_carts"] else ""
+    # old_carts viene con el último carrito completado primero
+    old_carts = cart_ops.format_cart(state["old_carts"][0]["cart_items"], links=False) if state["old_carts"] else ""
 
     prompt_content = get_shopping_assistant_prompt(
         user_preferences=user_preferences,
         user_id=user_id,
         summaries=summaries,
         old_carts=old_carts,
+        cart=cart_ops.format_cart(state.get("cart") or [], links=False),
     )
     system_prompt = SystemMessage(content=prompt_content)
-    conversation = [system_prompt] + state["messages"][-20:] 
-    response = llm.invoke(conversation)
+    return [system_prompt] + state["messages"][-20:]
+
+async def _invoke_shopping_model(state: GraphsState):
+    llm = get_chat_model("gpt-4o-mini", tools=tools)
+    return await llm.ainvoke(_shopping_conversation(state))
+
+def _prefetch_lookups(response):
+    # Las búsquedas que pidió la respuesta especulativa (no los cambios al carrito);
+    # handle_shopping_tools después las encuentra en el cache de resultados (o se suma a la que
+    # todavía está en curso)
+    return [
+        tools_by_name[tool_call["name"]].ainvoke(tool_call["args"])
+        for tool_call in response.tool_calls
+        if tool_call["name"] in tools_by_name
+    ]
+
+# Core invocation of the model
+async def _call_model(state: GraphsState):
+    response = await speculation.take(state)
+    if response is None:
+        response = await _invoke_shopping_model(state)
     # If it has tool_calls, return the response directly. I need all the answer because it has the tool call name.
     if hasattr(response, 'tool_calls') and response.tool_calls:
         return {
@@ -278,86 +332,66 @@ def _call_model(state: GraphsState):
         }
     
     else:
-        return {"messages": [AIMessage(content=response.content)]}
+        # El modelo cita los productos por handle: en la respuesta van los links
+        return {"messages": [AIMessage(content=product_table.rehydrate(response.content))]}
 
-def create_summary_node(state: GraphsState):
-    """Node that handles completing the purchase"""
+async def reorder_last_cart(state: GraphsState):
+    """Node that fills the cart with the last completed cart, refreshed against the current catalog"""
+    from backend import reorder
 
-    from backend.db import complete_cart, change_messages_status
-    complete_cart(state["user_id"])
-    make_summary(state["user_id"]) #el summary lo hago con los en proceso, y luego los cambio a completado
-    change_messages_status(state["user_id"]) # con esto pongo status en completado.
+    # old_carts viene con el último carrito completado primero
+    last_cart = state["old_carts"][0]["cart_items"] if state["old_carts"] else []
+    refreshed = await reorder.refresh_items(last_cart)
+    cart = reorder.merge_into(state.get("cart") or [], refreshed.items)
 
     return {
-            "messages": [''],
+        "messages": [AIMessage(content=reorder.reorder_message(cart, refreshed))],
+        "cart": cart,
     }
 
-def complete_purchase(state: GraphsState):
-    model = ChatOpenAI(
-        model = "gpt-4o-mini",
-        model_kwargs={"response_format": {"type": "json_object"}}
-    )
+async def create_summary_node(state: GraphsState):
+    """Node that handles completing the purchase"""
 
+    from backend.async_db import complete_cart, change_messages_status, load_cart, save_cart_changes
+    from backend.cart_store import diff
+    from backend.summarizer import reset_summary
+    # El carrito del estado es el que se compra: se guarda lo que cambió y se marca como completado
+    await save_cart_changes(state["user_id"], diff(await load_cart(state["user_id"]), state.get("cart") or []))
+    await complete_cart(state["user_id"])
+    await make_summary(state["user_id"]) #el summary lo hago con los en proceso, y luego los cambio a completado
+    await change_messages_status(state["user_id"]) # con esto pongo status en completado.
+    # Recién con los mensajes completados: una actualización en background que termine después
+    # ya no puede volver a crear el resumen
+    await reset_summary(state["user_id"])
 
-    system_message= SystemMessage(content=f"""
-    Genera el carrito de compras en formato JSON. 
-    El JSON debe incluir los siguientes campos para cada producto: 
-    SIMPRE PONER EL CARRITO
-    - nombre
-    - precio
-    - link
-
-    Ejemplo de formato JSON: 
-    {{"carrito": [ 
-        {{
-            "nombre": "Producto 1",
-            "precio": 10.99,
-            "link": "http://ejemplo.com/producto1"
-        }},
-        {{
-            "nombre": "Producto 2",
-            "precio": 5.49,
-            "link": "http://ejemplo.com/producto2"
-        }}
-        ]
-    }}
-
-    Genera la respuesta en formato json.
-
-    """)
-
-   # Invocar el modelo para obtener el carrito en formato JSON
-    json_cart_response = model.invoke([system_message] + state["messages"][-20:])
-    json_cart = json_cart_response.content  # Suponiendo que el contenido es el JSON generado
-
-    import json
-    json_cart = json.loads(json_cart)
-    json_cart = json.dumps(json_cart)
-
-    print(json_cart)
-
-    from backend.db import save_cart
-    save_cart(state["user_id"], json_cart)
-
-    model = ChatOpenAI(
-        model = "gpt-4o-mini"
-    )
-    system_message = SystemMessage(content="""
-    La compra se ha completado con éxito. 
-    Genera un mensaje amable agradeciendo al usuario por su compra y despidiéndote.
-                                   """)
+    return {
+            "messages": [''],
+    }
 
-    response = model.invoke([system_message])
+async def complete_purchase(state: GraphsState):
+    # El carrito ya quedó guardado como completado en create_summary: no hace falta pedirle al
+    # LLM que lo reconstruya en JSON ni que escriba la despedida
+    cart = state.get("cart") or []
+
+    if cart:
+        content = (
+            f"¡Listo! Tu compra de {sum(item['cantidad'] for item in cart)} productos por un total de "
+            f"{cart_ops.format_price(cart_ops.total(cart))} se completó con éxito. "
+            "¡Muchas gracias por comprar con frizbee, que la disfrutes! 🛒"
+        )
+    else:
+        content = "Tu carrito estaba vacío, así que no se realizó ninguna compra. ¡Cuando quieras armamos uno nuevo!"
 
-    from backend.db import update_key
-    update_key(state["user_id"], "")
+    from backend.async_db import update_key
+    await update_key(state["user_id"], "")
 
     return {
-            "messages": [response]
+            "messages": [AIMessage(content=content)],
+            "cart": [],
     }
 
 
-def make_summary(user_id):
+async def make_summary(user_id):
     """
     Retrieve user data from the database and generate a summary using AI.
     Args:
@@ -365,46 +399,18 @@ def make_summary(user_id):
     Returns:
         A summary of the user's data en la tabla ai_memory
     """
-    from backend.db import load_messages_en_proceso, add_summary_db
-    messages = load_messages_en_proceso(user_id)
+    from backend.async_db import add_summary_db
+    from backend.summarizer import update_summary
 
-    model = ChatOpenAI(
-        model = "gpt-4o-mini",
-        streaming=False
-    )
-
-    system_message = SystemMessage(content=f"""
-    Analiza la siguiente conversación entre un usuario y el asistente de compras de Jumbo:
-    Extrae ÚNICAMENTE las preferencias del usuario en formato bullet points.
-
-    Conversación:
-    {messages}
-
-    REGLAS:
-    - Un guión por preferencia
-    - Solo incluir preferencias alimenticias, de compra o restricciones
-    - Ser conciso y directo
-    - No incluir explicaciones ni texto adicional
-    - No incluir recomendaciones
-    
-    Formato de respuesta:
-    - preferencia 1
-    - preferencia 2
-    - etc.
-                                   """)
-
-    response = model.invoke([system_message])         
-    summary_content = response.content
-    summary_content = str(response.content).strip()
+    # El resumen se fue actualizando durante la conversación (backend/summarizer.py): acá solo
+    # se agregan los mensajes que faltan desde la última actualización
+    summary_content = await update_summary(user_id)
 
+    if summary_content:
+        await add_summary_db(user_id, summary_content) # añade el sumary a la base de datos
 
-    add_summary_db(user_id, summary_content) # añade el sumary a la base de datos
-
-def create_key(state: GraphsState):
-    model = ChatOpenAI(
-        model = "gpt-4o-mini",
-        streaming=True
-    )
+async def create_key(state: GraphsState):
+    model = get_chat_model("gpt-4o-mini", streaming=True)
 
     import random
 
@@ -425,14 +431,17 @@ def create_key(state: GraphsState):
     SIEMPRE USA EL CODIGO {random_number_string}, sin importar los codigos en mensajes anteriores.
 
     SIEMPRE DEBES MOSTRAR EL CARRITO QUE VA A COMPRAR EL USUARIO
+
+    Carrito actual (es el único que cuenta, con los precios y el total ya calculados):
+    {cart_ops.format_cart(state.get("cart") or [])}
                                    """)
 
     conversation = [system_message] + state["messages"][-20:]
-    response = model.invoke(conversation)
+    response = await model.ainvoke(conversation)
 
-    from backend.db import update_key 
+    from backend.async_db import update_key 
     
-    update_key(state["user_id"], random_number_string)
+    await update_key(state["user_id"], random_number_string)
 
     return {
             "messages": [response]
@@ -447,6 +456,7 @@ graph.add_node("add_preferences", add_preferences)
 graph.add_node("create_key", create_key)
 graph.add_node("create_summary", create_summary_node)
 graph.add_node("complete_purchase", complete_purchase)
+graph.add_node("reorder_last_cart", reorder_last_cart)
 
 # Add conditional logic to determine the next step based on the state (to continue or to end)
 graph.add_conditional_edges(
@@ -468,5 +478,6 @@ graph.add_edge("handle_shopping_tools", "modelNode")
 graph.add_edge("save_memory", "add_preferences")
 graph.add_edge("create_summary", "complete_purchase")
 graph.add_edge("complete_purchase", END)
+graph.add_edge("reorder_last_cart", END)
 # Compile the state graph into a runnable object
 graph_runnable = graph.compile()
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Database migrations
+
+Aplica en orden los archivos .sql de backend/migrations que todavía no se aplicaron y los
+registra en la tabla schema_migrations. Cada archivo corre en su propia transacción.
+
+Uso:
+    python -m backend.migrate
+"""
+import os
+
+from dotenv import load_dotenv
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def pending_migrations(applied):
+    return [
+        name for name in sorted(os.listdir(MIGRATIONS_DIR))
+        if name.endswith('.sql') and name not in applied
+    ]
+
+
+def migrate():
+    from backend.db import get_db_connection
+
+    with get_db_connection() as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        name TEXT PRIMARY KEY,
+                        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("SELECT name FROM schema_migrations")
+                applied = {row[0] for row in cur.fetchall()}
+            conn.commit()
+
+            for name in pending_migrations(applied):
+                with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                    sql = f.read()
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+                conn.commit()
+                print(f"applied {name}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    migrate()
@@ -0,0 +1,8 @@
+-- Historial por sesión con ventana (ORDER BY created_at DESC LIMIT n) y paginación keyset
+-- (created_at < cursor): los dos recorren este índice en vez de ordenar toda la sesión.
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created_at
+    ON chat_messages (session_id, created_at DESC);
+
+-- Mensajes en proceso de una sesión (resúmenes y cambio de estado al completar la compra)
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_status_created_at
+    ON chat_messages (session_id, status, created_at);
@@ -0,0 +1,24 @@
+-- Cola persistente de mensajes entrantes de WhatsApp (whatsapp_front/app/services/inbound_queue.py).
+-- msg_id es único: las re-entregas del webhook no se encolan dos veces. seq define el orden
+-- de procesamiento de los mensajes de cada usuario.
+CREATE TABLE IF NOT EXISTS inbound_messages (
+    seq BIGSERIAL PRIMARY KEY,
+    msg_id TEXT NOT NULL UNIQUE,
+    wa_id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    enqueued_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    lease_until TIMESTAMP,
+    completed_at TIMESTAMP
+);
+
+-- Mensajes sin terminar (pending / processing), en orden, para claim() y las métricas
+CREATE INDEX IF NOT EXISTS idx_inbound_messages_open
+    ON inbound_messages (status, seq) WHERE status IN ('pending', 'processing');
+
+-- Mensaje sin terminar más viejo de cada usuario
+CREATE INDEX IF NOT EXISTS idx_inbound_messages_wa_id_open
+    ON inbound_messages (wa_id, seq) WHERE status IN ('pending', 'processing');
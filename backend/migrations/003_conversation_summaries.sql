@@ -0,0 +1,9 @@
+-- Resumen incremental de la conversación en curso (backend/summarizer.py). last_summarized_at es
+-- la marca del último mensaje de chat_messages que ya está incluido en summary.
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    last_summarized_at TIMESTAMP,
+    summarized_messages INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,124 @@
+-- Carritos normalizados (backend/cart_store.py): una fila por carrito y una por producto, en vez
+-- de reescribir el JSONB entero de user_cart en cada cambio.
+CREATE TABLE IF NOT EXISTS carts (
+    cart_id BIGSERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'en_proceso',
+    -- Materializados por el trigger de cart_items
+    total NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS cart_items (
+    cart_id BIGINT NOT NULL REFERENCES carts (cart_id) ON DELETE CASCADE,
+    product_id TEXT NOT NULL,
+    nombre TEXT NOT NULL,
+    precio NUMERIC(12, 2) NOT NULL,
+    cantidad INTEGER NOT NULL CHECK (cantidad > 0),
+    link TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (cart_id, product_id)
+);
+
+-- Un solo carrito activo por usuario
+CREATE UNIQUE INDEX IF NOT EXISTS idx_carts_user_active
+    ON carts (user_id) WHERE status = 'en_proceso';
+
+-- Último carrito completado (y el historial de compras, para reordenar)
+CREATE INDEX IF NOT EXISTS idx_carts_user_completed
+    ON carts (user_id, completed_at DESC) WHERE status = 'completado';
+
+-- Producto en el historial de compras de todos los usuarios
+CREATE INDEX IF NOT EXISTS idx_cart_items_product_id
+    ON cart_items (product_id);
+
+-- total e item_count se actualizan con la diferencia de cada fila, sin recorrer el carrito
+CREATE OR REPLACE FUNCTION cart_items_update_total() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE carts
+        SET total = total - OLD.precio * OLD.cantidad,
+            item_count = item_count - OLD.cantidad,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE cart_id = OLD.cart_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE carts
+        SET total = total + NEW.precio * NEW.cantidad,
+            item_count = item_count + NEW.cantidad,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE cart_id = NEW.cart_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cart_items_total ON cart_items;
+CREATE TRIGGER cart_items_total
+    AFTER INSERT OR UPDATE OR DELETE ON cart_items
+    FOR EACH ROW EXECUTE FUNCTION cart_items_update_total();
+
+-- Backfill desde user_cart: todos los carritos completados y el último activo de cada usuario.
+-- cart_items puede ser una lista o {"carrito": [...]}. Los items viejos no tienen product_id: se
+-- calcula igual que catalog.product_id (sha1 del link normalizado, 16 caracteres), así coinciden
+-- con el índice de búsqueda. Los precios en texto se leen como cart.parse_price (punto de miles,
+-- coma decimal) y un mismo producto repetido en un carrito se junta en una fila.
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+DO $$
+DECLARE
+    r RECORD;
+    new_cart_id BIGINT;
+BEGIN
+    FOR r IN
+        SELECT * FROM (
+            SELECT user_id, cart_items, status, created_at, updated_at FROM user_cart
+            WHERE status = 'completado'
+            UNION ALL
+            (SELECT DISTINCT ON (user_id) user_id, cart_items, status, created_at, updated_at FROM user_cart
+             WHERE status = 'en_proceso'
+             ORDER BY user_id, updated_at DESC)
+        ) legacy
+        ORDER BY created_at
+    LOOP
+        INSERT INTO carts (user_id, status, created_at, updated_at, completed_at)
+        VALUES (r.user_id, r.status, r.created_at, r.updated_at,
+                CASE WHEN r.status = 'completado' THEN r.updated_at END)
+        RETURNING cart_id INTO new_cart_id;
+
+        INSERT INTO cart_items (cart_id, product_id, nombre, precio, cantidad, link)
+        SELECT new_cart_id, product_id,
+               (array_agg(nombre ORDER BY position))[1],
+               (array_agg(precio ORDER BY position))[1],
+               SUM(cantidad),
+               (array_agg(link ORDER BY position))[1]
+        FROM (
+            SELECT position,
+                   COALESCE(
+                       item->>'product_id',
+                       left(encode(digest(rtrim(lower(btrim(item->>'link', E' \t\r\n')), '/'), 'sha1'), 'hex'), 16)
+                   ) AS product_id,
+                   COALESCE(item->>'nombre', '') AS nombre,
+                   CASE
+                       WHEN jsonb_typeof(item->'precio') = 'number' THEN (item->>'precio')::numeric
+                       WHEN price_text ~ '^[0-9]+(,[0-9]+)?$' THEN replace(price_text, ',', '.')::numeric
+                       ELSE 0
+                   END AS precio,
+                   CASE WHEN item->>'cantidad' ~ '^[0-9]+$' AND (item->>'cantidad')::int > 0
+                        THEN (item->>'cantidad')::int ELSE 1 END AS cantidad,
+                   item->>'link' AS link
+            FROM jsonb_array_elements(
+                CASE WHEN jsonb_typeof(r.cart_items) = 'object' THEN COALESCE(r.cart_items->'carrito', '[]'::jsonb)
+                     ELSE r.cart_items END
+            ) WITH ORDINALITY AS items (item, position),
+            LATERAL (SELECT regexp_replace(item->>'precio', '[^0-9,]', '', 'g') AS price_text) price
+            WHERE item->>'link' IS NOT NULL
+        ) parsed
+        GROUP BY product_id;
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,9 @@
+-- Desempate para la paginación keyset y la marca del resumen: varios mensajes pueden tener el
+-- mismo created_at, así que los cursores son (created_at, id). Si la tabla ya tiene id, no cambia.
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created_at_id
+    ON chat_messages (session_id, created_at, id);
+
+-- Reemplazado por el índice de arriba (se recorre igual hacia atrás)
+DROP INDEX IF EXISTS idx_chat_messages_session_created_at;
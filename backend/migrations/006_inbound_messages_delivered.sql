@@ -0,0 +1,3 @@
+-- Cuántos caracteres de la respuesta ya se mandaron al usuario. Si falla el envío, el reintento
+-- del job solo manda lo que falta (la respuesta ya está en chat_messages, no se vuelve a generar).
+ALTER TABLE inbound_messages ADD COLUMN IF NOT EXISTS delivered INTEGER NOT NULL DEFAULT 0;
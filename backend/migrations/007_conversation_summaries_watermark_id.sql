@@ -0,0 +1,12 @@
+-- La marca del resumen pasa a ser (last_summarized_at, last_summarized_id), igual que la
+-- paginación del historial: con solo created_at, los mensajes con el mismo timestamp que el
+-- último resumido se salteaban.
+ALTER TABLE conversation_summaries ADD COLUMN IF NOT EXISTS last_summarized_id BIGINT;
+
+-- Con la marca vieja los mensajes con created_at = last_summarized_at ya no se resumían
+UPDATE conversation_summaries s
+SET last_summarized_id = (
+    SELECT MAX(m.id) FROM chat_messages m
+    WHERE m.session_id = s.session_id AND m.created_at = s.last_summarized_at
+)
+WHERE s.last_summarized_at IS NOT NULL AND s.last_summarized_id IS NULL;
@@ -0,0 +1,215 @@
+"""
+Chat model registry
+
+Los nodos del grafo creaban un ChatOpenAI nuevo en cada llamada, perdiendo la reutilización
+de conexiones HTTP. Acá se crea un solo cliente por configuración
+(modelo, temperatura, response_format, streaming, tools) y todos comparten el mismo pool de
+conexiones HTTP.
+
+- Las llamadas sync comparten un httpx.Client por proceso
+- Las llamadas async comparten un httpx.AsyncClient por event loop (los clientes async no se
+  pueden usar desde otro loop, y los frontends crean uno nuevo con asyncio.run). Antes de que
+  termine el loop hay que llamar a close_http_client(), igual que async_db.close_pool()
+- model_stats() devuelve latencia, llamadas, errores y tokens por configuración, y
+  pool_stats() el estado de los pools HTTP
+
+El tamaño del pool se configura con LLM_HTTP_MAX_CONNECTIONS y LLM_HTTP_MAX_KEEPALIVE.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+
+import httpx
+from langchain_openai import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_http_client = None
+_async_clients = {}
+_models = {}
+_stats = {}
+
+
+def http_limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 100)),
+        max_keepalive_connections=int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', 20)),
+    )
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = httpx.Client(limits=http_limits(), timeout=httpx.Timeout(60.0, connect=10.0))
+    return _http_client
+
+
+def get_async_http_client(loop):
+    client = _async_clients.get(loop)
+    if client is None:
+        with _lock:
+            # Los clientes de loops que ya se cerraron no se pueden reutilizar (ni cerrar con aclose)
+            for closed_loop in [l for l in _async_clients if l.is_closed()]:
+                logger.warning("Discarding the HTTP client of a closed event loop (close_http_client() was not called)")
+                _drop_loop(closed_loop)
+            client = _async_clients.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(limits=http_limits(), timeout=httpx.Timeout(60.0, connect=10.0))
+                _async_clients[loop] = client
+    return client
+
+
+def _drop_loop(loop):
+    for key in [k for k in _models if k[1] is loop]:
+        _models.pop(key)
+    return _async_clients.pop(loop, None)
+
+
+async def close_http_client():
+    """Close the async HTTP client of the running event loop (call it before the loop shuts down)"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _drop_loop(loop)
+    if client is not None:
+        await client.aclose()
+
+
+class LatencyStats(BaseCallbackHandler):
+    """Records latency, calls, errors and token usage of every call made with one configuration"""
+
+    run_inline = True
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_tokens = 0
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def _finish(self, run_id):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return None
+        return time.perf_counter() - started
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        elapsed = self._finish(run_id)
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        with self._lock:
+            self.calls += 1
+            self.total_tokens += usage.get('total_tokens', 0) or 0
+            if elapsed is not None:
+                self.total_latency += elapsed
+                self.max_latency = max(self.max_latency, elapsed)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'avg_latency': self.total_latency / self.calls if self.calls else 0.0,
+                'max_latency': self.max_latency,
+                'total_tokens': self.total_tokens,
+            }
+
+
+def _config_name(model, temperature, response_format, streaming, tools):
+    return json.dumps({
+        'model': model,
+        'temperature': temperature,
+        'response_format': response_format,
+        'streaming': streaming,
+        'tools': [tool.name for tool in tools] if tools else None,
+    }, sort_keys=True)
+
+
+def get_chat_model(model="gpt-4o-mini", temperature=None, response_format=None, streaming=False, tools=None):
+    """
+    Return the shared ChatOpenAI (already bound to `tools`, if given) for this configuration.
+    Inside an event loop the client uses that loop's pooled httpx.AsyncClient.
+    """
+    name = _config_name(model, temperature, response_format, streaming, tools)
+    loop = _running_loop()
+    key = (name, loop)
+
+    chat_model = _models.get(key)
+    if chat_model is not None:
+        return chat_model
+
+    kwargs = {
+        'model': model,
+        'streaming': streaming,
+        # Para tener usage_metadata también cuando la respuesta se streamea
+        'stream_usage': True,
+        'http_client': get_http_client(),
+    }
+    if loop is not None:
+        kwargs['http_async_client'] = get_async_http_client(loop)
+    if temperature is not None:
+        kwargs['temperature'] = temperature
+    if response_format is not None:
+        kwargs['model_kwargs'] = {'response_format': response_format}
+
+    with _lock:
+        stats = _stats.setdefault(name, LatencyStats(name))
+    kwargs['callbacks'] = [stats]
+
+    chat_model = ChatOpenAI(**kwargs)
+    if tools:
+        chat_model = chat_model.bind_tools(tools)
+
+    with _lock:
+        return _models.setdefault(key, chat_model)
+
+
+def model_stats():
+    return {name: stats.snapshot() for name, stats in _stats.items()}
+
+
+def _pool_connections(client):
+    # httpx no expone el pool públicamente; si cambia la implementación devolvemos None
+    pool = getattr(getattr(client, '_transport', None), '_pool', None)
+    connections = getattr(pool, 'connections', None)
+    return len(connections) if connections is not None else None
+
+
+def pool_stats():
+    limits = http_limits()
+    return {
+        'max_connections': limits.max_connections,
+        'max_keepalive_connections': limits.max_keepalive_connections,
+        'sync_connections': _pool_connections(_http_client) if _http_client is not None else 0,
+        'async_clients': len([l for l in _async_clients if not l.is_closed()]),
+        'async_connections': sum(
+            _pool_connections(client) or 0 for l, client in _async_clients.items() if not l.is_closed()
+        ),
+        'models': len(_models),
+    }
@@ -1,4 +1,4 @@
-def get_shopping_assistant_prompt(user_preferences, user_id, summaries, old_carts):
+def get_shopping_assistant_prompt(user_preferences, user_id, summaries, old_carts, cart=""):
     return f'''
 Eres un asistente de compras del supermercado Jumbo que ayuda a realizar la compra semanal. 
 Tu estas encargado de realizar el carrito de compras, mientras que otro agente está encargado de realizar el proceso de compra y de pagar.
@@ -9,6 +9,8 @@ Preferencias del usuario: {user_preferences}
 ID del usuario: {user_id}
 Ultimo carrito comprado: {old_carts}
 Resumen de conversaciones anteriores: {summaries}
+Carrito actual:
+{cart}
 
 Eres uno de los dos asistentes AI que trabajan juntos en frizbee para ayudar en el proceso de compras en el supermercado jumbo.
 Tu trabajo en particular es ayudar al usuario realizar esta compra solamente.
@@ -40,7 +42,7 @@ INSTRUCCIONES
 SECUENCIA OBLIGATORIA:
 1. Buscar → product_lookup_tool
 2. Verificar → ¿Producto encontrado?
-3. Si encontrado → lo puedes agregar al carrito
+3. Si encontrado → lo puedes agregar al carrito con add_product
 4. Si no encontrado → buscar alternativas
 
 EJEMPLOS DE BÚSQUEDAS:
@@ -49,6 +51,9 @@ EJEMPLOS DE BÚSQUEDAS:
 - product_lookup_tool("bebidas para deportistas")
 - product_lookup_tool("galletas sin azúcar")
 - product_lookup_tool("frutas frescas")
+- product_lookup_tool("vino tinto", max_price=8000) → si el usuario tiene un presupuesto
+- product_lookup_tool("yogur", min_discount=20, category="lacteos") → si busca ofertas
+- product_batch_lookup_tool(["harina", "huevos", "leche", "azúcar"]) → varios productos a la vez (receta, compra semanal)
 
 REGLAS IMPORTANTES:
 1. Adapta las preguntas según:
@@ -101,9 +106,15 @@ REGLAS IMPORTANTES:
 4. NUNCA inventes productos ni información
 5. No mostrar imágenes
 6. Cuando le muestres el carrito al usuario, SIEMPRE DEBES MOSTRAR EL NOMBRE, PRECIO, CANTIDAD, LINK PARA CADA PRODUCTO Y EL PRECIO  TOTAL. 
+7. Los productos vienen con un id entre corchetes, por ejemplo [p3f9a2c1b]. Para mostrar el link de un producto escribe su id entre corchetes tal cual: se reemplaza por el link automáticamente. Nunca inventes links.
 
 USO DE HERRAMIENTA:
 - product_lookup_tool: OBLIGATORIO antes de sugerir/agregar productos
+- product_batch_lookup_tool: cuando tengas que buscar varios productos distintos, búscalos todos en una sola llamada en vez de llamar varias veces a product_lookup_tool
+- add_product: para agregar al carrito un producto que devolvió product_lookup_tool (con su id, por ejemplo add_product("p3f9a2c1b", 2))
+- remove_product: para quitar un producto del carrito (con su id)
+- change_quantity: para cambiar la cantidad de un producto del carrito (con su id)
+- El carrito SOLO cambia con estas herramientas: si no las llamas, el producto no está en el carrito
 
 '''
 
@@ -155,8 +166,12 @@ def get_determine_initial_node_prompt(prompt):
     DEBES RESPONDER ÚNICAMENTE CON UNA DE ESTAS PALABRAS:
     - "shopping" (proceso de compra)
     - "end" (finalizar compra)
+    - "reorder" (repetir la última compra)
     
     REGLAS:
+    Responde "reorder" si:
+    - El usuario quiere repetir su última compra tal cual ("lo mismo que la vez pasada", "lo de siempre")
+
     Responde "shopping" si:
     - El usuario menciona productos específicos
     - Solicita buscar o agregar productos al carrito
@@ -178,6 +193,7 @@ def get_determine_initial_node_prompt(prompt):
     RESPONDE ÚNICAMENTE CON UNA DE ESTAS PALABRAS:
     - "shopping"
     - "end"
+    - "reorder"
     ''' 
    
    if prompt == 'prompt1':
@@ -189,7 +205,7 @@ def get_function_call_prompt(prompt):
    if prompt == 'prompt1':
       enum = ["shopping", "long", "end"]
    elif prompt == 'prompt2':
-      enum = ["shopping", "end"]
+      enum = ["shopping", "end", "reorder"]
 
    tools = [
       {
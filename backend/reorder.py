@@ -0,0 +1,111 @@
+"""
+Repeat last purchase
+
+Cuando el usuario pide "lo mismo que la última vez", el nodo reorder_last_cart arma el carrito a
+partir del último carrito completado sin pasar por el modelo de compras ni por product_lookup_tool:
+
+- Los productos se buscan por ID (catalog.product_id del link, el mismo ID que en el índice) con
+  un solo fetch al backend de búsqueda, sin embeddings ni queries vectoriales
+- Precio y descuento se actualizan con los del catálogo actual. El precio ya es el precio con
+  descuento; los descuentos y promociones vigentes se informan aparte (los carritos guardados
+  no tienen el descuento con el que se compró, así que se muestra el de hoy)
+- Los productos que ya no están en el índice se informan y no se agregan
+- Repetir el pedido dos veces deja el mismo carrito: las cantidades se fijan, no se suman
+"""
+import re
+import asyncio
+from dataclasses import dataclass, field
+
+from backend import cart as cart_ops
+from backend.tools.product_table import catalog_price
+from backend.tools.search_backends import get_search_backend
+
+
+@dataclass
+class Reorder:
+    items: list = field(default_factory=list)           # items del carrito con precios actuales
+    missing: list = field(default_factory=list)         # items que ya no están en el catálogo
+    price_changes: list = field(default_factory=list)   # (item, precio anterior)
+    discounts: list = field(default_factory=list)       # (item, descuento %, promoción) vigentes
+
+
+async def refresh_items(items):
+    """Resolve the items of an old cart against the current catalog in one batched fetch"""
+    ids = [item['product_id'] for item in items]
+    found = await asyncio.to_thread(get_search_backend().fetch, list(dict.fromkeys(ids)))
+
+    reorder = Reorder()
+    for item, _id in zip(items, ids):
+        metadata = found.get(_id)
+        if metadata is None:
+            reorder.missing.append(item)
+            continue
+        refreshed = {
+            'product_id': _id,
+            'nombre': metadata.get('product_name') or item['nombre'],
+            'precio': catalog_price(metadata),
+            'cantidad': item['cantidad'],
+            'link': metadata.get('link') or item['link'],
+        }
+        if round(refreshed['precio'], 2) != round(item['precio'], 2):
+            reorder.price_changes.append((refreshed, item['precio']))
+        discount, promotion = catalog_discount(metadata), metadata.get('promotion') or ''
+        if discount or promotion:
+            reorder.discounts.append((refreshed, discount, promotion))
+        reorder.items.append(refreshed)
+    return reorder
+
+
+def catalog_discount(metadata):
+    """Discount percentage of an index match (discount_pct, or the '-35%' text of old indexes)"""
+    if isinstance(metadata.get('discount_pct'), (int, float)):
+        return abs(int(metadata['discount_pct']))
+    match = re.fullmatch(r'-?(\d+)(?:[.,]\d+)?%?', str(metadata.get('discount_percentage', '')).strip())
+    return int(match.group(1)) if match else 0
+
+
+def merge_into(cart, items):
+    """
+    Put the items in the cart. Products that are already there get the quantity and price of the
+    reorder (not the sum), so asking twice does not double the cart
+    """
+    cart = [dict(item) for item in cart]
+    positions = {item['product_id']: i for i, item in enumerate(cart)}
+    for item in items:
+        i = positions.get(item['product_id'])
+        if i is None:
+            positions[item['product_id']] = len(cart)
+            cart.append(dict(item))
+        else:
+            cart[i].update(precio=item['precio'], cantidad=item['cantidad'])
+    return cart
+
+
+def reorder_message(cart, reorder):
+    if not reorder.items and not reorder.missing:
+        return ("No encontré una compra anterior para repetir. "
+                "¿Qué productos querés agregar a tu carrito?")
+    if not reorder.items:
+        lines = ["Ninguno de los productos de tu última compra está disponible ahora 😕"]
+    else:
+        lines = ["Armé tu carrito con los productos de tu última compra, con los precios de hoy:", "",
+                 cart_ops.format_cart(cart)]
+
+    if reorder.price_changes:
+        lines += ["", "Cambiaron de precio:"]
+        lines += [
+            f"- {item['nombre']}: {cart_ops.format_price(old)} → {cart_ops.format_price(item['precio'])}"
+            for item, old in reorder.price_changes
+        ]
+    if reorder.discounts:
+        lines += ["", "Hoy tienen descuento:"]
+        lines += [
+            f"- {item['nombre']}: " + " y ".join(filter(None, [f"{discount}% off" if discount else "", promotion]))
+            for item, discount, promotion in reorder.discounts
+        ]
+    if reorder.missing:
+        lines += ["", "Ya no están disponibles:"]
+        lines += [f"- {item['nombre']}" for item in reorder.missing]
+
+    lines += ["", "¿Querés agregar, cambiar o sacar algo, o finalizamos la compra?"]
+    return "\n".join(lines)
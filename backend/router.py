@@ -0,0 +1,311 @@
+"""
+Fast-path router for determine_initial_node
+
+Decide los turnos obvios sin llamar al LLM:
+- el mensaje es la clave de compra -> create_summary (ya existía)
+- frases explícitas de cierre ("quiero pagar", "finalizar la compra") -> create_key, salvo que
+  estén negadas ("todavía no quiero pagar") o sean una pregunta ("¿puedo pagar con tarjeta?")
+- el mensaje habla de alergias o dietas -> add_preferences (con cualquier prompt, antes de
+  mirar los productos, así "sin gluten por favor" se guarda como preferencia)
+- pedidos de repetir la última compra ("lo mismo que la vez pasada") -> reorder_last_cart
+- el mensaje menciona productos del catálogo -> modelNode. Solo cuentan los sustantivos de
+  producto (primera palabra del nombre), las subcategorías y las palabras que aparecen en al
+  menos ROUTER_MIN_PRODUCT_DF productos (marcas): "bueno" o "fiesta" aparecen en uno o dos
+  nombres y no alcanzan
+- un clasificador Naive Bayes entrenado con las decisiones que tomó el LLM antes
+  (ROUTER_LOG_PATH, una decisión por línea en JSON) cuando está muy seguro
+
+Si ninguna regla aplica con confianza se devuelve None y determine_initial_node usa el LLM,
+que además registra su decisión para entrenar el clasificador. router_stats() devuelve
+cuántas veces se usó cada camino.
+
+fast_route y record_decision leen y escriben archivos (catálogo, log de decisiones), así que
+desde código async se llaman con asyncio.to_thread.
+"""
+import os
+import re
+import json
+import math
+import threading
+import unicodedata
+from collections import Counter
+
+import pandas as pd
+
+DECISION_TO_NODE = {
+    "shopping": "modelNode",
+    "long": "add_preferences",
+    "end": "create_key",
+    "reorder": "reorder_last_cart",
+}
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'data_results.csv')
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'router_decisions.jsonl')
+
+CLASSIFIER_THRESHOLD = float(os.getenv('ROUTER_CLASSIFIER_THRESHOLD', 0.9))
+CLASSIFIER_MIN_SAMPLES = int(os.getenv('ROUTER_CLASSIFIER_MIN_SAMPLES', 200))
+MIN_PRODUCT_DF = int(os.getenv('ROUTER_MIN_PRODUCT_DF', 5))
+
+# Palabras que aparecen en nombres de productos pero no indican que el usuario pide un producto
+STOPWORDS = {
+    'de', 'del', 'la', 'las', 'el', 'los', 'con', 'sin', 'por', 'para', 'en', 'y', 'o', 'un', 'una',
+    'unos', 'unas', 'al', 'a', 'x', 'que', 'mas', 'muy', 'lo', 'le', 'les', 'me', 'mi', 'mis', 'tu',
+    'su', 'sus', 'es', 'son', 'si', 'no', 'hola', 'gracias', 'quiero', 'necesito', 'comprar', 'compra',
+    'carrito', 'bien', 'dale', 'ok', 'buenas', 'buen', 'dia', 'todo', 'nada', 'algo', 'otro', 'otra',
+    'gr', 'grs', 'kg', 'ml', 'cc', 'lt', 'lts', 'pack', 'unidad', 'unidades', 'clasico', 'clasica',
+    'original', 'natural', 'tipo', 'grande', 'chico', 'familiar', 'super', 'extra', 'light', 'nuevo',
+    'rico', 'rica', 'ricos', 'ricas', 'cosas', 'semana', 'semanal', 'casa', 'favor', 'gusta', 'tambien',
+    'soy', 'listo', 'lista', 'hoy', 'vez', 'ahora', 'fin', 'perfecto', 'genial', 'mejor',
+}
+
+CHECKOUT_PATTERNS = [
+    r'\b(finalizar|terminar|cerrar|completar|confirmar|concretar)\s+(la\s+|el\s+|mi\s+)?(compra|pedido|carrito)\b',
+    r'\b(quiero|voy\s+a)\s+pagar\b',
+    r'\b(listo|ya\s+esta|eso\s+es\s+todo)\s*,?\s*(finaliza|termina|cerra|confirma)',
+    r'^\s*(pagar|finalizar( compra)?|checkout)\s*[.!]*\s*$',
+]
+
+REORDER_PATTERNS = [
+    r'\b(repeti|repetir|repetime|repetirme|repeteme)\s+(la\s+|el\s+|mi\s+)?(ultim[oa]\s+)?(compra|pedido|carrito)',
+    r'\blo\s+mismo\s+(que\s+)?(la\s+)?(ultima\s+vez|vez\s+pasada|semana\s+pasada|de\s+siempre|de\s+la\s+otra\s+vez)\b',
+    r'\b(lo|la)\s+de\s+siempre\b',
+    r'\b(mismo|misma)\s+(compra|pedido|carrito)\s+(que\s+)?(la\s+)?(ultima|anterior|pasad[oa])',
+]
+
+# Un cierre negado o preguntado no es una confirmación: decide el LLM
+NEGATION_PATTERNS = [
+    r'\b(no|todavia\s+no|aun\s+no|ni)\b',
+]
+QUESTION_PATTERNS = [
+    r'\?',
+    r'\b(como|puedo|se\s+puede|donde|cuando|cuanto)\b',
+]
+
+# Alergias y dietas: van a add_preferences con cualquier prompt, para que se guarden
+DIETARY_PATTERNS = [
+    r'\b(soy|somos|es|son)\s+(vegetarian|vegan|celiac|diabetic|intolerante|alergic)',
+    r'\b(alergi|alergic[oa]s?\b|intoleran|celiac[oa]?s?\b|sin\s+tacc|sin\s+gluten|sin\s+lactosa|vegetarian|vegan[oa]?s?\b|diabet|kosher)',
+]
+
+# Otras preferencias personales: en el flujo de usuarios nuevos decide el LLM
+PREFERENCE_PATTERNS = [
+    r'\b(no\s+como|no\s+comemos|me\s+gusta|nos\s+gusta|prefiero|preferimos|odio|evito)\b',
+    r'\b(somos|vivimos)\s+\d+\b',
+]
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return re.findall(r'[a-zñ]+', normalize_text(text))
+
+
+def _singular(token):
+    if token.endswith('es') and len(token) > 4:
+        return token[:-2]
+    if token.endswith('s') and len(token) > 3:
+        return token[:-1]
+    return token
+
+
+class CatalogVocabulary:
+    """Words from product names and subcategories, used to detect product mentions"""
+
+    def __init__(self, path=None):
+        path = path or os.getenv('CATALOG_PATH') or DEFAULT_CATALOG_PATH
+        df = pd.read_csv(path, usecols=['product_name', 'sub_category'], dtype=str).fillna('')
+        text = df['product_name'].str.cat(df['sub_category'].str.replace('-', ' '), sep=' ')
+        words = Counter(token for line in text for token in set(tokenize(line)))
+        # Sustantivo de producto ("leche", "galletitas") y palabras de las subcategorías
+        nouns = {tokens[0] for tokens in map(tokenize, df['product_name']) if tokens}
+        nouns |= {token for line in df['sub_category'] for token in tokenize(line.replace('-', ' '))}
+        self.words = {
+            token for token, count in words.items()
+            if len(token) >= 3 and token not in STOPWORDS and (token in nouns or count >= MIN_PRODUCT_DF)
+        }
+        self.words |= {_singular(token) for token in self.words}
+
+    def product_mentions(self, text):
+        return [
+            token for token in tokenize(text)
+            if token not in STOPWORDS and (token in self.words or _singular(token) in self.words)
+        ]
+
+
+class DecisionClassifier:
+    """Multinomial Naive Bayes over the decisions the LLM router logged in the past"""
+
+    def __init__(self):
+        self.class_counts = Counter()
+        self.token_counts = {}
+        self.token_totals = Counter()
+        self.vocabulary = set()
+        self.samples = 0
+
+    def fit(self, rows):
+        for row in rows:
+            label = row['decision']
+            tokens = [t for t in tokenize(row['text']) if t not in STOPWORDS] or ['<vacio>']
+            self.class_counts[label] += 1
+            self.token_counts.setdefault(label, Counter()).update(tokens)
+            self.token_totals[label] += len(tokens)
+            self.vocabulary.update(tokens)
+            self.samples += 1
+        return self
+
+    def predict(self, text, allowed):
+        """Return (decision, probability) restricted to the allowed decisions"""
+        labels = [label for label in allowed if self.class_counts[label]]
+        if not labels:
+            return None, 0.0
+
+        tokens = [t for t in tokenize(text) if t not in STOPWORDS] or ['<vacio>']
+        vocabulary_size = len(self.vocabulary) + 1
+        total = sum(self.class_counts[label] for label in labels)
+        log_probs = {}
+        for label in labels:
+            log_prob = math.log(self.class_counts[label] / total)
+            counts = self.token_counts[label]
+            denominator = self.token_totals[label] + vocabulary_size
+            for token in tokens:
+                log_prob += math.log((counts[token] + 1) / denominator)
+            log_probs[label] = log_prob
+
+        best = max(log_probs, key=log_probs.get)
+        norm = sum(math.exp(lp - log_probs[best]) for lp in log_probs.values())
+        return best, 1.0 / norm
+
+
+_lock = threading.Lock()
+_vocabulary = None
+_classifier = None
+_classifier_offset = 0
+_stats = Counter()
+
+
+def get_vocabulary():
+    global _vocabulary
+    if _vocabulary is None:
+        with _lock:
+            if _vocabulary is None:
+                _vocabulary = CatalogVocabulary()
+    return _vocabulary
+
+
+def get_log_path():
+    return os.getenv('ROUTER_LOG_PATH') or DEFAULT_LOG_PATH
+
+
+def _read_rows(lines):
+    rows = []
+    for line in lines:
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return rows
+
+
+def get_classifier():
+    """
+    Return the classifier trained on the decision log. The log is append-only, so only the lines
+    added since the last call are read and added to the counts (it is retrained from scratch only
+    if the file was truncated or replaced)
+    """
+    global _classifier, _classifier_offset
+    path = get_log_path()
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return None
+
+    if _classifier is not None and size == _classifier_offset:
+        return _classifier
+
+    with _lock:
+        if _classifier is None or size < _classifier_offset:
+            _classifier, _classifier_offset = DecisionClassifier(), 0
+        with open(path, 'rb') as f:
+            f.seek(_classifier_offset)
+            data = f.read()
+        # Solo líneas completas: una línea a medio escribir se lee en la próxima llamada
+        end = data.rfind(b"\n") + 1
+        if end:
+            _classifier.fit(_read_rows(data[:end].decode('utf-8', errors='replace').splitlines()))
+            _classifier_offset += end
+    return _classifier
+
+
+def record_decision(text, decision, prompt):
+    """Append an LLM routing decision to the training log (get_classifier picks it up incrementally)"""
+    if not decision:
+        return
+    line = json.dumps({'text': text, 'decision': decision, 'prompt': prompt}, ensure_ascii=False)
+    with _lock:
+        with open(get_log_path(), 'a') as f:
+            f.write(line + "\n")
+
+
+def _count(path):
+    with _lock:
+        _stats[path] += 1
+
+
+def fast_route(text, key, allowed):
+    """
+    Return the next node for obvious turns, or None to fall back to the LLM router.
+    `allowed` are the decisions the LLM could take in this state ("shopping", "long", "end", "reorder").
+    """
+    if text != '' and text == key:
+        _count('key')
+        return "create_summary"
+
+    normalized = normalize_text(text)
+    is_checkout = any(re.search(pattern, normalized) for pattern in CHECKOUT_PATTERNS)
+    is_hesitant = any(re.search(pattern, normalized) for pattern in NEGATION_PATTERNS + QUESTION_PATTERNS)
+    if is_checkout and is_hesitant:
+        _count('llm')
+        return None
+
+    if any(re.search(pattern, normalized) for pattern in DIETARY_PATTERNS):
+        _count('preference')
+        return DECISION_TO_NODE["long"]
+
+    is_preference = any(re.search(pattern, normalized) for pattern in PREFERENCE_PATTERNS)
+
+    mentions = get_vocabulary().product_mentions(text)
+
+    if is_checkout and not mentions and "end" in allowed:
+        _count('checkout')
+        return DECISION_TO_NODE["end"]
+
+    is_reorder = any(re.search(pattern, normalized) for pattern in REORDER_PATTERNS)
+    if is_reorder and not is_checkout and not mentions and "reorder" in allowed:
+        _count('reorder')
+        return DECISION_TO_NODE["reorder"]
+
+    if mentions and not is_checkout and not (is_preference and "long" in allowed):
+        _count('catalog')
+        return DECISION_TO_NODE["shopping"]
+
+    classifier = get_classifier()
+    if classifier is not None and classifier.samples >= CLASSIFIER_MIN_SAMPLES:
+        decision, probability = classifier.predict(text, allowed)
+        if decision is not None and probability >= CLASSIFIER_THRESHOLD:
+            _count('classifier')
+            return DECISION_TO_NODE[decision]
+
+    _count('llm')
+    return None
+
+
+def router_stats():
+    with _lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    stats['total'] = total
+    stats['llm_rate'] = stats.get('llm', 0) / total if total else 0.0
+    return stats
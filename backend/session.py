@@ -0,0 +1,201 @@
+"""
+Session context
+
+Todo lo que el grafo necesita antes de empezar un turno (historial, preferencias, resúmenes,
+carritos anteriores, carrito activo y clave de compra) se trae con una sola query, en una sola
+conexión y una sola transacción. Opcionalmente la misma query guarda el mensaje nuevo del usuario.
+
+La query la usan load_session_context en backend/db.py (sync, Streamlit) y en
+backend/async_db.py (async, WhatsApp / nodos del grafo).
+"""
+import os
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from langchain_core.messages import AIMessage, HumanMessage, BaseMessage
+
+from backend.cart import from_json
+from backend.cart_store import CART_ITEM_JSON
+
+# Cuántos mensajes recientes se cargan por turno. _call_model usa los últimos 20 y
+# determine_initial_node los últimos 4, así que no tiene sentido traer todo el historial.
+HISTORY_WINDOW = int(os.getenv('HISTORY_WINDOW', 20))
+
+# Últimos N mensajes (LIMIT NULL = todos) en orden cronológico. Usa el índice
+# (session_id, created_at, id) de backend/migrations/005_chat_messages_keyset_id.sql; el id
+# desempata los mensajes con el mismo created_at
+CHAT_HISTORY_QUERY = """
+    SELECT role, content FROM (
+        SELECT role, content, created_at, id FROM chat_messages
+        WHERE session_id = %(session_id)s
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    ) recent
+    ORDER BY created_at, id
+"""
+
+# Paginación keyset para la vista de historial: la primera página no tiene cursor, las
+# siguientes piden los mensajes anteriores al (created_at, id) más viejo de la página anterior
+CHAT_HISTORY_FIRST_PAGE_QUERY = """
+    SELECT role, content, created_at, id FROM chat_messages
+    WHERE session_id = %(session_id)s
+    ORDER BY created_at DESC, id DESC
+    LIMIT %(limit)s
+"""
+CHAT_HISTORY_PAGE_QUERY = """
+    SELECT role, content, created_at, id FROM chat_messages
+    WHERE session_id = %(session_id)s AND (created_at, id) < (%(before)s, %(before_id)s)
+    ORDER BY created_at DESC, id DESC
+    LIMIT %(limit)s
+"""
+
+
+def history_page_query(session_id, before, page_size):
+    """`before` is the cursor returned by history_page: (created_at, id) or None for the first page"""
+    if before is None:
+        return CHAT_HISTORY_FIRST_PAGE_QUERY, {'session_id': session_id, 'limit': page_size}
+    before_ts, before_id = before
+    params = {'session_id': session_id, 'before': before_ts, 'before_id': before_id, 'limit': page_size}
+    return CHAT_HISTORY_PAGE_QUERY, params
+
+
+def to_messages(rows):
+    return [
+        AIMessage(content=msg['content']) if msg['role'] == 'assistant'
+        else HumanMessage(content=msg['content'])
+        for msg in rows
+    ]
+
+
+def history_page(rows, page_size):
+    """Turn a DESC page of rows into (messages in chronological order, cursor for the previous page)"""
+    rows = list(reversed(rows))
+    next_cursor = (rows[0]['created_at'], rows[0]['id']) if len(rows) == page_size else None
+    return to_messages(rows), next_cursor
+
+
+# chat_messages.created_at siempre sale del reloj de la base (clock_timestamp(), también en
+# save_message), así el orden del historial y la marca del resumen no mezclan dos relojes.
+# Los CTE que modifican datos se ejecutan siempre, pero sus filas no son visibles para los
+# SELECT del mismo statement: el historial devuelto NO incluye el mensaje que se está guardando.
+SESSION_CONTEXT_QUERY = f"""
+    WITH new_message AS (
+        INSERT INTO chat_messages (session_id, role, content, created_at, status, msg_id)
+        SELECT %(user_id)s, 'user', %(content)s::text, clock_timestamp(), 'en_proceso', %(msg_id)s::text
+        WHERE %(content)s::text IS NOT NULL
+        RETURNING 1
+    ),
+    new_preferences AS (
+        INSERT INTO ai_memory (user_id, content, type, created_at, updated_at)
+        SELECT %(user_id)s, '', 'preferences', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        WHERE NOT EXISTS (
+            SELECT 1 FROM ai_memory WHERE user_id = %(user_id)s AND type = 'preferences'
+        )
+        RETURNING content
+    ),
+    new_key AS (
+        INSERT INTO keys (user_id, key, created_at, updated_at)
+        SELECT %(user_id)s, '', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        WHERE NOT EXISTS (SELECT 1 FROM keys WHERE user_id = %(user_id)s)
+        RETURNING key
+    )
+    SELECT
+        (SELECT COALESCE(json_agg(json_build_object('role', role, 'content', content)
+                                  ORDER BY created_at, id), '[]'::json)
+           FROM (SELECT role, content, created_at, id FROM chat_messages
+                  WHERE session_id = %(user_id)s
+                  ORDER BY created_at DESC, id DESC
+                  LIMIT %(history_limit)s) recent) AS history,
+        COALESCE(
+            (SELECT content FROM ai_memory
+              WHERE user_id = %(user_id)s AND type = 'preferences'
+              ORDER BY created_at DESC LIMIT 1),
+            (SELECT content FROM new_preferences)
+        ) AS preferences,
+        (SELECT COALESCE(json_agg(json_build_object('content', content, 'created_at', created_at)
+                                  ORDER BY created_at DESC), '[]'::json)
+           FROM ai_memory
+          WHERE user_id = %(user_id)s AND type = 'summary') AS summaries,
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'cart_id', c.cart_id, 'total', c.total, 'item_count', c.item_count,
+                    'completed_at', c.completed_at,
+                    'items', (SELECT COALESCE(json_agg({CART_ITEM_JSON} ORDER BY i.created_at), '[]'::json)
+                                FROM cart_items i WHERE i.cart_id = c.cart_id))), '[]'::json)
+           FROM (SELECT cart_id, total, item_count, completed_at FROM carts
+                  WHERE user_id = %(user_id)s AND status = 'completado' AND item_count > 0
+                  ORDER BY completed_at DESC
+                  LIMIT 1) c) AS old_carts,
+        (SELECT COALESCE(json_agg({CART_ITEM_JSON} ORDER BY i.created_at), '[]'::json)
+           FROM carts c
+           JOIN cart_items i ON i.cart_id = c.cart_id
+          WHERE c.user_id = %(user_id)s AND c.status = 'en_proceso') AS cart,
+        COALESCE(
+            (SELECT key FROM keys WHERE user_id = %(user_id)s LIMIT 1),
+            (SELECT key FROM new_key)
+        ) AS key,
+        (SELECT COUNT(*) FROM new_message) AS saved_messages
+"""
+
+
+def session_context_params(user_id, content=None, msg_id=None, history_limit=HISTORY_WINDOW):
+    return {'user_id': user_id, 'content': content, 'msg_id': msg_id, 'history_limit': history_limit}
+
+
+def _json(value):
+    # psycopg2 y psycopg 3 ya decodifican json, pero por las dudas aceptamos strings
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+
+
+@dataclass
+class SessionContext:
+    user_id: str
+    messages: list[BaseMessage] = field(default_factory=list)
+    preferences: str = ''
+    summaries: list[dict] = field(default_factory=list)
+    old_carts: list[dict] = field(default_factory=list)
+    cart: list = field(default_factory=list)
+    key: str = ''
+
+    @classmethod
+    def from_row(cls, user_id, row):
+        return cls(
+            user_id=user_id,
+            messages=to_messages(_json(row['history']) or []),
+            preferences=row['preferences'] or '',
+            summaries=[
+                {'content': summary['content'], 'created_at': _timestamp(summary['created_at'])}
+                for summary in _json(row['summaries']) or []
+            ],
+            old_carts=[
+                {
+                    'cart_id': cart['cart_id'],
+                    'cart_items': from_json(cart['items']),
+                    'total': float(cart['total']),
+                    'item_count': cart['item_count'],
+                    'completed_at': _timestamp(cart['completed_at']),
+                }
+                for cart in _json(row['old_carts']) or []
+            ],
+            cart=from_json(_json(row['cart'])),
+            key=row['key'] or '',
+        )
+
+    def to_state(self, new_messages=None):
+        """Build the input state of graph_runnable, optionally appending the new user messages"""
+        return {
+            "messages": self.messages + list(new_messages or []),
+            "user_id": self.user_id,
+            "preferences": self.preferences,
+            "summaries": self.summaries,
+            "old_carts": self.old_carts,
+            "key": {"key": self.key},
+            "cart": self.cart,
+        }
@@ -0,0 +1,146 @@
+"""
+Speculative execution of the shopping model
+
+determine_initial_node tiene que terminar su llamada al LLM antes de que empiece _call_model,
+así que las dos latencias se suman. Como "shopping" es por lejos la decisión más común, con
+SPECULATIVE_ROUTING=1 la primera llamada de _call_model arranca en paralelo con el router
+(y, apenas el modelo pide product_lookup_tool, también esas búsquedas, que quedan en el
+cache de resultados). Si el router decide "shopping" _call_model usa la respuesta
+especulativa; si decide otra cosa se cancela.
+
+speculation_stats() devuelve el tiempo ahorrado y los tokens desperdiciados en ramas
+descartadas. Las ramas canceladas antes de terminar no reportan tokens (OpenAI igual cobra
+el prompt), por eso se cuentan aparte en cancelled_in_flight. errors cuenta las ramas que
+fallaron (se usen o no) y prefetch_errors las búsquedas anticipadas que fallaron.
+"""
+import os
+import time
+import asyncio
+import threading
+
+_lock = threading.Lock()
+_branches = {}
+_stats = {
+    'started': 0,
+    'used': 0,
+    'discarded': 0,
+    'cancelled_in_flight': 0,
+    'errors': 0,
+    'prefetch_errors': 0,
+    'time_saved': 0.0,
+    'wasted_tokens': 0,
+}
+
+
+def enabled():
+    return os.getenv('SPECULATIVE_ROUTING', '0') == '1'
+
+
+def branch_key(state):
+    """Identifies the turn: the branch is only valid for exactly the state it was started with"""
+    last = state["messages"][-1].content if state["messages"] else ''
+    return (asyncio.get_running_loop(), state["user_id"], len(state["messages"]), last)
+
+
+class Branch:
+    def __init__(self, coro, prefetch=None):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.prefetch_tasks = []
+        self._prefetch = prefetch
+        self.task = asyncio.create_task(self._run(coro))
+        self.task.add_done_callback(_record_error('errors'))
+
+    async def _run(self, coro):
+        response = await coro
+        self.finished = time.perf_counter()
+        if self._prefetch is not None:
+            self.prefetch_tasks = [asyncio.create_task(c) for c in self._prefetch(response)]
+            for task in self.prefetch_tasks:
+                task.add_done_callback(_record_error('prefetch_errors'))
+        return response
+
+    def cancel(self):
+        self.task.cancel()
+        for task in self.prefetch_tasks:
+            task.cancel()
+
+
+def _add(name, value=1):
+    with _lock:
+        _stats[name] += value
+
+
+def _record_error(name):
+    """
+    Done callback: retrieves the exception of a task nobody may await (a discarded branch), so
+    asyncio does not log "Task exception was never retrieved", and counts it
+    """
+    def callback(task):
+        if not task.cancelled() and task.exception() is not None:
+            _add(name)
+    return callback
+
+
+def _tokens(response):
+    usage = getattr(response, 'usage_metadata', None) or {}
+    return usage.get('total_tokens', 0) or 0
+
+
+def start(state, coro, prefetch=None):
+    """
+    Start `coro` (the shopping model call for this state) in the background.
+    `prefetch(response)` may return coroutines to run as soon as the response arrives.
+    """
+    key = branch_key(state)
+    with _lock:
+        # Ramas de loops que ya se cerraron (p. ej. el grafo falló antes de usarlas)
+        for stale in [k for k in _branches if k[0].is_closed()]:
+            _branches.pop(stale)
+    previous = _branches.pop(key, None)
+    if previous is not None:
+        previous.cancel()
+    _branches[key] = Branch(coro, prefetch)
+    _add('started')
+
+
+async def take(state):
+    """Return the speculative response for this state, or None if there is none (or it failed)"""
+    branch = _branches.pop(branch_key(state), None)
+    if branch is None:
+        return None
+
+    # Lo que la rama ya corrió mientras el router decidía es tiempo ahorrado
+    saved = (branch.finished or time.perf_counter()) - branch.started
+    try:
+        response = await branch.task
+    except Exception as e:
+        # El done callback ya la contó en errors
+        print(f"speculative branch failed: {e}")
+        return None
+
+    _add('used')
+    _add('time_saved', saved)
+    return response
+
+
+def cancel(state):
+    """Discard the speculative branch of this state (the router did not choose shopping)"""
+    branch = _branches.pop(branch_key(state), None)
+    if branch is None:
+        return
+
+    _add('discarded')
+    if branch.task.done() and not branch.task.cancelled() and branch.task.exception() is None:
+        _add('wasted_tokens', _tokens(branch.task.result()))
+    else:
+        _add('cancelled_in_flight')
+    branch.cancel()
+
+
+def speculation_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats['avg_time_saved'] = stats['time_saved'] / stats['used'] if stats['used'] else 0.0
+    stats['hit_rate'] = stats['used'] / stats['started'] if stats['started'] else 0.0
+    return stats
@@ -0,0 +1,186 @@
+"""
+Rolling conversation summarizer
+
+Antes make_summary cargaba todos los mensajes en_proceso y hacía una sola llamada grande al
+LLM en el checkout. Ahora se mantiene un resumen que se va actualizando:
+
+- conversation_summaries guarda por sesión el resumen actual y la marca (last_summarized_at,
+  last_summarized_id) del último mensaje incluido (backend/migrations/003 y 007)
+- Después de cada turno schedule(session_id) actualiza el resumen en background cuando hay al
+  menos SUMMARY_EVERY_N mensajes nuevos desde la marca
+- Cada actualización solo le pasa al LLM el resumen anterior y los mensajes nuevos (de a
+  SUMMARY_MAX_BATCH), así el prompt no crece con la sesión
+- En el checkout make_summary solo agrega la cola que falta y guarda el resultado. Los mensajes
+  se marcan como completados antes de borrar el resumen, así una actualización en background
+  que termina tarde no lo vuelve a crear (SAVE_QUERY exige mensajes en proceso)
+
+Las actualizaciones en background corren en un event loop propio (un thread), así funcionan
+igual desde Streamlit (asyncio.run por turno) que desde el dispatcher de WhatsApp.
+"""
+import os
+import asyncio
+import logging
+import threading
+
+from langchain_core.messages import SystemMessage
+
+from backend import async_db
+from backend.models import get_chat_model
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_EVERY_N = int(os.getenv('SUMMARY_EVERY_N', 10))
+SUMMARY_MAX_BATCH = int(os.getenv('SUMMARY_MAX_BATCH', 50))
+
+# Mensajes en proceso posteriores a la marca (created_at, id), en orden
+AFTER_WATERMARK = """
+      AND (%(after_at)s::timestamp IS NULL
+           OR (created_at, id) > (%(after_at)s::timestamp, %(after_id)s::bigint))
+"""
+
+TAIL_QUERY = f"""
+    SELECT id, role, content, created_at FROM chat_messages
+    WHERE session_id = %(session_id)s AND status = 'en_proceso'{AFTER_WATERMARK}
+    ORDER BY created_at, id
+    LIMIT %(limit)s
+"""
+
+# Solo se guarda si los mensajes resumidos siguen en proceso (si la compra ya se cerró, una
+# actualización que llega tarde no tiene que volver a crear el resumen) y si la marca avanza
+SAVE_QUERY = """
+    INSERT INTO conversation_summaries
+        (session_id, summary, last_summarized_at, last_summarized_id, summarized_messages, updated_at)
+    SELECT %(session_id)s, %(summary)s, %(watermark_at)s, %(watermark_id)s, %(count)s, CURRENT_TIMESTAMP
+    WHERE EXISTS (
+        SELECT 1 FROM chat_messages
+        WHERE session_id = %(session_id)s AND status = 'en_proceso' AND id = %(watermark_id)s
+    )
+    ON CONFLICT (session_id) DO UPDATE
+    SET summary = EXCLUDED.summary,
+        last_summarized_at = EXCLUDED.last_summarized_at,
+        last_summarized_id = EXCLUDED.last_summarized_id,
+        summarized_messages = conversation_summaries.summarized_messages + EXCLUDED.summarized_messages,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE conversation_summaries.last_summarized_at IS NULL
+       OR (conversation_summaries.last_summarized_at, COALESCE(conversation_summaries.last_summarized_id, 0))
+          < (EXCLUDED.last_summarized_at, EXCLUDED.last_summarized_id)
+"""
+
+
+def summary_prompt(summary, messages):
+    conversation = "\n".join(
+        f"{'asistente' if message['role'] == 'assistant' else 'usuario'}: {message['content']}"
+        for message in messages
+    )
+    return f"""
+    Analiza la siguiente conversación entre un usuario y el asistente de compras de Jumbo:
+    Extrae ÚNICAMENTE las preferencias del usuario en formato bullet points.
+
+    Preferencias ya extraídas de la parte anterior de la conversación:
+    {summary or '(ninguna)'}
+
+    Mensajes nuevos:
+    {conversation}
+
+    REGLAS:
+    - Devuelve la lista completa: las preferencias anteriores más las nuevas
+    - Si un mensaje nuevo contradice una preferencia anterior, quédate con la nueva
+    - Un guión por preferencia
+    - Solo incluir preferencias alimenticias, de compra o restricciones
+    - Ser conciso y directo
+    - No incluir explicaciones ni texto adicional
+    - No incluir recomendaciones
+
+    Formato de respuesta:
+    - preferencia 1
+    - preferencia 2
+    - etc.
+    """
+
+
+async def load_summary(session_id):
+    """Return (summary, watermark) of the session. The watermark is (created_at, id), or None"""
+    row = await async_db.fetchone("""
+        SELECT summary, last_summarized_at, last_summarized_id FROM conversation_summaries
+        WHERE session_id = %s
+    """, (session_id,))
+    if row is None or row['last_summarized_at'] is None:
+        return (row['summary'] if row else ''), None
+    return row['summary'], (row['last_summarized_at'], row['last_summarized_id'] or 0)
+
+
+def _after(watermark):
+    after_at, after_id = watermark or (None, None)
+    return {'after_at': after_at, 'after_id': after_id}
+
+
+async def count_pending(session_id, watermark):
+    row = await async_db.fetchone(f"""
+        SELECT COUNT(*) AS pending FROM chat_messages
+        WHERE session_id = %(session_id)s AND status = 'en_proceso'{AFTER_WATERMARK}
+    """, {'session_id': session_id, **_after(watermark)})
+    return row['pending']
+
+
+async def update_summary(session_id, min_messages=1):
+    """
+    Fold the messages after the watermark into the running summary.
+    Does nothing if there are fewer than min_messages new messages. Returns the summary.
+    """
+    summary, watermark = await load_summary(session_id)
+    if await count_pending(session_id, watermark) < min_messages:
+        return summary
+
+    model = get_chat_model("gpt-4o-mini", streaming=False)
+    while True:
+        messages = await async_db.fetchall(TAIL_QUERY, {
+            'session_id': session_id, 'limit': SUMMARY_MAX_BATCH, **_after(watermark),
+        })
+        if not messages:
+            return summary
+
+        response = await model.ainvoke([SystemMessage(content=summary_prompt(summary, messages))])
+        summary = str(response.content).strip()
+        watermark = (messages[-1]['created_at'], messages[-1]['id'])
+        await async_db.execute(SAVE_QUERY, {
+            'session_id': session_id, 'summary': summary, 'count': len(messages),
+            'watermark_at': watermark[0], 'watermark_id': watermark[1],
+        })
+
+
+async def reset_summary(session_id):
+    """Start over (the conversation was completed: call it after change_messages_status)"""
+    await async_db.execute("DELETE FROM conversation_summaries WHERE session_id = %s", (session_id,))
+
+
+_loop = None
+_loop_lock = threading.Lock()
+_scheduled = set()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="summarizer", daemon=True).start()
+    return _loop
+
+
+async def _update_in_background(session_id):
+    try:
+        await update_summary(session_id, min_messages=SUMMARY_EVERY_N)
+    except Exception as e:
+        logger.error(f"Error updating summary for {session_id}: {e}")
+    finally:
+        with _loop_lock:
+            _scheduled.discard(session_id)
+
+
+def schedule(session_id):
+    """Update the summary in the background if enough messages accumulated. Call it after each turn"""
+    with _loop_lock:
+        if session_id in _scheduled:
+            return
+        _scheduled.add(session_id)
+    asyncio.run_coroutine_threadsafe(_update_in_background(session_id), _background_loop())
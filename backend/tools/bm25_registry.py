@@ -0,0 +1,75 @@
+"""
+BM25 encoder registry
+
+Mantiene una sola instancia del BM25Encoder por proceso para que product_lookup_tool
+no tenga que abrir y deserializar el pickle en cada consulta.
+
+- El path se configura con BM25_MODEL_PATH (por defecto backend/tools/bm25_model.pkl)
+- La carga es lazy; con BM25_WARMUP=1 se carga al importar el modulo
+- Si cambia el mtime del pickle (por ejemplo despues de correr vector_creation.py),
+  el encoder se recarga en la siguiente consulta sin reiniciar el proceso
+"""
+import os
+import pickle
+import threading
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bm25_model.pkl')
+
+_lock = threading.Lock()
+_encoder = None
+_loaded_mtime = None
+_loaded_path = None
+
+
+def get_model_path():
+    return os.getenv('BM25_MODEL_PATH') or DEFAULT_MODEL_PATH
+
+
+def get_bm25():
+    """Return the process-wide BM25 encoder, (re)loading it if the pickle changed on disk"""
+    global _encoder, _loaded_mtime, _loaded_path
+
+    model_path = get_model_path()
+    mtime = os.stat(model_path).st_mtime_ns
+
+    if _encoder is not None and mtime == _loaded_mtime and model_path == _loaded_path:
+        return _encoder
+
+    with _lock:
+        # Otro thread pudo haberlo cargado mientras esperabamos el lock
+        if _encoder is not None and mtime == _loaded_mtime and model_path == _loaded_path:
+            return _encoder
+
+        with open(model_path, 'rb') as f:
+            encoder = pickle.load(f)
+
+        _encoder = encoder
+        _loaded_mtime = mtime
+        _loaded_path = model_path
+        print(f"BM25 encoder loaded from {model_path}")
+        return _encoder
+
+
+async def aget_bm25():
+    """Async version of get_bm25 that keeps the unpickling off the event loop"""
+    if _encoder is not None and _loaded_path == get_model_path():
+        try:
+            if os.stat(_loaded_path).st_mtime_ns == _loaded_mtime:
+                return _encoder
+        except OSError:
+            pass
+
+    import asyncio
+    return await asyncio.to_thread(get_bm25)
+
+
+def warmup():
+    """Load the encoder eagerly, ignoring a missing pickle so imports never fail"""
+    try:
+        get_bm25()
+    except FileNotFoundError:
+        print(f"BM25 warmup skipped, {get_model_path()} not found")
+
+
+if os.getenv('BM25_WARMUP', '').lower() in ('1', 'true', 'yes'):
+    warmup()
@@ -0,0 +1,98 @@
+"""
+Catalog helpers shared by the indexing pipeline and the runtime tools
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+def product_id(link):
+    """Stable product ID derived from the product URL, independent of the row position in the CSV"""
+    normalized = str(link).strip().lower().rstrip('/')
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+CATEGORIES = [
+    'almacen', 'frutas-y-verduras', 'carnes', 'pescados-y-mariscos', 'quesos-y-fiambres',
+    'lacteos', 'congelados', 'panaderia-y-reposteria', 'comidas-preparadas', 'bebidas',
+]
+
+# "1.5 L", "500 Gr", "750cc", "500mlx1", "16 U"
+_SIZE_PATTERN = (
+    r'(?i)(\d+(?:[.,]\d+)?)\s*'
+    r'(kg|kgs|kilos?|grs?|g|gramos|lts?|l|litros?|ml|cc|cm3|u|un|unid|unidades)(?![a-záéíóúñ])'
+)
+# "X Kg", "Por Kg": productos que se venden por peso
+_PER_KG_PATTERN = r'(?i)\b(?:x|por)\s*kg\b'
+
+_UNIT_FACTORS = {
+    'kg': ('kg', 1.0), 'kgs': ('kg', 1.0), 'kilo': ('kg', 1.0), 'kilos': ('kg', 1.0),
+    'g': ('kg', 0.001), 'gr': ('kg', 0.001), 'grs': ('kg', 0.001), 'gramos': ('kg', 0.001),
+    'l': ('l', 1.0), 'lt': ('l', 1.0), 'lts': ('l', 1.0), 'litro': ('l', 1.0), 'litros': ('l', 1.0),
+    'ml': ('l', 0.001), 'cc': ('l', 0.001), 'cm3': ('l', 0.001),
+    'u': ('u', 1.0), 'un': ('u', 1.0), 'unid': ('u', 1.0), 'unidades': ('u', 1.0),
+}
+
+
+def parse_prices(prices):
+    """'$2.024,25' -> 2024.25 (formato argentino: punto de miles, coma decimal)"""
+    cleaned = (
+        prices.astype(str)
+        .str.replace(r'[^\d.,]', '', regex=True)
+        .str.replace('.', '', regex=False)
+        .str.replace(',', '.', regex=False)
+    )
+    return pd.to_numeric(cleaned, errors='coerce')
+
+
+def parse_discounts(discounts):
+    """'-35%' -> 35. Promociones como '2do al 80%' no son un descuento directo y quedan en 0"""
+    numeric = pd.to_numeric(discounts.astype(str).str.replace('%', '', regex=False), errors='coerce')
+    return numeric.abs().fillna(0).astype(int)
+
+
+def parse_sizes(product_names):
+    """Return (quantity, unit) series with the package size normalized to kg, l or u"""
+    sizes = product_names.str.extract(_SIZE_PATTERN)
+    units = sizes[1].str.lower().map(lambda unit: _UNIT_FACTORS.get(unit, (None, np.nan)))
+    unit = units.str[0]
+    quantity = pd.to_numeric(sizes[0].str.replace(',', '.', regex=False), errors='coerce') * units.str[1].astype(float)
+
+    per_kg = product_names.str.contains(_PER_KG_PATTERN, regex=True) & quantity.isna()
+    quantity = quantity.mask(per_kg, 1.0)
+    unit = unit.mask(per_kg, 'kg')
+
+    quantity = quantity.where(quantity > 0)
+    return quantity, unit.where(quantity.notna())
+
+
+def add_numeric_fields(df):
+    """
+    Add typed price, discount_pct, promotion, unit and unit_price columns, keeping the original
+    text columns for display
+    """
+    df = df.copy()
+    df['price'] = parse_prices(df['price_with_discount'])
+    df['discount_pct'] = parse_discounts(df['discount_percentage'])
+
+    raw_discount = df['discount_percentage'].fillna('').astype(str)
+    is_plain_discount = raw_discount.str.fullmatch(r'-?\d+(?:[.,]\d+)?%?') | (raw_discount == '')
+    df['promotion'] = raw_discount.where(~is_plain_discount, '')
+
+    quantity, unit = parse_sizes(df['product_name'].fillna(''))
+    df['unit'] = unit
+    df['unit_price'] = (df['price'] / quantity).round(2)
+    return df
+
+
+def build_filter(max_price=None, min_discount=None, category=None):
+    """Translate the lookup tool arguments into a Pinecone metadata filter (None if empty)"""
+    conditions = {}
+    if max_price is not None:
+        conditions['price'] = {'$lte': float(max_price)}
+    if min_discount is not None:
+        conditions['discount_pct'] = {'$gte': int(min_discount)}
+    if category:
+        conditions['category'] = {'$eq': category}
+    return conditions or None
@@ -0,0 +1,141 @@
+"""
+Query embedding cache
+
+Cache de dos niveles delante de embedding_client.embed_query:
+- LRU en memoria (por proceso)
+- SQLite en disco (compartido entre el proceso de Streamlit y el de WhatsApp y persistente
+  entre reinicios). Los vectores se guardan como float32.
+
+La clave es el texto normalizado + modelo + dimensiones, asi un cambio de modelo nunca
+devuelve vectores viejos. Se configura con EMBEDDING_CACHE_PATH y EMBEDDING_CACHE_MEMORY_ITEMS.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_cache.sqlite3')
+
+
+def normalize_query(text):
+    """Lowercase, NFC-normalize and collapse whitespace so trivially different queries share a key"""
+    text = unicodedata.normalize('NFC', str(text)).lower()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class CachedEmbeddings:
+    def __init__(self, client, model, dimensions, path=None, max_memory_items=None):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.path = path or os.getenv('EMBEDDING_CACHE_PATH') or DEFAULT_CACHE_PATH
+        self.max_memory_items = max_memory_items or int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', 4096))
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        # WAL permite que los dos frontends lean y escriban el mismo archivo a la vez
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _key(self, normalized):
+        raw = f"{self.model}|{self.dimensions}|{normalized}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        """Resolve keys from memory and then from disk. Returns {key: vector} for the hits"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self._counters['memory_hits'] += 1
+
+            pending = [key for key in keys if key not in found]
+            if pending:
+                placeholders = ','.join('?' * len(pending))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM query_embeddings WHERE key IN ({placeholders})",
+                    pending,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self._counters['disk_hits'] += 1
+        return found
+
+    def _store(self, items):
+        """Persist [(key, normalized_text, vector)] in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO query_embeddings (key, model, dimensions, text, vector, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (key, self.model, self.dimensions, text, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for key, text, vector in items
+                ],
+            )
+            self._conn.commit()
+            for key, _, vector in items:
+                self._remember(key, list(vector))
+
+    def embed_documents(self, texts):
+        """Embed a list of queries, sending only the cache misses to the API in a single request"""
+        normalized = [normalize_query(text) for text in texts]
+        keys = [self._key(text) for text in normalized]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, normalized):
+            if key not in found:
+                missing[key] = text
+
+        if missing:
+            with self._lock:
+                self._counters['misses'] += len(missing)
+            vectors = self.client.embed_documents(list(missing.values()))
+            self._store([(key, text, vector) for (key, text), vector in zip(missing.items(), vectors)])
+            found.update(zip(missing.keys(), vectors))
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_items'] = len(self._memory)
+            stats['disk_items'] = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,329 @@
+"""
+Catalog indexing pipeline
+
+Reemplaza al loop de vector_creation.py. Sube el catalogo (data_results.csv) al indice
+hibrido de Pinecone de forma incremental y resumible:
+
+- Cada producto tiene un ID estable derivado de su link (catalog.product_id), asi que
+  reordenar el CSV no invalida nada
+- Se guarda un hash del contenido de cada producto en el archivo de estado
+  (INDEX_STATE_PATH, por defecto backend/tools/index_state.json). Solo se embeben y suben
+  los productos nuevos o que cambiaron, y se borran del indice los que desaparecieron
+- El archivo de estado se reescribe despues de cada batch subido, asi que si el proceso
+  se cae, la siguiente corrida sigue desde donde quedo
+- Los batches de embedding y de upsert corren solapados en thread pools, con un limite
+  de batches en vuelo
+
+El BM25 se reutiliza del pickle existente; con --refit-bm25 (o si no hay pickle) se
+reentrena y, como cambian los vectores sparse, se re-indexa todo el catalogo. El modelo nuevo
+se guarda aparte (BM25_MODEL_PATH + '.new') y reemplaza al publicado recien cuando se subio el
+ultimo batch: bm25_registry recarga el pickle al cambiar, y las queries no pueden usar el
+vocabulario nuevo mientras el indice todavia tiene los vectores del viejo. Si la corrida se
+corta, la siguiente sigue con el modelo pendiente.
+
+Uso:
+    python -m backend.tools.indexing [--dry-run] [--refit-bm25] [--batch-size 500]
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from backend.tools.catalog import product_id, add_numeric_fields
+from backend.tools.bm25_registry import get_model_path
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CATALOG_PATH = os.path.join(TOOLS_DIR, 'data_results.csv')
+DEFAULT_STATE_PATH = os.path.join(TOOLS_DIR, 'index_state.json')
+
+EMBEDDINGS_MODEL = "text-embedding-3-small"
+EMBEDDINGS_DIMENSIONS = 512
+
+
+METADATA_COLUMNS = ['brand', 'product_name', 'price_with_discount', 'discount_percentage',
+                    'image', 'link', 'sub_category', 'category',
+                    'price', 'discount_pct', 'promotion', 'unit', 'unit_price']
+TEXT_COLUMNS = ['product_name', 'brand', 'category', 'sub_category']
+
+
+class StageTimer:
+    """Accumulates wall time per pipeline stage (thread-safe, stages can run in worker threads)"""
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.totals[name] = self.totals.get(name, 0.0) + elapsed
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self):
+        print("stage timings:")
+        for name, total in self.totals.items():
+            print(f"  {name:<12} {total:8.2f}s  ({self.counts[name]} calls)")
+
+
+def load_catalog(path):
+    return pd.read_csv(path, dtype=str)
+
+
+def prepare_catalog(df):
+    """
+    Build document texts, cleaned metadata, normalized discounts and content hashes for the
+    whole catalog with column operations. Returns a DataFrame indexed by product id with
+    columns text, hash and metadata (one dict per product).
+    """
+    df = df.drop(columns=['original_price'], errors='ignore')
+    # price, discount_pct, promotion, unit y unit_price numericos para poder filtrar en el indice
+    df = add_numeric_fields(df)
+    text_columns = df.columns.difference(['price', 'discount_pct', 'unit_price'])
+    df[text_columns] = df[text_columns].fillna('')
+
+    # "-35%" -> "35%"; promociones como "2do al 80%" quedan en "0%" (y en la columna promotion)
+    df['discount_percentage'] = df['discount_pct'].astype(str) + "%"
+    df['price_with_discount'] = df['price_with_discount'].str.strip()
+
+    text = df[TEXT_COLUMNS[0]].str.cat(df[TEXT_COLUMNS[1:]], sep=' ')
+    text = text.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+    ids = df['link'].map(product_id)
+    hashes = pd.util.hash_pandas_object(df[METADATA_COLUMNS].assign(text=text), index=False)
+
+    products = pd.DataFrame({
+        'text': text.to_numpy(),
+        'hash': hashes.map('{:016x}'.format).to_numpy(),
+        'metadata': [
+            # Pinecone no acepta nulls en la metadata: los campos sin valor no se guardan
+            {k: v for k, v in record.items() if v == v and v != ''}
+            for record in df[METADATA_COLUMNS].to_dict(orient="records")
+        ],
+    }, index=ids.to_numpy())
+    # Si el CSV repite un producto nos quedamos con la ultima fila
+    return products[~products.index.duplicated(keep='last')]
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def file_fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def pending_model_path():
+    return f"{get_model_path()}.new"
+
+
+def load_or_fit_bm25(texts, refit):
+    """
+    Return (bm25, fingerprint, pending): pending is True when the model is not published yet
+    (publish_bm25 moves it to BM25_MODEL_PATH once the index uses it)
+    """
+    from pinecone_text.sparse import BM25Encoder
+
+    model_path, pending_path = get_model_path(), pending_model_path()
+    if refit or not (os.path.exists(model_path) or os.path.exists(pending_path)):
+        bm25 = BM25Encoder()
+        bm25.fit(texts)
+        with open(pending_path, 'wb') as f:
+            pickle.dump(bm25, f)
+        print(f"BM25 fitted on {len(texts)} products and saved to {pending_path}")
+        path = pending_path
+    else:
+        # Un refit que no termino de subirse sigue con el mismo modelo
+        path = pending_path if os.path.exists(pending_path) else model_path
+        with open(path, 'rb') as f:
+            bm25 = pickle.load(f)
+    return bm25, file_fingerprint(path), path == pending_path
+
+
+def publish_bm25():
+    os.replace(pending_model_path(), get_model_path())
+    print(f"BM25 published to {get_model_path()}")
+
+
+def plan_changes(products, state):
+    indexed = state['products']
+    changed = products['hash'].ne(products.index.map(indexed.get))
+    to_upsert = products.index[changed].tolist()
+    to_delete = [_id for _id in indexed if _id not in products.index]
+    return to_upsert, to_delete
+
+
+def run(catalog_path=None, state_path=None, batch_size=500, embed_workers=2, upsert_workers=2,
+        max_in_flight=4, refit_bm25=False, dry_run=False):
+    load_dotenv()
+    catalog_path = catalog_path or os.getenv('CATALOG_PATH') or DEFAULT_CATALOG_PATH
+    state_path = state_path or os.getenv('INDEX_STATE_PATH') or DEFAULT_STATE_PATH
+
+    timer = StageTimer()
+    with timer.stage('load'):
+        df = load_catalog(catalog_path)
+    with timer.stage('preprocess'):
+        products = prepare_catalog(df)
+    print(f"{len(products)} products in {catalog_path}")
+
+    with timer.stage('bm25'):
+        bm25, bm25_fingerprint, bm25_pending = load_or_fit_bm25(
+            [metadata['product_name'] for metadata in products['metadata']], refit_bm25
+        )
+
+    from backend.tools.search_backends import connect_pinecone_index
+    pinecone_index = connect_pinecone_index()
+
+    state = load_state(state_path)
+    if state is None:
+        # Primera corrida: el indice puede tener IDs viejos (posiciones de fila)
+        indexed = {_id: None for page in pinecone_index.list() for _id in page}
+        state = {'bm25': bm25_fingerprint, 'products': indexed}
+    elif state.get('bm25') != bm25_fingerprint:
+        # Con otro BM25 cambian todos los vectores sparse: se re-indexa todo
+        state = {'bm25': bm25_fingerprint, 'products': {_id: None for _id in state['products']}}
+
+    with timer.stage('plan'):
+        to_upsert, to_delete = plan_changes(products, state)
+    print(f"to upsert: {len(to_upsert)}, to delete: {len(to_delete)}")
+    if dry_run:
+        if bm25_pending and refit_bm25:
+            os.remove(pending_model_path())
+        timer.report()
+        return
+
+    if to_upsert:
+        from langchain_openai import OpenAIEmbeddings
+        embedding_client = OpenAIEmbeddings(api_key=os.getenv('OPENAI_API_KEY'),
+            model=EMBEDDINGS_MODEL, dimensions=EMBEDDINGS_DIMENSIONS)
+
+        def embed_batch(batch):
+            texts = batch['text'].tolist()
+            with timer.stage('sparse'):
+                sparse_embeds = bm25.encode_documents(texts)
+            with timer.stage('embed'):
+                dense_embeds = embedding_client.embed_documents(texts)
+            return [
+                {
+                    'id': _id,
+                    'sparse_values': sparse,
+                    'values': dense,
+                    'metadata': metadata,
+                }
+                for _id, sparse, dense, metadata in zip(batch.index, sparse_embeds, dense_embeds, batch['metadata'])
+            ]
+
+        def upsert_batch(upserts):
+            with timer.stage('upsert'):
+                pinecone_index.upsert(upserts, batch_size=100)
+            return [upsert['id'] for upsert in upserts]
+
+        # Los batches salen de la tabla ya preprocesada, sin volver a tocar el CSV
+        pending = products.loc[to_upsert]
+        batches = (pending.iloc[i:i + batch_size] for i in range(0, len(pending), batch_size))
+        done_count = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(embed_workers) as embed_pool, ThreadPoolExecutor(upsert_workers) as upsert_pool:
+            pending_embeds, pending_upserts = set(), set()
+
+            def fill():
+                # Mantener como maximo max_in_flight batches entre embedding y upsert
+                while len(pending_embeds) + len(pending_upserts) < max_in_flight:
+                    batch = next(batches, None)
+                    if batch is None:
+                        return
+                    pending_embeds.add(embed_pool.submit(embed_batch, batch))
+
+            fill()
+            while pending_embeds or pending_upserts:
+                finished, _ = wait(pending_embeds | pending_upserts, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in pending_embeds:
+                        pending_embeds.remove(future)
+                        pending_upserts.add(upsert_pool.submit(upsert_batch, future.result()))
+                    else:
+                        pending_upserts.remove(future)
+                        ids = future.result()
+                        state['products'].update(products.loc[ids, 'hash'].items())
+                        with timer.stage('checkpoint'):
+                            save_state(state, state_path)
+                        done_count += len(ids)
+                        print(f"upserted {done_count}/{len(to_upsert)} ({time.perf_counter() - start:.1f}s)")
+                fill()
+
+    if bm25_pending:
+        # Todos los vectores sparse ya son del modelo nuevo: recien ahora lo ven las queries
+        publish_bm25()
+
+    for i in range(0, len(to_delete), 1000):
+        ids = to_delete[i:i + 1000]
+        with timer.stage('delete'):
+            pinecone_index.delete(ids=ids)
+        for _id in ids:
+            state['products'].pop(_id, None)
+        save_state(state, state_path)
+    if to_delete:
+        print(f"deleted {len(to_delete)} products")
+
+    # show index description after uploading the documents
+    print(pinecone_index.describe_index_stats())
+
+    if to_upsert or to_delete:
+        # invalida el cache de resultados de product_lookup_tool en todos los procesos
+        from backend.tools.result_cache import bump_catalog_version
+        print(f"catalog version: {bump_catalog_version()}")
+
+    timer.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental indexing of the Jumbo catalog")
+    parser.add_argument('--catalog', help="CSV path (default backend/tools/data_results.csv)")
+    parser.add_argument('--state', help="state/checkpoint path (default backend/tools/index_state.json)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--embed-workers', type=int, default=2)
+    parser.add_argument('--upsert-workers', type=int, default=2)
+    parser.add_argument('--max-in-flight', type=int, default=4)
+    parser.add_argument('--refit-bm25', action='store_true')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    run(
+        catalog_path=args.catalog,
+        state_path=args.state,
+        batch_size=args.batch_size,
+        embed_workers=args.embed_workers,
+        upsert_workers=args.upsert_workers,
+        max_in_flight=args.max_in_flight,
+        refit_bm25=args.refit_bm25,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == '__main__':
+    main()
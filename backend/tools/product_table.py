@@ -0,0 +1,140 @@
+"""
+Product handles for the LLM context
+
+product_lookup_tool no le pasa al modelo los links de producto ni de imagen (las URLs de
+vtexassets solas son ~150 caracteres por resultado y se reenvían en cada llamada del turno).
+Cada producto se identifica con un handle corto (p + prefijo del catalog.product_id, p. ej.
+"p3f9a2c1b") y la tabla de este módulo guarda, por proceso, handle -> producto completo:
+
+- Las tools del carrito reciben el handle y toman nombre, precio y link de la tabla
+- El carrito en el prompt se muestra con handles (cart.format_cart(cart, links=False)). Esos
+  productos solo reservan el handle: el precio del carrito no pisa al del catálogo, y para
+  agregarlos de nuevo se traen del índice (resolve)
+- resolve() también trae del índice los productos que la tabla no tiene (otro worker, reinicio)
+  cuando el modelo manda el link en vez del handle
+- El modelo cita los productos como [p3f9a2c1b] y rehydrate() los reemplaza por el link
+  al armar la respuesta final (y StreamRehydrator mientras se streamea)
+"""
+import re
+import threading
+
+from backend.tools.catalog import product_id
+
+HANDLE_LENGTH = 8
+HANDLE_PATTERN = re.compile(r'\[(p[0-9a-f]{8,16})\]')
+
+
+def catalog_price(metadata):
+    """Numeric price of an index match (the numeric 'price' field, or the display price for old indexes)"""
+    # backend.cart importa este módulo
+    from backend.cart import parse_price
+
+    if isinstance(metadata.get('price'), (int, float)):
+        return float(metadata['price'])
+    return parse_price(metadata.get('price_with_discount', 0))
+
+
+class ProductTable:
+    def __init__(self):
+        self._products = {}     # handle -> {'product_id', 'nombre', 'precio', 'link', 'image'}
+        self._handles = {}      # product_id -> handle
+        self._lock = threading.Lock()
+
+    def register(self, product, catalog=True):
+        """
+        Store the product (needs at least product_id and link) and return its handle.
+        Catalog data replaces what the table had; other data (catalog=False) only fills empty handles
+        """
+        pid = product['product_id']
+        with self._lock:
+            handle = self._handles.get(pid)
+            if handle is None:
+                # Si dos productos comparten el prefijo, el segundo usa uno más largo
+                length = HANDLE_LENGTH
+                while f"p{pid[:length]}" in self._products and length < len(pid):
+                    length += 1
+                handle = f"p{pid[:length]}"
+                self._handles[pid] = handle
+            if catalog or handle not in self._products:
+                self._products[handle] = {**product, 'catalog': catalog}
+        return handle
+
+    def register_match(self, metadata):
+        return self.register({
+            'product_id': product_id(metadata['link']),
+            'nombre': metadata['product_name'],
+            'precio': catalog_price(metadata),
+            'link': metadata['link'],
+            'image': metadata.get('image', ''),
+        })
+
+    def register_cart_item(self, item):
+        # Precio y nombre pueden ser los de una compra vieja: no reemplazan a los del catálogo
+        return self.register({
+            'product_id': item['product_id'],
+            'nombre': item['nombre'],
+            'precio': item['precio'],
+            'link': item['link'],
+        }, catalog=False)
+
+    def get(self, ref):
+        """Product of a handle (or of a product link), or None"""
+        ref = str(ref).strip().strip('[]')
+        with self._lock:
+            if ref.startswith('http'):
+                ref = self._handles.get(product_id(ref))
+            return self._products.get(ref)
+
+    def resolve(self, refs):
+        """
+        Fetch from the search index the products of refs (handles or links) that the table does not
+        have with catalog data. Blocking: call it with asyncio.to_thread from async code
+        """
+        from backend.tools.search_backends import get_search_backend
+
+        ids = []
+        for ref in refs:
+            product = self.get(ref)
+            if product is not None and product['catalog']:
+                continue
+            if product is not None:
+                ids.append(product['product_id'])
+            elif str(ref).strip().startswith('http'):
+                ids.append(product_id(ref))
+        if not ids:
+            return
+        for metadata in get_search_backend().fetch(list(dict.fromkeys(ids))).values():
+            self.register_match(metadata)
+
+    def rehydrate(self, text):
+        """Replace [handle] references with the product link (unknown handles are left as they are)"""
+        def link(match):
+            product = self.get(match.group(1))
+            return product['link'] if product else match.group(0)
+        return HANDLE_PATTERN.sub(link, text)
+
+
+class StreamRehydrator:
+    """rehydrate() for streamed text: holds back a trailing '[p...' until the reference is complete"""
+
+    MAX_PENDING = 20
+
+    def __init__(self, table=None):
+        self.table = table or product_table
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        start = self.buffer.rfind('[')
+        if start != -1 and ']' not in self.buffer[start:] and len(self.buffer) - start <= self.MAX_PENDING:
+            ready, self.buffer = self.buffer[:start], self.buffer[start:]
+        else:
+            ready, self.buffer = self.buffer, ""
+        return self.table.rehydrate(ready)
+
+    def flush(self):
+        ready, self.buffer = self.buffer, ""
+        return self.table.rehydrate(ready)
+
+
+product_table = ProductTable()
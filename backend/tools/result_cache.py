@@ -0,0 +1,150 @@
+"""
+Result cache for product_lookup_tool
+
+Cache TTL/LRU del JSON final de product_lookup_tool, por proceso.
+
+- La clave es (version del catalogo, query normalizada). La version del catalogo es un
+  archivo (CATALOG_VERSION_PATH, por defecto backend/tools/catalog_version.txt) que
+  vector_creation.py reescribe despues de cada upsert, asi que re-indexar invalida el
+  cache de todos los procesos sin reiniciarlos.
+- Consultas identicas concurrentes (por ejemplo dentro del mismo batch de
+  handle_shopping_tools) comparten un solo request en vuelo.
+
+Se configura con RESULT_CACHE_TTL (segundos) y RESULT_CACHE_MAX_ITEMS.
+"""
+import os
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+
+DEFAULT_VERSION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog_version.txt')
+
+
+def get_version_path():
+    return os.getenv('CATALOG_VERSION_PATH') or DEFAULT_VERSION_PATH
+
+
+_version_lock = threading.Lock()
+_version_mtime = None
+_version = ''
+
+
+def get_catalog_version():
+    """Return the current catalog version stamp, re-reading the file only when it changed"""
+    global _version_mtime, _version
+    path = get_version_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return ''
+
+    if mtime != _version_mtime:
+        with _version_lock:
+            with open(path) as f:
+                _version = f.read().strip()
+            _version_mtime = mtime
+    return _version
+
+
+def bump_catalog_version():
+    """Write a new catalog version stamp. Call it after re-upserting the index"""
+    path = get_version_path()
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
+
+
+class ResultCache:
+    def __init__(self, ttl=None, max_items=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv('RESULT_CACHE_TTL', 3600))
+        self.max_items = max_items or int(os.getenv('RESULT_CACHE_MAX_ITEMS', 2048))
+
+        self._items = OrderedDict()
+        self._inflight = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'shared': 0}
+
+    def _get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def _check_version(self):
+        version = get_catalog_version()
+        if version != self._version:
+            with self._lock:
+                self._items.clear()
+                self._version = version
+        return version
+
+    def peek(self, query_key):
+        """Cached value for query_key or None, without computing (and without counting a hit)"""
+        return self._get((self._check_version(), query_key))
+
+    async def get_or_compute(self, query_key, compute):
+        """
+        Return the cached value for query_key, or await compute() once and cache it.
+        Concurrent callers with the same key await the same in-flight task.
+        """
+        key = (self._check_version(), query_key)
+
+        value = self._get(key)
+        if value is not None:
+            self._counters['hits'] += 1
+            return value
+
+        loop = asyncio.get_running_loop()
+        inflight_key = (id(loop), key)
+        task = self._inflight.get(inflight_key)
+        if task is not None:
+            self._counters['shared'] += 1
+            return await asyncio.shield(task)
+
+        self._counters['misses'] += 1
+        task = loop.create_task(compute())
+        self._inflight[inflight_key] = task
+        try:
+            value = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._inflight.pop(inflight_key, None)
+            else:
+                task.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+
+        self._set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['items'] = len(self._items)
+            stats['inflight'] = len(self._inflight)
+            stats['catalog_version'] = self._version
+        return stats
+
+
+lookup_cache = ResultCache()
@@ -0,0 +1,337 @@
+"""
+Search backends for product_lookup_tool
+
+- PineconeBackend: consulta el indice hibrido 'jumbo-ai' en Pinecone (comportamiento original)
+- LocalHybridBackend: tiene todo el catalogo en memoria. Los vectores densos estan en una
+  matriz NumPy (N x 512) y los postings de BM25 en una matriz CSR (termino x producto), y
+  calcula el mismo score dotproduct que usa Pinecone: dense·q_dense + sparse·q_sparse
+
+query_many() corre varias queries de una vez (product_batch_lookup_tool): Pinecone las manda en
+paralelo sobre el mismo cliente, y el backend local las resuelve con una sola multiplicacion de
+matrices (N x D)·(D x B) mas (N x V)·(V x B) para la parte sparse.
+
+El backend se elige con SEARCH_BACKEND=pinecone|local (por defecto pinecone), asi se pueden
+comparar los resultados de los dos.
+
+El indice local se construye bajando los vectores del indice de Pinecone:
+    python -m backend.tools.search_backends build
+y se puede comparar contra Pinecone con:
+    python -m backend.tools.search_backends compare "aceite de girasol"
+"""
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse as sp
+
+INDEX_NAME = 'jumbo-ai'
+DEFAULT_LOCAL_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_index.npz')
+
+
+def get_local_index_path():
+    return os.getenv('LOCAL_INDEX_PATH') or DEFAULT_LOCAL_INDEX_PATH
+
+
+def connect_pinecone_index():
+    from pinecone import Pinecone
+
+    pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
+    return pc.Index(INDEX_NAME)
+
+
+class PineconeBackend:
+    name = 'pinecone'
+
+    def __init__(self, index=None, max_workers=None):
+        self.index = index or connect_pinecone_index()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv('PINECONE_QUERY_WORKERS', 8)),
+            thread_name_prefix='pinecone-query',
+        )
+
+    def query(self, dense, sparse, top_k=10, filter=None):
+        result = self.index.query(
+            top_k=top_k,
+            vector=dense,
+            sparse_vector=sparse,
+            filter=filter,
+            include_metadata=True
+        )
+        return [
+            {'id': match['id'], 'score': match['score'], 'metadata': match['metadata']}
+            for match in result['matches']
+        ]
+
+    def query_many(self, dense, sparse, top_k=10, filter=None):
+        """One result list per (dense, sparse) pair, querying the index concurrently"""
+        return list(self._executor.map(
+            lambda pair: self.query(pair[0], pair[1], top_k=top_k, filter=filter),
+            zip(dense, sparse),
+        ))
+
+    def fetch(self, ids, batch_size=100):
+        """Metadata of the given product ids ({id: metadata}), without querying. Missing ids are left out"""
+        found = {}
+        for i in range(0, len(ids), batch_size):
+            vectors = self.index.fetch(ids=list(ids[i:i + batch_size])).vectors
+            found.update({_id: vector.metadata or {} for _id, vector in vectors.items()})
+        return found
+
+
+class LocalHybridBackend:
+    name = 'local'
+
+    def __init__(self, ids, dense, postings, vocab, metadata):
+        self.ids = ids                  # (N,) product ids, same ids as in Pinecone
+        self.dense = dense              # (N, D) float32
+        self.postings = postings        # (V, N) CSR, row j = BM25 postings of term vocab[j]
+        self.vocab = vocab              # (V,) sorted BM25 hashed token ids
+        self.metadata = metadata        # list of N metadata dicts
+        self._fields = {}               # metadata field -> (N,) array, built on first filter
+        self._positions = None          # product id -> row, built on first fetch
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or get_local_index_path()
+        with np.load(path, allow_pickle=False) as data:
+            n_docs = data['dense'].shape[0]
+            postings = sp.csr_matrix(
+                (data['postings_data'], data['postings_indices'], data['postings_indptr']),
+                shape=(len(data['vocab']), n_docs),
+            )
+            return cls(
+                ids=data['ids'],
+                dense=np.ascontiguousarray(data['dense'], dtype=np.float32),
+                postings=postings,
+                vocab=data['vocab'],
+                metadata=json.loads(str(data['metadata'])),
+            )
+
+    def _sparse_scores(self, sparse):
+        indices = np.asarray(sparse.get('indices', []), dtype=np.int64)
+        values = np.asarray(sparse.get('values', []), dtype=np.float32)
+        if indices.size == 0 or self.vocab.size == 0:
+            return None
+
+        # Los terminos de la query que no aparecen en ningun producto suman 0
+        rows = np.searchsorted(self.vocab, indices)
+        rows = np.minimum(rows, self.vocab.size - 1)
+        known = self.vocab[rows] == indices
+        if not known.any():
+            return None
+
+        return self.postings[rows[known]].T @ values[known]
+
+    def scores(self, dense, sparse):
+        scores = self.dense @ np.asarray(dense, dtype=np.float32)
+        sparse_scores = self._sparse_scores(sparse)
+        if sparse_scores is not None:
+            scores += sparse_scores
+        return scores
+
+    def _field(self, name):
+        if name not in self._fields:
+            values = [metadata.get(name) for metadata in self.metadata]
+            if all(value is None or isinstance(value, (int, float)) for value in values):
+                self._fields[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            else:
+                self._fields[name] = np.array(values, dtype=object)
+        return self._fields[name]
+
+    def _mask(self, filter):
+        """Evaluate the subset of the Pinecone filter language used by product_lookup_tool"""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field, condition in filter.items():
+            if field == '$and':
+                for sub_filter in condition:
+                    mask &= self._mask(sub_filter)
+                continue
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+
+            values = self._field(field)
+            for op, operand in condition.items():
+                with np.errstate(invalid='ignore'):
+                    if op == '$eq':
+                        mask &= values == operand
+                    elif op == '$ne':
+                        mask &= values != operand
+                    elif op == '$gt':
+                        mask &= values > operand
+                    elif op == '$gte':
+                        mask &= values >= operand
+                    elif op == '$lt':
+                        mask &= values < operand
+                    elif op == '$lte':
+                        mask &= values <= operand
+                    elif op == '$in':
+                        mask &= np.isin(values, list(operand))
+                    elif op == '$nin':
+                        mask &= ~np.isin(values, list(operand))
+                    else:
+                        raise ValueError(f"Unsupported filter operator: {op}")
+        return mask
+
+    def _top_k(self, scores, top_k, mask=None):
+        candidates = np.arange(scores.size) if mask is None else np.flatnonzero(mask)
+        top_k = min(top_k, candidates.size)
+        if top_k <= 0:
+            return []
+        candidate_scores = scores[candidates]
+        top = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+        top = candidates[top[np.argsort(-candidate_scores[top])]]
+        return [
+            {'id': str(self.ids[i]), 'score': float(scores[i]), 'metadata': self.metadata[i]}
+            for i in top
+        ]
+
+    def query(self, dense, sparse, top_k=10, filter=None):
+        mask = self._mask(filter) if filter else None
+        return self._top_k(self.scores(dense, sparse), top_k, mask)
+
+    def _sparse_matrix(self, sparse):
+        """(V, B) CSR matrix with the BM25 query vectors as columns (unknown terms dropped)"""
+        rows, cols, values = [], [], []
+        for col, vector in enumerate(sparse):
+            indices = np.asarray(vector.get('indices', []), dtype=np.int64)
+            if indices.size == 0 or self.vocab.size == 0:
+                continue
+            term_rows = np.minimum(np.searchsorted(self.vocab, indices), self.vocab.size - 1)
+            known = self.vocab[term_rows] == indices
+            rows.extend(term_rows[known])
+            cols.extend([col] * int(known.sum()))
+            values.extend(np.asarray(vector.get('values', []), dtype=np.float32)[known])
+        return sp.csr_matrix(
+            (np.asarray(values, dtype=np.float32), (rows, cols)),
+            shape=(self.vocab.size, len(sparse)),
+        )
+
+    def query_many(self, dense, sparse, top_k=10, filter=None):
+        """One result list per (dense, sparse) pair, scoring the whole batch with one matmul"""
+        if not dense:
+            return []
+        queries = np.asarray(dense, dtype=np.float32)
+        scores = self.dense @ queries.T
+        sparse_matrix = self._sparse_matrix(sparse)
+        if sparse_matrix.nnz:
+            scores += (self.postings.T @ sparse_matrix).toarray()
+
+        mask = self._mask(filter) if filter else None
+        return [self._top_k(scores[:, col], top_k, mask) for col in range(scores.shape[1])]
+
+    def fetch(self, ids):
+        """Metadata of the given product ids ({id: metadata}), without querying. Missing ids are left out"""
+        if self._positions is None:
+            self._positions = {str(_id): i for i, _id in enumerate(self.ids)}
+        return {_id: self.metadata[self._positions[_id]] for _id in ids if _id in self._positions}
+
+
+def build_local_index(index=None, path=None, batch_size=100):
+    """Download every vector of the Pinecone index and save it as a local index file"""
+    index = index or connect_pinecone_index()
+    path = path or get_local_index_path()
+
+    ids = [_id for page in index.list() for _id in page]
+
+    dense_rows = []
+    metadata = []
+    sparse_rows = []
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        vectors = index.fetch(ids=batch).vectors
+        for _id in batch:
+            vector = vectors[_id]
+            dense_rows.append(vector.values)
+            metadata.append(vector.metadata or {})
+            sparse_values = vector.sparse_values
+            if sparse_values is None:
+                sparse_rows.append(([], []))
+            else:
+                sparse_rows.append((sparse_values.indices, sparse_values.values))
+
+    vocab = np.unique(np.fromiter(
+        (token for indices, _ in sparse_rows for token in indices), dtype=np.int64
+    ))
+    term_rows, doc_cols, weights = [], [], []
+    for doc, (indices, values) in enumerate(sparse_rows):
+        term_rows.extend(np.searchsorted(vocab, np.asarray(indices, dtype=np.int64)))
+        doc_cols.extend([doc] * len(indices))
+        weights.extend(values)
+    postings = sp.csr_matrix(
+        (np.asarray(weights, dtype=np.float32), (term_rows, doc_cols)),
+        shape=(len(vocab), len(ids)),
+    )
+
+    np.savez(
+        path,
+        ids=np.asarray(ids),
+        dense=np.asarray(dense_rows, dtype=np.float32),
+        postings_data=postings.data,
+        postings_indices=postings.indices,
+        postings_indptr=postings.indptr,
+        vocab=vocab,
+        metadata=json.dumps(metadata),
+    )
+    print(f"Local index with {len(ids)} products saved to {path}")
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_search_backend(name=None):
+    """Return the (cached) backend selected by name or by the SEARCH_BACKEND env var"""
+    name = (name or os.getenv('SEARCH_BACKEND') or 'pinecone').lower()
+    if name in _backends:
+        return _backends[name]
+
+    with _backends_lock:
+        if name not in _backends:
+            if name == 'pinecone':
+                _backends[name] = PineconeBackend()
+            elif name == 'local':
+                _backends[name] = LocalHybridBackend.load()
+            else:
+                raise ValueError(f"Unknown search backend: {name}")
+        return _backends[name]
+
+
+def compare_backends(query, top_k=10):
+    """Run the same query against both backends and print the rankings side by side"""
+    import time
+    from backend.tools.bm25_registry import get_bm25
+    from backend.tools.tool import embedding_client
+
+    dense = embedding_client.embed_query(query)
+    sparse = get_bm25().encode_queries(query)
+
+    rankings = {}
+    for name in ('pinecone', 'local'):
+        backend = get_search_backend(name)
+        start = time.perf_counter()
+        rankings[name] = backend.query(dense, sparse, top_k=top_k)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{name}: {elapsed:.2f} ms")
+
+    for remote, local in zip(rankings['pinecone'], rankings['local']):
+        print(f"{remote['score']:.4f} {remote['metadata'].get('product_name', ''):<50} | "
+              f"{local['score']:.4f} {local['metadata'].get('product_name', '')}")
+
+    overlap = {m['id'] for m in rankings['pinecone']} & {m['id'] for m in rankings['local']}
+    print(f"overlap: {len(overlap)}/{top_k}")
+
+
+if __name__ == '__main__':
+    import sys
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        build_local_index()
+    elif command == 'compare':
+        compare_backends(' '.join(sys.argv[2:]))
+    else:
+        print("usage: python -m backend.tools.search_backends [build|compare <query>]")
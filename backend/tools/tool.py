@@ -13,72 +13,140 @@ EMBEDDINGS_DIMENSIONS = 512
 embedding_client = OpenAIEmbeddings(api_key=OPENAI_API_KEY,
     model="text-embedding-3-small", dimensions=EMBEDDINGS_DIMENSIONS)
 
-from pinecone import Pinecone
-from pinecone_text.sparse import BM25Encoder
+from backend.tools.embedding_cache import CachedEmbeddings, normalize_query
 
-# initialize connection to pinecone
-api_key = os.environ.get('PINECONE_API_KEY') 
+# Cache LRU + SQLite delante de embed_query, compartido entre procesos
+cached_embeddings = CachedEmbeddings(embedding_client,
+    model="text-embedding-3-small", dimensions=EMBEDDINGS_DIMENSIONS)
 
-# connect to index
-pc = Pinecone(api_key=api_key)
-index_name = 'jumbo-ai'
-pinecone_index = pc.Index(index_name)
+from backend.tools.search_backends import get_search_backend
 
-import asyncio
-import pickle
+from backend.tools.bm25_registry import aget_bm25
+from backend.tools.result_cache import lookup_cache
 
-async def load_bm25_model():
-    #current_dir = os.path.dirname(os.path.abspath(__file__))
+from backend.tools.catalog import CATEGORIES, build_filter
+from backend.tools.product_table import product_table
 
-    #model_path = os.path.join(current_dir, 'bm25_model.pkl')
-    #with open('backend/tools/bm25_model.pkl', 'rb') as f:
-    #    bm25 = pickle.load(f)  # Load asynchronously
-    #return bm25
+import asyncio
+from typing import Annotated, Literal, Optional
+from langchain_core.tools import tool
 
-    # for server
-    #base_path = "/home/ubuntu/frizbee"
-    #model_path = os.path.join(base_path, 'backend/tools/bm25_model.pkl')
+LOOKUP_BATCH_MAX = int(os.getenv('LOOKUP_BATCH_MAX', 20))
 
-    # for mac
-    base_path = "/Users/felipegoulu/projects/activos/jumbo_ai"
-    model_path = os.path.join(base_path, 'backend/tools/bm25_model.pkl')
-    with open(model_path, 'rb') as f:
-        bm25 = pickle.load(f)
-    return bm25
+# Cuántos resultados le llegan al modelo por búsqueda. Los que tienen score menor a
+# LOOKUP_MIN_SCORE o a LOOKUP_RELATIVE_CUTOFF * el score del primero se descartan
+LOOKUP_TOP_K = int(os.getenv('LOOKUP_TOP_K', 10))
+LOOKUP_MIN_SCORE = float(os.getenv('LOOKUP_MIN_SCORE', '-inf'))
+LOOKUP_RELATIVE_CUTOFF = float(os.getenv('LOOKUP_RELATIVE_CUTOFF', 0))
 
-import asyncio
-from langchain_core.tools import tool
+def _cutoff(result_matches):
+    if not result_matches:
+        return result_matches
+    min_score = LOOKUP_MIN_SCORE
+    if LOOKUP_RELATIVE_CUTOFF and result_matches[0]['score'] > 0:
+        min_score = max(min_score, LOOKUP_RELATIVE_CUTOFF * result_matches[0]['score'])
+    return [match for match in result_matches if match['score'] >= min_score]
 
-@tool("product_lookup_tool")
-async def product_lookup_tool(query):
+def _format_results(result_matches):
     """
-    Busco dentro de la base de datos del supermercado 'jumbo'
+    One line per product: [handle] nombre | precio | descuento | promocion | precio por unidad.
+    Sin links ni imágenes: el handle alcanza para agregarlo al carrito y se reemplaza por el link
+    en la respuesta final (ver product_table)
     """
-    # Check if the bm25 model is loaded
-    bm25 = await load_bm25_model()  # Ensure the model is loaded
+    lines = []
+    for match in _cutoff(result_matches):
+        metadata = match['metadata']
+        fields = [f"[{product_table.register_match(metadata)}] {metadata['product_name']}",
+                  metadata['price_with_discount']]
+        if metadata.get('discount_percentage'):
+            fields.append(metadata['discount_percentage'])
+        if metadata.get('promotion') and metadata['promotion'] != metadata.get('discount_percentage'):
+            fields.append(metadata['promotion'])
+        if metadata.get('unit_price'):
+            fields.append(f"${metadata['unit_price']:.2f}/{metadata['unit']}")
+        lines.append(" | ".join(str(field) for field in fields))
+    return "\n".join(lines) or "Sin resultados"
+
+async def _product_lookup(query, filter=None):
+    # El encoder se carga una sola vez por proceso (y se recarga si cambia el pickle)
+    bm25 = await aget_bm25()
     sparse = bm25.encode_queries(query)
-    dense = await asyncio.to_thread(embedding_client.embed_query, query)
-
-    result = await asyncio.to_thread(
-        pinecone_index.query,
-        top_k = 10,
-        vector = dense,
-        sparse_vector = sparse,
-        include_metadata = True
+    dense = await asyncio.to_thread(cached_embeddings.embed_query, query)
+
+    # SEARCH_BACKEND elige entre Pinecone y el indice local en memoria
+    search_backend = get_search_backend()
+    result_matches = await asyncio.to_thread(
+        search_backend.query,
+        dense,
+        sparse,
+        top_k = LOOKUP_TOP_K,
+        filter = filter
     )
-    result_matches = result['matches']
-    final_result = []
-    for i in range(len(result_matches)):
-        final_result.append({
-            'nombre_producto': result_matches[i]['metadata']['product_name'],
-            'price_with_discount': result_matches[i]['metadata']['price_with_discount'],
-            'discount': result_matches[i]['metadata']['discount_percentage'],
-            'link_producto': result_matches[i]['metadata']['link'],
-            'link_imagen': result_matches[i]['metadata']['image'],
-        })
-            
-    # Convert the list of dictionaries to a JSON string
-    import json
-    json_string = json.dumps(final_result)
-
-    return json_string
\ No newline at end of file
+    return _format_results(result_matches)
+
+async def _product_lookup_many(queries, filter=None):
+    """Same as _product_lookup for N queries: one embeddings request, one BM25 pass, one batched search"""
+    bm25 = await aget_bm25()
+    sparse = bm25.encode_queries(list(queries))
+    dense = await asyncio.to_thread(cached_embeddings.embed_documents, queries)
+
+    search_backend = get_search_backend()
+    results = await asyncio.to_thread(search_backend.query_many, dense, sparse, top_k=LOOKUP_TOP_K, filter=filter)
+    return [_format_results(result_matches) for result_matches in results]
+
+def _cache_key(query, max_price, min_discount, category):
+    # Mismo resultado para la misma query y filtros mientras no cambie la version del catalogo
+    return (get_search_backend().name, normalize_query(query), max_price, min_discount, category)
+
+@tool("product_lookup_tool")
+async def product_lookup_tool(
+    query: Annotated[str, "Lo que busca el usuario, por ejemplo 'aceite de girasol'"],
+    max_price: Annotated[Optional[float], "Precio maximo en pesos (con descuento)"] = None,
+    min_discount: Annotated[Optional[int], "Descuento minimo en porcentaje, por ejemplo 20"] = None,
+    category: Annotated[Optional[Literal[tuple(CATEGORIES)]], "Categoria del supermercado"] = None,
+):
+    """
+    Busco dentro de la base de datos del supermercado 'jumbo'.
+    Los filtros opcionales (precio maximo, descuento minimo, categoria) se aplican en el indice.
+    """
+    filter = build_filter(max_price=max_price, min_discount=min_discount, category=category)
+
+    cache_key = _cache_key(query, max_price, min_discount, category)
+    return await lookup_cache.get_or_compute(cache_key, lambda: _product_lookup(query, filter))
+
+@tool("product_batch_lookup_tool")
+async def product_batch_lookup_tool(
+    queries: Annotated[list[str], "Todo lo que hay que buscar, un producto por elemento, por ejemplo ['harina', 'huevos', 'leche']"],
+    max_price: Annotated[Optional[float], "Precio maximo en pesos (con descuento), para todas las busquedas"] = None,
+    min_discount: Annotated[Optional[int], "Descuento minimo en porcentaje, para todas las busquedas"] = None,
+    category: Annotated[Optional[Literal[tuple(CATEGORIES)]], "Categoria del supermercado, para todas las busquedas"] = None,
+):
+    """
+    Busco varios productos a la vez dentro de la base de datos del supermercado 'jumbo'
+    (por ejemplo los ingredientes de una receta o una compra semanal).
+    Devuelve los resultados de cada busqueda por separado.
+    """
+    filter = build_filter(max_price=max_price, min_discount=min_discount, category=category)
+    queries = list(dict.fromkeys(query for query in queries if query.strip()))[:LOOKUP_BATCH_MAX]
+    keys = [_cache_key(query, max_price, min_discount, category) for query in queries]
+
+    # Solo las que no estan en el cache van al batch; cada una se guarda en el cache por separado,
+    # asi una busqueda posterior con product_lookup_tool la reutiliza
+    pending = [query for query, key in zip(queries, keys) if lookup_cache.peek(key) is None]
+    batch = None
+
+    def compute(query):
+        async def run():
+            nonlocal batch
+            if query not in pending:
+                # Vencio entre el peek y ahora
+                return await _product_lookup(query, filter)
+            if batch is None:
+                batch = asyncio.ensure_future(_product_lookup_many(pending, filter))
+            return (await batch)[pending.index(query)]
+        return run
+
+    results = await asyncio.gather(*(
+        lookup_cache.get_or_compute(key, compute(query)) for query, key in zip(queries, keys)
+    ))
+    return "\n\n".join(f"{query}:\n{result}" for query, result in zip(queries, results))
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def table(monkeypatch):
+    """Empty product table in place of the process-wide one"""
+    from backend import cart
+    from backend.tools.product_table import ProductTable
+
+    table = ProductTable()
+    monkeypatch.setattr(cart, 'product_table', table)
+    return table
+
+
+@pytest.fixture
+def match():
+    """Index metadata of a catalog product, as product_lookup_tool gets it"""
+    def make(name, price, link=None):
+        return {
+            'product_name': name,
+            'price': price,
+            'price_with_discount': '',
+            'link': link or f"https://www.cotodigital.com.ar/sitios/cdigi/productos/{name.lower().replace(' ', '-')}",
+            'image': '',
+        }
+    return make
@@ -0,0 +1,145 @@
+from backend import cart
+from backend.tools.catalog import product_id
+
+
+def add(table, metadata, cantidad=1, current=()):
+    handle = table.register_match(metadata)
+    return cart.apply_tool_call(list(current), {'name': 'add_product', 'args': {'producto': handle, 'cantidad': cantidad}})
+
+
+def test_parse_price():
+    assert cart.parse_price(2024.25) == 2024.25
+    assert cart.parse_price(1200) == 1200.0
+    assert cart.parse_price('$2.024,25') == 2024.25
+    # El punto siempre es de miles
+    assert cart.parse_price('$2.024') == 2024.0
+    assert cart.parse_price('$ 999,9') == 999.9
+    assert cart.parse_price('') == 0.0
+    assert cart.parse_price('sin precio') == 0.0
+
+
+def test_format_price():
+    assert cart.format_price(2024.25) == '$2.024,25'
+    assert cart.format_price(1200) == '$1.200,00'
+
+
+def test_from_json_formats():
+    item = {'nombre': 'Leche', 'precio': '$1.200,50', 'cantidad': 2, 'link': 'https://x/leche'}
+    expected = [{'product_id': product_id('https://x/leche'), 'nombre': 'Leche', 'precio': 1200.5,
+                 'cantidad': 2, 'link': 'https://x/leche'}]
+    assert cart.from_json([item]) == expected
+    assert cart.from_json({'carrito': [item]}) == expected
+    assert cart.from_json(cart.to_json([item])) == expected
+    assert cart.from_json('') == []
+    assert cart.from_json(None) == []
+
+
+def test_from_json_clamps_quantity():
+    assert cart.from_json([{'nombre': 'Pan', 'precio': 10, 'cantidad': 0, 'link': 'https://x/pan'}])[0]['cantidad'] == 1
+
+
+def test_total():
+    items = [
+        {'nombre': 'Leche', 'precio': 1200.5, 'cantidad': 2, 'link': 'https://x/leche'},
+        {'nombre': 'Pan', 'precio': 999.99, 'cantidad': 1, 'link': 'https://x/pan'},
+    ]
+    assert cart.total(items) == 3400.99
+    assert cart.total([]) == 0
+
+
+def test_add_product(table, match):
+    items, message = add(table, match('Leche Entera', 1200.0), cantidad=2)
+    assert items == [{
+        'product_id': product_id(match('Leche Entera', 0)['link']),
+        'nombre': 'Leche Entera',
+        'precio': 1200.0,
+        'cantidad': 2,
+        'link': match('Leche Entera', 0)['link'],
+    }]
+    assert message == 'Agregado: Leche Entera x2. Total: $2.400,00'
+
+
+def test_add_existing_product_adds_quantity_at_current_price(table, match):
+    items, _ = add(table, match('Leche Entera', 1000.0))
+    items, message = add(table, match('Leche Entera', 1200.0), cantidad=2, current=items)
+    assert len(items) == 1
+    assert items[0]['cantidad'] == 3
+    assert items[0]['precio'] == 1200.0
+    assert message == 'Ahora hay 3 de Leche Entera en el carrito. Total: $3.600,00'
+
+
+def test_add_does_not_modify_the_previous_cart(table, match):
+    before, _ = add(table, match('Leche Entera', 1000.0))
+    after, _ = add(table, match('Leche Entera', 1000.0), current=before)
+    assert before[0]['cantidad'] == 1
+    assert after[0]['cantidad'] == 2
+
+
+def test_add_rejects_non_positive_quantities(table, match):
+    items, message = add(table, match('Leche Entera', 1000.0), cantidad=0)
+    assert items == []
+    assert message.startswith('ERROR')
+
+
+def test_add_unknown_handle(table):
+    items, message = cart.apply_tool_call([], {'name': 'add_product', 'args': {'producto': 'p00000000'}})
+    assert items == []
+    assert message.startswith('ERROR: no hay ningún producto p00000000')
+
+
+def test_add_needs_catalog_data(table):
+    # Un producto que solo se vio en un carrito viejo no se agrega con su precio de entonces
+    old = {'product_id': product_id('https://x/leche'), 'nombre': 'Leche', 'precio': 10.0,
+           'cantidad': 1, 'link': 'https://x/leche'}
+    handle = table.register_cart_item(old)
+    items, message = cart.apply_tool_call([], {'name': 'add_product', 'args': {'producto': handle}})
+    assert items == []
+    assert message.startswith('ERROR')
+
+
+def test_remove_product(table, match):
+    items, _ = add(table, match('Leche Entera', 1000.0))
+    handle = table.register_match(match('Leche Entera', 1000.0))
+
+    items, message = cart.apply_tool_call(items, {'name': 'remove_product', 'args': {'producto': handle}})
+    assert items == []
+    assert message == 'Quitado: Leche Entera. Total: $0,00'
+
+    _, message = cart.apply_tool_call(items, {'name': 'remove_product', 'args': {'producto': handle}})
+    assert message == f'No hay ningún producto {handle} en el carrito'
+
+
+def test_refs_by_link_and_name(table, match):
+    leche = match('Leche Entera', 1000.0)
+    items, _ = add(table, leche)
+    assert cart.change_item_quantity(items, leche['link'], 4)[0][0]['cantidad'] == 4
+    assert cart.remove_item(items, 'leche entera')[0] == []
+
+
+def test_change_quantity(table, match):
+    items, _ = add(table, match('Leche Entera', 1000.0))
+    handle = table.register_match(match('Leche Entera', 1000.0))
+
+    items, message = cart.apply_tool_call(items, {'name': 'change_quantity', 'args': {'producto': handle, 'cantidad': 5}})
+    assert items[0]['cantidad'] == 5
+    assert message == 'Ahora hay 5 de Leche Entera en el carrito. Total: $5.000,00'
+
+    # 0 lo quita del carrito
+    items, _ = cart.apply_tool_call(items, {'name': 'change_quantity', 'args': {'producto': handle, 'cantidad': 0}})
+    assert items == []
+
+
+def test_invalid_arguments(table):
+    _, message = cart.apply_tool_call([], {'name': 'change_quantity', 'args': {'producto': 'p1'}})
+    assert message.startswith('ERROR: argumentos inválidos para change_quantity')
+    _, message = cart.apply_tool_call([], {'name': 'empty_cart', 'args': {}})
+    assert message == 'ERROR: tool desconocida empty_cart'
+
+
+def test_format_cart(table, match):
+    items, _ = add(table, match('Leche Entera', 1000.0), cantidad=2)
+    link = items[0]['link']
+    assert cart.format_cart(items) == f"- Leche Entera x2: $2.000,00 ({link})\nTotal: $2.000,00"
+    handle = table.register_match(match('Leche Entera', 1000.0))
+    assert cart.format_cart(items, links=False) == f"- Leche Entera x2: $2.000,00 [{handle}]\nTotal: $2.000,00"
+    assert cart.format_cart([]) == "El carrito está vacío."
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from backend.cart_store import CartChanges, diff, upsert_params, completed_cart
+
+
+def item(pid, cantidad=1, precio=100.0):
+    return {'product_id': pid, 'nombre': pid.title(), 'precio': precio, 'cantidad': cantidad,
+            'link': f'https://x/{pid}'}
+
+
+def test_no_changes():
+    cart = [item('leche'), item('pan')]
+    changes = diff(cart, [dict(i) for i in cart])
+    assert not changes
+    assert changes == CartChanges()
+
+
+def test_added_changed_and_removed():
+    before = [item('leche'), item('pan'), item('queso')]
+    after = [item('leche', cantidad=2), item('queso'), item('yerba')]
+    changes = diff(before, after)
+    assert changes
+    assert changes.upserts == [item('leche', cantidad=2), item('yerba')]
+    assert changes.removed == ['pan']
+
+
+def test_price_change_is_an_upsert():
+    assert diff([item('leche')], [item('leche', precio=120.0)]).upserts == [item('leche', precio=120.0)]
+
+
+def test_empty_carts():
+    assert not diff(None, None)
+    assert diff(None, [item('leche')]).upserts == [item('leche')]
+    assert diff([item('leche')], []).removed == ['leche']
+
+
+def test_upsert_params():
+    changes = diff([], [item('leche', cantidad=3)])
+    assert upsert_params(7, changes) == [{
+        'cart_id': 7,
+        'product_id': 'leche',
+        'nombre': 'Leche',
+        'precio': 100.0,
+        'cantidad': 3,
+        'link': 'https://x/leche',
+    }]
+    assert upsert_params(7, CartChanges(removed=['pan'])) == []
+
+
+def test_completed_cart():
+    completed_at = datetime(2024, 11, 5, 10, 30)
+    row = {'cart_id': 7, 'items': [item('leche', cantidad=2)], 'total': '200.00', 'item_count': 1,
+           'completed_at': completed_at}
+    assert completed_cart(row) == {
+        'cart_id': 7,
+        'cart_items': [item('leche', cantidad=2)],
+        'total': 200.0,
+        'item_count': 1,
+        'completed_at': completed_at,
+    }
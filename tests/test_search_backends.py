@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from scipy import sparse as sp
+
+from backend.tools.catalog import build_filter
+from backend.tools.search_backends import LocalHybridBackend
+
+METADATA = [
+    {'product_name': 'Leche Entera', 'price': 1200.0, 'discount_pct': 0, 'category': 'lacteos'},
+    {'product_name': 'Yogur', 'price': 800.0, 'discount_pct': 20, 'category': 'lacteos'},
+    {'product_name': 'Pan', 'price': 1500.0, 'discount_pct': 10, 'category': 'panaderia-y-reposteria'},
+    # Producto de un índice viejo, sin descuento
+    {'product_name': 'Aceite', 'price': 3000.0, 'category': 'almacen'},
+]
+
+
+@pytest.fixture
+def backend():
+    n = len(METADATA)
+    vocab = np.array([11, 22], dtype=np.int64)
+    postings = sp.csr_matrix(np.array([[1, 0, 0, 0], [0, 0, 1, 1]], dtype=np.float32))
+    dense = np.eye(n, 3, dtype=np.float32)
+    return LocalHybridBackend(
+        ids=np.array([f'id{i}' for i in range(n)]), dense=dense, postings=postings, vocab=vocab,
+        metadata=METADATA,
+    )
+
+
+def names(backend, filter):
+    return [METADATA[i]['product_name'] for i in np.flatnonzero(backend._mask(filter))]
+
+
+def test_numeric_operators(backend):
+    assert names(backend, {'price': {'$lte': 1200}}) == ['Leche Entera', 'Yogur']
+    assert names(backend, {'price': {'$lt': 1200}}) == ['Yogur']
+    assert names(backend, {'price': {'$gt': 1200}}) == ['Pan', 'Aceite']
+    assert names(backend, {'price': {'$gte': 1500, '$lt': 3000}}) == ['Pan']
+    assert names(backend, {'price': {'$ne': 800}}) == ['Leche Entera', 'Pan', 'Aceite']
+
+
+def test_missing_values_do_not_match_comparisons(backend):
+    assert names(backend, {'discount_pct': {'$gte': 0}}) == ['Leche Entera', 'Yogur', 'Pan']
+    assert names(backend, {'discount_pct': {'$lt': 100}}) == ['Leche Entera', 'Yogur', 'Pan']
+
+
+def test_string_operators(backend):
+    assert names(backend, {'category': {'$eq': 'lacteos'}}) == ['Leche Entera', 'Yogur']
+    # Sin operador es $eq
+    assert names(backend, {'category': 'almacen'}) == ['Aceite']
+    assert names(backend, {'category': {'$in': ['almacen', 'panaderia-y-reposteria']}}) == ['Pan', 'Aceite']
+    assert names(backend, {'category': {'$nin': ['lacteos']}}) == ['Pan', 'Aceite']
+
+
+def test_and(backend):
+    filter = {'$and': [{'category': 'lacteos'}, {'discount_pct': {'$gte': 10}}]}
+    assert names(backend, filter) == ['Yogur']
+    assert names(backend, {'$and': [{'price': {'$lte': 1500}}], 'category': {'$ne': 'lacteos'}}) == ['Pan']
+
+
+def test_build_filter(backend):
+    filter = build_filter(max_price=1500, min_discount=10, category='lacteos')
+    assert names(backend, filter) == ['Yogur']
+
+
+def test_unsupported_operator(backend):
+    with pytest.raises(ValueError):
+        backend._mask({'price': {'$exists': True}})
+
+
+def test_query_only_returns_matches_of_the_filter(backend):
+    dense = [1.0, 0.0, 0.1]
+    sparse = {'indices': [22, 99], 'values': [0.5, 1.0]}
+    unfiltered = backend.query(dense, sparse, top_k=2)
+    assert [m['id'] for m in unfiltered] == ['id0', 'id2']
+
+    results = backend.query(dense, sparse, top_k=10, filter={'category': {'$ne': 'lacteos'}})
+    assert [m['id'] for m in results] == ['id2', 'id3']
+    assert results[0]['score'] == pytest.approx(0.6)
+    assert backend.query(dense, sparse, filter={'price': {'$gt': 5000}}) == []
+
+
+def test_query_many_matches_query(backend):
+    dense = [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0]]
+    sparse = [{'indices': [11], 'values': [2.0]}, {'indices': [], 'values': []}]
+    filter = {'price': {'$lte': 1500}}
+    expected = [backend.query(d, s, top_k=2, filter=filter) for d, s in zip(dense, sparse)]
+    assert backend.query_many(dense, sparse, top_k=2, filter=filter) == expected
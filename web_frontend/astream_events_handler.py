@@ -7,6 +7,9 @@ import sys
 
 
 from backend.graph import graph_runnable
+from backend.async_db import close_pool
+from backend.models import close_http_client
+from backend.tools.product_table import product_table
 
 
 async def invoke_our_graph(state, BOT_AVATAR): 
@@ -17,32 +20,42 @@ async def invoke_our_graph(state, BOT_AVATAR):
     with st.chat_message("assistant", avatar=BOT_AVATAR):
         chat_container = st.container()
 
-    async for event in graph_runnable.astream_events(state, version="v2"):
-        #if "parent_ids" in event:
-        #    continue
-        kind = event["event"]  
-        if kind == "on_chat_model_stream":
-
-            chunk = event["data"]["chunk"].content  
-
-            if event.get("metadata", {}).get("langgraph_node") in ["create_summary", "__start__"]:
-                continue
-
-            final_text += chunk  
-            chat_container = chat_container.empty()
-            chat_container.write(final_text)  
-
-        if kind == 'on_chain_end':
-            response = event['data']["output"]
-            if "messages" in response and "cart" in response and "preferences" in response:
-                # for cart:
-                final_response["cart"] = response["cart"]
-                # for preferences
-                final_response["preferences"] = response["preferences"]
-                # for AI message:
-                messages = response["messages"]
-                for msg in messages:
-                    if isinstance(msg, AIMessage):
-                        final_response["messages"] = msg        
+    try:
+        async for event in graph_runnable.astream_events(state, version="v2"):
+            #if "parent_ids" in event:
+            #    continue
+            kind = event["event"]  
+            if kind == "on_chat_model_stream":
+
+                chunk = event["data"]["chunk"].content  
+
+                if event.get("metadata", {}).get("langgraph_node") in ["create_summary", "__start__"]:
+                    continue
+
+                final_text += chunk  
+                chat_container = chat_container.empty()
+                # Los [handle] de productos se muestran como link
+                chat_container.write(product_table.rehydrate(final_text))
+
+            if kind == 'on_chain_end':
+                response = event['data']["output"]
+                if "messages" in response and "cart" in response and "preferences" in response:
+                    # for cart:
+                    final_response["cart"] = response["cart"]
+                    # for preferences
+                    final_response["preferences"] = response["preferences"]
+                    # for AI message:
+                    messages = response["messages"]
+                    for msg in messages:
+                        if isinstance(msg, AIMessage):
+                            final_response["messages"] = msg        
+    finally:
+        # Los nodos usan el pool async y el cliente HTTP de este loop, que asyncio.run cierra al terminar
+        await close_pool()
+        await close_http_client()
+
+    # Con SPECULATIVE_ROUTING la respuesta del modelo se genera durante el router y no se streamea
+    if not final_text and final_response["messages"]:
+        chat_container.write(final_response["messages"].content)
 
     return final_response
@@ -1,3 +1,4 @@
+import functools
 from flask import Flask
 from app.config import load_configurations, configure_logging
 from .views import webhook_blueprint
@@ -13,4 +14,9 @@ def create_app():
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Workers de la cola de mensajes entrantes: al arrancar retoman lo que quedó pendiente
+    from app.services.dispatcher import dispatcher
+    from app.utils.whatsapp_utils import handle_whatsapp_message
+    dispatcher.start(functools.partial(handle_whatsapp_message, app))
+
     return app
\ No newline at end of file
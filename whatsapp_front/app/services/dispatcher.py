@@ -0,0 +1,122 @@
+"""
+Webhook dispatcher
+
+El webhook guarda el mensaje en la cola persistente (app/services/inbound_queue.py) y responde
+200 enseguida. El turno (grafo, LLMs, asend_message) se procesa acá, en un event loop que corre
+en su propio thread y vive todo el proceso (así el pool async de la base y los clientes HTTP de
+los modelos se reutilizan entre turnos).
+
+- WHATSAPP_MAX_CONCURRENCY workers toman mensajes de la cola con claim(), así que usuarios
+  distintos se procesan en paralelo y los mensajes de un mismo usuario en orden
+- Si el handler falla el mensaje se reintenta con backoff; si el proceso se cae, cuando vence
+  el lease lo toma otro worker (o este mismo proceso al reiniciar)
+- Además del aviso del webhook, los workers consultan la cola cada INBOUND_POLL_SECONDS para
+  tomar reintentos y mensajes de otras instancias
+- dispatcher.stats() devuelve los contadores del proceso y las métricas de la cola
+"""
+import os
+import asyncio
+import logging
+import threading
+
+from app.services.inbound_queue import get_inbound_queue, coalesce_settings
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    def __init__(self, queue=None, max_concurrency=None):
+        self.max_concurrency = max_concurrency or int(os.getenv('WHATSAPP_MAX_CONCURRENCY', 8))
+        self.poll_interval = float(os.getenv('INBOUND_POLL_SECONDS', 1))
+        # Un mensaje que está esperando la ventana de agrupado se puede tomar apenas termina la ventana
+        coalesce_window = coalesce_settings()[0]
+        self.idle_wait = min(self.poll_interval, coalesce_window) if coalesce_window > 0 else self.poll_interval
+        self._queue = queue
+        self._loop = None
+        self._thread = None
+        self._wakeup = None
+        self._lock = threading.Lock()
+        # processed son turnos; messages los mensajes que respondieron (varios por turno si se agruparon)
+        self._stats = {'active': 0, 'processed': 0, 'messages': 0, 'errors': 0}
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            self._queue = get_inbound_queue()
+        return self._queue
+
+    def start(self, handler):
+        """Start the workers (only the first call does something). `handler(job)` processes one message"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, args=(handler, ready), name="whatsapp-dispatcher", daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+
+    def _run(self, handler, ready):
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        for _ in range(self.max_concurrency):
+            self._loop.create_task(self._worker(handler))
+        self._loop.create_task(self._purge())
+        self._loop.call_soon(ready.set)
+        self._loop.run_forever()
+
+    def notify(self):
+        """Wake up idle workers, there is a new message in the queue. Thread-safe"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker(self, handler):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except Exception:
+                logger.exception("Error claiming inbound message")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.idle_wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._stats['active'] += 1
+            try:
+                await handler(job)
+                await asyncio.to_thread(self.queue.complete, job)
+                self._stats['processed'] += 1
+                self._stats['messages'] += len(job['messages'])
+            except Exception as e:
+                logger.exception(f"Error processing message {job['msg_id']} from {job['wa_id']}")
+                self._stats['errors'] += 1
+                try:
+                    await asyncio.to_thread(self.queue.fail, job, e)
+                except Exception:
+                    # Si ni siquiera se pudo marcar, el lease vence y se reintenta igual
+                    logger.exception("Error marking inbound message as failed")
+            finally:
+                self._stats['active'] -= 1
+
+    async def _purge(self):
+        # Los mensajes ya procesados solo sirven para las métricas y para deduplicar re-entregas
+        retention = float(os.getenv('INBOUND_RETENTION_HOURS', 24 * 7)) * 3600
+        while True:
+            try:
+                await asyncio.to_thread(self.queue.purge, retention)
+            except Exception:
+                logger.exception("Error purging inbound messages")
+            await asyncio.sleep(3600)
+
+    def stats(self):
+        return dict(self._stats, max_concurrency=self.max_concurrency, queue=self.queue.metrics())
+
+
+dispatcher = Dispatcher()
@@ -0,0 +1,362 @@
+"""
+Inbound message queue
+
+Cola persistente para los mensajes que llegan por el webhook. Si el proceso se cae en medio de
+un turno el mensaje no se pierde: se vuelve a procesar cuando vence su lease.
+
+- enqueue es idempotente por msg_id: las re-entregas de Meta no se encolan dos veces
+- claim() toma el mensaje más viejo que se puede procesar y lo marca con un lease
+  (INBOUND_LEASE_SECONDS). Un mensaje solo se puede tomar si no hay mensajes anteriores del
+  mismo usuario sin terminar, así cada usuario se procesa en orden
+- fail() lo vuelve a dejar pendiente con backoff exponencial hasta INBOUND_MAX_ATTEMPTS
+  intentos; después queda como 'failed' y no bloquea los mensajes siguientes del usuario
+- mark_delivered() guarda cuánto de la respuesta ya se le mandó al usuario (job['delivered']),
+  así un reintento por un envío fallido no repite lo que ya llegó
+- Los mensajes seguidos de un usuario se agrupan en un solo job ("hola", "necesito leche",
+  "y pan" -> un turno del grafo): un usuario no se toma hasta que pasan COALESCE_WINDOW_MS sin
+  mensajes nuevos (o COALESCE_MAX_WAIT_MS desde el primero), y claim() se lleva todos sus
+  mensajes pendientes, hasta COALESCE_MAX_MESSAGES. Los que llegan mientras se procesa un turno
+  forman el job siguiente
+- metrics() devuelve profundidad de la cola y lag de procesamiento
+
+Backends (INBOUND_QUEUE_BACKEND):
+- sqlite (default): un archivo local (INBOUND_QUEUE_PATH), para una sola instancia
+- postgres: la tabla inbound_messages (backend/migrations/002_inbound_messages.sql), para
+  varias instancias contra la misma base
+"""
+import os
+import time
+import sqlite3
+import threading
+
+DEFAULT_QUEUE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'inbound_queue.sqlite3'
+)
+
+
+def lease_seconds():
+    return float(os.getenv('INBOUND_LEASE_SECONDS', 300))
+
+
+def max_attempts():
+    return int(os.getenv('INBOUND_MAX_ATTEMPTS', 5))
+
+
+def coalesce_settings():
+    """(window, max_wait) in seconds and max messages per job"""
+    window = float(os.getenv('COALESCE_WINDOW_MS', 1000)) / 1000
+    max_wait = float(os.getenv('COALESCE_MAX_WAIT_MS', 5000)) / 1000
+    return window, max_wait, int(os.getenv('COALESCE_MAX_MESSAGES', 10))
+
+
+def _job(rows):
+    """Group the claimed rows of one user into a job"""
+    rows = sorted((dict(row) for row in rows), key=lambda row: row['seq'])
+    return {
+        'wa_id': rows[0]['wa_id'],
+        'msg_id': rows[0]['msg_id'],
+        'seqs': [row['seq'] for row in rows],
+        'messages': [{'msg_id': row['msg_id'], 'body': row['body']} for row in rows],
+        'attempts': max(row['attempts'] for row in rows),
+        'delivered': max(row['delivered'] for row in rows),
+        'enqueued_at': float(min(row['enqueued_at'] for row in rows)),
+    }
+
+
+def retry_delay(attempts):
+    """Exponential backoff: 2s, 4s, 8s... up to 5 minutes"""
+    base = float(os.getenv('INBOUND_RETRY_BASE_SECONDS', 2))
+    return min(base * 2 ** (attempts - 1), 300.0)
+
+
+class SQLiteInboundQueue:
+    name = 'sqlite'
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('INBOUND_QUEUE_PATH') or DEFAULT_QUEUE_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS inbound_messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                msg_id TEXT NOT NULL UNIQUE,
+                wa_id TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                completed_at REAL,
+                delivered INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_inbound_messages_open
+                ON inbound_messages (status, seq) WHERE status IN ('pending', 'processing');
+            CREATE INDEX IF NOT EXISTS idx_inbound_messages_wa_id_open
+                ON inbound_messages (wa_id, seq) WHERE status IN ('pending', 'processing');
+        """)
+        # Archivos creados antes de que existiera la columna
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(inbound_messages)")}
+        if 'delivered' not in columns:
+            self._conn.execute("ALTER TABLE inbound_messages ADD COLUMN delivered INTEGER NOT NULL DEFAULT 0")
+
+    def enqueue(self, msg_id, wa_id, body):
+        """Return True if the message was queued, False if it was already there"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute("""
+                INSERT INTO inbound_messages (msg_id, wa_id, body, enqueued_at, available_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (msg_id) DO NOTHING
+            """, (msg_id, wa_id, body, now, now))
+            return cur.rowcount == 1
+
+    def claim(self, lease=None):
+        """Lease the next job (the pending messages of one user), or None"""
+        now = time.time()
+        lease = lease or lease_seconds()
+        window, max_wait, max_messages = coalesce_settings()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                head = self._conn.execute("""
+                    SELECT seq, wa_id FROM inbound_messages m
+                    WHERE status IN ('pending', 'processing')
+                      AND available_at <= :now
+                      AND (status = 'pending' OR lease_until < :now)
+                      AND NOT EXISTS (
+                          SELECT 1 FROM inbound_messages o
+                          WHERE o.wa_id = m.wa_id AND o.status IN ('pending', 'processing') AND o.seq < m.seq
+                      )
+                      AND (enqueued_at <= :now - :max_wait OR NOT EXISTS (
+                          SELECT 1 FROM inbound_messages n
+                          WHERE n.wa_id = m.wa_id AND n.status = 'pending' AND n.enqueued_at > :now - :window
+                      ))
+                    ORDER BY seq
+                    LIMIT 1
+                """, {'now': now, 'window': window, 'max_wait': max_wait}).fetchone()
+
+                rows = []
+                if head is not None:
+                    rows = self._conn.execute("""
+                        SELECT seq, msg_id, wa_id, body, attempts + 1 AS attempts, enqueued_at, delivered FROM inbound_messages
+                        WHERE wa_id = :wa_id AND seq >= :seq
+                          AND (seq = :seq OR (available_at <= :now AND (
+                              status = 'pending' OR (status = 'processing' AND lease_until < :now)
+                          )))
+                        ORDER BY seq
+                        LIMIT :max_messages
+                    """, {'wa_id': head['wa_id'], 'seq': head['seq'], 'now': now, 'max_messages': max_messages}).fetchall()
+                    self._conn.executemany("""
+                        UPDATE inbound_messages
+                        SET status = 'processing', attempts = attempts + 1, lease_until = ?
+                        WHERE seq = ?
+                    """, [(now + lease, row['seq']) for row in rows])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return _job(rows) if rows else None
+
+    def complete(self, job):
+        with self._lock:
+            now = time.time()
+            self._conn.executemany("""
+                UPDATE inbound_messages
+                SET status = 'done', completed_at = ?, lease_until = NULL
+                WHERE seq = ?
+            """, [(now, seq) for seq in job['seqs']])
+
+    def mark_delivered(self, job, delivered):
+        with self._lock:
+            self._conn.executemany("""
+                UPDATE inbound_messages SET delivered = ? WHERE seq = ?
+            """, [(delivered, seq) for seq in job['seqs']])
+
+    def fail(self, job, error):
+        now = time.time()
+        if job['attempts'] >= max_attempts():
+            status, available_at = 'failed', now
+        else:
+            status, available_at = 'pending', now + retry_delay(job['attempts'])
+        with self._lock:
+            self._conn.executemany("""
+                UPDATE inbound_messages
+                SET status = ?, available_at = ?, lease_until = NULL, last_error = ?
+                WHERE seq = ?
+            """, [(status, available_at, str(error), seq) for seq in job['seqs']])
+
+    def purge(self, older_than):
+        """Delete messages processed more than `older_than` seconds ago"""
+        with self._lock:
+            cur = self._conn.execute("""
+                DELETE FROM inbound_messages WHERE status = 'done' AND completed_at < ?
+            """, (time.time() - older_than,))
+            return cur.rowcount
+
+    def metrics(self):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM inbound_messages WHERE status = 'pending') AS pending,
+                    (SELECT COUNT(*) FROM inbound_messages WHERE status = 'processing') AS processing,
+                    (SELECT COUNT(*) FROM inbound_messages WHERE status = 'failed') AS failed,
+                    (SELECT MIN(enqueued_at) FROM inbound_messages
+                      WHERE status IN ('pending', 'processing')) AS oldest_open,
+                    (SELECT AVG(completed_at - enqueued_at) FROM (
+                        SELECT completed_at, enqueued_at FROM inbound_messages
+                        WHERE status = 'done' ORDER BY completed_at DESC LIMIT 100
+                    )) AS avg_lag
+            """).fetchone()
+        return _metrics(row, now)
+
+
+class PostgresInboundQueue:
+    name = 'postgres'
+
+    def _execute(self, query, params=(), fetch=None):
+        from psycopg2.extras import RealDictCursor
+        from backend.db import get_db_connection
+
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, params)
+                if fetch == 'one':
+                    return cur.fetchone()
+                if fetch == 'all':
+                    return cur.fetchall()
+                return cur.rowcount
+
+    def enqueue(self, msg_id, wa_id, body):
+        return self._execute("""
+            INSERT INTO inbound_messages (msg_id, wa_id, body)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (msg_id) DO NOTHING
+        """, (msg_id, wa_id, body)) == 1
+
+    def claim(self, lease=None):
+        window, max_wait, max_messages = coalesce_settings()
+        # SKIP LOCKED: varias instancias pueden hacer claim a la vez sin bloquearse
+        rows = self._execute("""
+            WITH head AS (
+                SELECT seq, wa_id FROM inbound_messages m
+                WHERE status IN ('pending', 'processing')
+                  AND available_at <= CURRENT_TIMESTAMP
+                  AND (status = 'pending' OR lease_until < CURRENT_TIMESTAMP)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM inbound_messages o
+                      WHERE o.wa_id = m.wa_id AND o.status IN ('pending', 'processing') AND o.seq < m.seq
+                  )
+                  AND (enqueued_at <= CURRENT_TIMESTAMP - make_interval(secs => %(max_wait)s) OR NOT EXISTS (
+                      SELECT 1 FROM inbound_messages n
+                      WHERE n.wa_id = m.wa_id AND n.status = 'pending'
+                        AND n.enqueued_at > CURRENT_TIMESTAMP - make_interval(secs => %(window)s)
+                  ))
+                ORDER BY seq
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            ),
+            batch AS (
+                SELECT i.seq FROM inbound_messages i, head
+                WHERE i.wa_id = head.wa_id AND i.seq >= head.seq
+                  AND (i.seq = head.seq OR (i.available_at <= CURRENT_TIMESTAMP AND (
+                      i.status = 'pending' OR (i.status = 'processing' AND i.lease_until < CURRENT_TIMESTAMP)
+                  )))
+                ORDER BY i.seq
+                LIMIT %(max_messages)s
+                FOR UPDATE OF i SKIP LOCKED
+            )
+            UPDATE inbound_messages
+            SET status = 'processing', attempts = attempts + 1,
+                lease_until = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s)
+            WHERE seq IN (SELECT seq FROM batch)
+            RETURNING seq, msg_id, wa_id, body, attempts, EXTRACT(EPOCH FROM enqueued_at) AS enqueued_at, delivered
+        """, {
+            'window': window, 'max_wait': max_wait, 'max_messages': max_messages,
+            'lease': lease or lease_seconds(),
+        }, fetch='all')
+        return _job(rows) if rows else None
+
+    def complete(self, job):
+        self._execute("""
+            UPDATE inbound_messages
+            SET status = 'done', completed_at = CURRENT_TIMESTAMP, lease_until = NULL
+            WHERE seq = ANY(%s)
+        """, (job['seqs'],))
+
+    def mark_delivered(self, job, delivered):
+        self._execute("""
+            UPDATE inbound_messages SET delivered = %s WHERE seq = ANY(%s)
+        """, (delivered, job['seqs']))
+
+    def fail(self, job, error):
+        if job['attempts'] >= max_attempts():
+            status, delay = 'failed', 0
+        else:
+            status, delay = 'pending', retry_delay(job['attempts'])
+        self._execute("""
+            UPDATE inbound_messages
+            SET status = %s, available_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                lease_until = NULL, last_error = %s
+            WHERE seq = ANY(%s)
+        """, (status, delay, str(error), job['seqs']))
+
+    def purge(self, older_than):
+        return self._execute("""
+            DELETE FROM inbound_messages
+            WHERE status = 'done' AND completed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """, (older_than,))
+
+    def metrics(self):
+        row = self._execute("""
+            SELECT
+                (SELECT COUNT(*) FROM inbound_messages WHERE status = 'pending') AS pending,
+                (SELECT COUNT(*) FROM inbound_messages WHERE status = 'processing') AS processing,
+                (SELECT COUNT(*) FROM inbound_messages WHERE status = 'failed') AS failed,
+                (SELECT EXTRACT(EPOCH FROM MIN(enqueued_at)) FROM inbound_messages
+                  WHERE status IN ('pending', 'processing')) AS oldest_open,
+                (SELECT EXTRACT(EPOCH FROM AVG(completed_at - enqueued_at)) FROM (
+                    SELECT completed_at, enqueued_at FROM inbound_messages
+                    WHERE status = 'done' ORDER BY completed_at DESC LIMIT 100
+                ) recent) AS avg_lag,
+                EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) AS now
+        """, fetch='one')
+        return _metrics(row, float(row['now']))
+
+
+def _metrics(row, now):
+    oldest_open = row['oldest_open']
+    return {
+        'depth': row['pending'] + row['processing'],
+        'pending': row['pending'],
+        'processing': row['processing'],
+        'failed': row['failed'],
+        # Cuánto hace que espera el mensaje sin terminar más viejo
+        'oldest_open_age': now - float(oldest_open) if oldest_open is not None else 0.0,
+        # Promedio entre que llegó y terminó de procesarse, últimos 100 mensajes
+        'avg_lag': float(row['avg_lag'] or 0.0),
+    }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_inbound_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                backend = os.getenv('INBOUND_QUEUE_BACKEND', 'sqlite')
+                if backend == 'postgres':
+                    _queue = PostgresInboundQueue()
+                elif backend == 'sqlite':
+                    _queue = SQLiteInboundQueue()
+                else:
+                    raise ValueError(f"Unknown INBOUND_QUEUE_BACKEND: {backend}")
+    return _queue
@@ -0,0 +1,105 @@
+"""
+Mock Graph API
+
+Servidor HTTP local que imita el endpoint /{version}/{phone_number_id}/messages, para probar y
+medir el cliente de app/services/whatsapp_client.py sin red:
+
+    with MockGraphAPI(latency=0.05, error_rate=0.05, rate_limit=80) as api:
+        client = WhatsAppClient("token", "v21.0", "123", base_url=api.url)
+
+- latency: segundos que tarda cada respuesta
+- error_rate: fracción de requests que responden error_status (500 por defecto)
+- rate_limit: mensajes por segundo a partir de los cuales responde 429 con Retry-After
+- retry_after: valor del header Retry-After de los 429 y 503 (None para no mandarlo)
+"""
+import json
+import time
+import random
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockGraphAPI:
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=None, retry_after=1, error_status=500):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests = 0
+        self.responses = {}
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _status(self):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1:
+                self._recent.popleft()
+            if self.rate_limit is not None and len(self._recent) >= self.rate_limit:
+                status = 429
+            elif random.random() < self.error_rate:
+                status = self.error_status
+            else:
+                status = 200
+                self._recent.append(now)
+            self.responses[status] = self.responses.get(status, 0) + 1
+            return status
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if api.latency:
+                    time.sleep(api.latency)
+
+                status = api._status()
+                if status == 200:
+                    to = json.loads(body or b'{}').get('to')
+                    payload = {"messaging_product": "whatsapp", "contacts": [{"input": to, "wa_id": to}],
+                               "messages": [{"id": f"wamid.mock{api.requests}"}]}
+                else:
+                    payload = {"error": {"message": "mock error", "code": status}}
+
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if status in (429, 503) and api.retry_after is not None:
+                    self.send_header('Retry-After', str(api.retry_after))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
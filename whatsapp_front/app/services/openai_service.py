@@ -5,54 +5,99 @@ import asyncio  # Import asyncio
 
 from langchain_core.messages import AIMessage, HumanMessage
 from backend.graph import graph_runnable
+from backend import summarizer
 
-from backend.db import load_cart, load_preferences, load_summaries, load_old_carts, load_chat_history, load_key, save_preferences, save_cart, save_message
+from backend.async_db import load_session_context, save_preferences, save_message, save_cart_changes
+from backend.cart_store import diff
+from backend.tools.product_table import StreamRehydrator
 
 
-async def invoke_our_graph(state): 
+# Los chunks de estos nodos no son parte de la respuesta (router, resumen de la compra)
+SKIP_STREAM_NODES = ["__start__", "create_summary"]
+
+
+async def invoke_our_graph(state, on_chunk=None): 
+    """
+    Run the graph. With on_chunk, the answer is streamed: every text chunk of the models that write
+    the reply is passed to `await on_chunk(text, run_id)` as soon as it arrives. run_id identifies
+    the model call: calls that end in tool calls can stream text too, and only the last one is the
+    reply that gets saved
+    """
     final_response = {"messages": [], "cart": [], "preferences": ""}
 
-    response = await graph_runnable.ainvoke(state)
+    if on_chunk is None:
+        response = await graph_runnable.ainvoke(state)
+    else:
+        # Los [handle] de productos se reemplazan por el link antes de mandar cada chunk
+        rehydrator = StreamRehydrator()
+        run_id = None
+        response = {}
+        async for event in graph_runnable.astream_events(state, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                if event.get("metadata", {}).get("langgraph_node") in SKIP_STREAM_NODES:
+                    continue
+                if event["run_id"] != run_id:
+                    # Lo que quedó pendiente de la llamada anterior no se mezcla con esta
+                    rest = rehydrator.flush()
+                    if rest:
+                        await on_chunk(rest, run_id)
+                    run_id = event["run_id"]
+                chunk = rehydrator.feed(event["data"]["chunk"].content)
+                if chunk:
+                    await on_chunk(chunk, run_id)
+
+            # El on_chain_end sin padres es el del grafo completo: trae el estado final
+            if kind == "on_chain_end" and not event.get("parent_ids"):
+                response = event["data"]["output"]
+        rest = rehydrator.flush()
+        if rest:
+            await on_chunk(rest, run_id)
     
-    # Since we're not streaming anymore, we can directly process the response
     if "messages" in response and "preferences" in response: 
         final_response["messages"] = response["messages"]
         final_response["preferences"] = response["preferences"]
+        final_response["cart"] = response.get("cart", [])
     return final_response
 
-def generate_response(message_body, wa_id, msg_id):
-    # aca llega el ultimo mensaje solo
-
-    save_message(wa_id, "user", message_body, msg_id)
-    
-    messages = load_chat_history(wa_id)
-    messages.append(HumanMessage(content=message_body))
-
-    user_preferences = load_preferences(wa_id)
-    summaries = load_summaries(wa_id)
-    old_carts = load_old_carts(wa_id)
-    key = load_key(wa_id)
-
-    # Run the assistant and get the new message
-    state = {
-        "messages": messages,
-        "user_id": wa_id,
-        "preferences": user_preferences,
-        "summaries": summaries,
-        "old_carts": old_carts,
-        "key": key
-    }
-
-    response = asyncio.run(invoke_our_graph(state))
+async def agenerate_response(wa_id, messages, already_saved=(), on_chunk=None):
+    """
+    Run one graph turn for one or more consecutive user messages ([{'msg_id', 'body'}], oldest first).
+    already_saved are msg_ids that a previous attempt already stored in chat_messages.
+    on_chunk receives the reply while it is generated (see invoke_our_graph).
+    """
+    # Los mensajes agrupados se guardan en orden; el último va con la query de contexto
+    *previous, last = messages
+    for message in previous:
+        if message["msg_id"] not in already_saved:
+            await save_message(wa_id, "user", message["body"], message["msg_id"])
+
+    if last["msg_id"] in already_saved:
+        # Reintento de un mensaje que ya se guardó: ya es el último del historial
+        context = await load_session_context(wa_id)
+        state = context.to_state()
+    else:
+        # Guarda el mensaje y trae historial, preferencias, resúmenes, carritos y clave en un solo round trip
+        context = await load_session_context(wa_id, new_message=last["body"], msg_id=last["msg_id"])
+
+        # Run the assistant and get the new message
+        state = context.to_state([HumanMessage(content=last["body"])])
+
+    response = await invoke_our_graph(state, on_chunk=on_chunk)
     new_message = response["messages"][-1].content
 
-    save_message(wa_id, "assistant", new_message, '')
-
     user_preferences = response["preferences"]
-    save_preferences(wa_id, user_preferences)
+    await save_preferences(wa_id, user_preferences)
 
-    # key = state["key"]
+    # Solo los items del carrito activo que cambiaron en el turno
+    await save_cart_changes(wa_id, diff(context.cart, response["cart"]))
 
-    return new_message
+    # La respuesta se guarda al final: si está en chat_messages el turno terminó (ver load_reply)
+    await save_message(wa_id, "assistant", new_message, '')
 
+    # Resumen incremental de la conversación, en background
+    summarizer.schedule(wa_id)
 
+    # key = state["key"]
+
+    return new_message
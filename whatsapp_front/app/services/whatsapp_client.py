@@ -0,0 +1,166 @@
+"""
+Outbound WhatsApp client
+
+Cliente para mandar mensajes por la Graph API:
+- Una requests.Session por cliente con pool de conexiones keep-alive (WHATSAPP_HTTP_POOL)
+- Rate limit con token bucket (WHATSAPP_RATE_LIMIT mensajes por segundo, por defecto 80, el
+  límite de la Cloud API por número)
+- Reintentos con backoff exponencial y jitter (WHATSAPP_MAX_RETRIES) solo cuando el mensaje
+  seguro no se mandó: 429, 503 con Retry-After y errores al conectar. El POST no es idempotente,
+  así que otros 5xx, timeouts de lectura y conexiones cortadas no se reintentan acá (se
+  reintenta el job de la cola, ver whatsapp_utils.handle_whatsapp_message)
+- asend() para mandar desde el event loop sin bloquearlo
+
+La URL base se puede cambiar con GRAPH_API_URL (p. ej. para usar el mock de
+app/services/mock_graph_api.py y medir throughput sin red, ver bench_send.py).
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+
+class WhatsAppSendError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class WhatsAppClient:
+    def __init__(self, access_token, version, phone_number_id, base_url=None,
+                 rate_limit=None, max_retries=None, timeout=10, pool_size=None):
+        base_url = base_url or os.getenv('GRAPH_API_URL', 'https://graph.facebook.com')
+        self.url = f"{base_url.rstrip('/')}/{version}/{phone_number_id}/messages"
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('WHATSAPP_MAX_RETRIES', 5))
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit or float(os.getenv('WHATSAPP_RATE_LIMIT', 80)))
+
+        pool_size = pool_size or int(os.getenv('WHATSAPP_HTTP_POOL', 20))
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            "Content-type": "application/json",
+            "Authorization": f"Bearer {access_token}",
+        })
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="whatsapp-send")
+        self._stats_lock = threading.Lock()
+        self._stats = {'sent': 0, 'retries': 0, 'failed': 0, 'rate_limited': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` (1, 2, ...): full jitter, or Retry-After if given"""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+
+    def send(self, data):
+        """POST a message payload (JSON string). Returns the response or raises WhatsAppSendError"""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            retry_after = None
+            try:
+                response = self.session.post(self.url, data=data, timeout=self.timeout)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error, status_code = f"{type(e).__name__}: {e}", None
+                if not _not_sent(e):
+                    self._count('failed')
+                    raise WhatsAppSendError(error, status_code)
+            else:
+                if response.ok:
+                    self._count('sent')
+                    return response
+                error, status_code = f"HTTP {response.status_code}: {response.text[:200]}", response.status_code
+                retry_after = _retry_after(response)
+                if status_code == 429:
+                    self._count('rate_limited')
+                elif not (status_code == 503 and retry_after is not None):
+                    self._count('failed')
+                    raise WhatsAppSendError(error, status_code)
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self._count('failed')
+                raise WhatsAppSendError(f"Giving up after {self.max_retries} retries: {error}", status_code)
+
+            delay = self.backoff(attempt, retry_after)
+            logger.warning(f"WhatsApp send failed ({error}), retry {attempt} in {delay:.2f}s")
+            self._count('retries')
+            time.sleep(delay)
+
+    async def asend(self, data):
+        # Executor propio del tamaño del pool: el default de asyncio tiene pocos threads en máquinas chicas
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.send, data)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+def _not_sent(error):
+    """True if the request failed before reaching the server (it is safe to POST it again)"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_whatsapp_client(config):
+    """Shared client for the app config (ACCESS_TOKEN, VERSION, PHONE_NUMBER_ID)"""
+    key = (config['ACCESS_TOKEN'], config['VERSION'], config['PHONE_NUMBER_ID'])
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = WhatsAppClient(*key)
+                _clients[key] = client
+    return client
@@ -1,13 +1,11 @@
 import logging
-from flask import current_app, jsonify
 import json
-import requests
+import asyncio
+import os
 
-# from app.services.openai_service import generate_response
 import re
 
 
-
 def log_http_response(response):
     logging.info(f"Status: {response.status_code}")
     logging.info(f"Content-type: {response.headers.get('content-type')}")
@@ -25,31 +23,16 @@ def get_text_message_input(recipient, text):
         }
     )
 
-def send_message(data):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-
-    try:
-        response = requests.post(
-            url, data=data, headers=headers, timeout=10
-        )  # 10 seconds timeout as an example
-        response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-    except requests.Timeout:
-        logging.error("Timeout occurred while sending message")
-        return jsonify({"status": "error", "message": "Request timed out"}), 408
-    except (
-        requests.RequestException
-    ) as e:  # This will catch any general request exception
-        logging.error(f"Request failed due to: {e}")
-        return jsonify({"status": "error", "message": "Failed to send message"}), 500
-    else:
-        # Process the response as normal
-        log_http_response(response)
-        return response
+def get_typing_indicator_input(message_id):
+    # Marca el mensaje como leído y muestra "escribiendo..." hasta que llega la respuesta (máx. 25s)
+    return json.dumps(
+        {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id,
+            "typing_indicator": {"type": "text"},
+        }
+    )
 
 
 def process_text_for_whatsapp(text):
@@ -70,39 +53,187 @@ def process_text_for_whatsapp(text):
     return whatsapp_style_text
 
 
+def get_recipient(wa_id):
+    # creo que aca en vez usar recipient waid tengo que ponerle yo un unique identifier. este unique tiene que ser el nro de telefeno.
+    # si no me equivoco puedo usar la variable wa_id
+    #data = get_text_message_input(current_app.config["RECIPIENT_WAID"], response)
+    #wa_id = "5491149276686"
+    remover = "54911"
+
+    input = wa_id.replace(remover, "")
+    input = "+541115" + input
+    print(f"wa_id: {wa_id}")
+    print(f"input: {input}")
+    return input
+
+
 def process_whatsapp_message(body):
+    """Acknowledge fast: save the message in the inbound queue, the dispatcher answers it in the background"""
     wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
     name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
     message = body["entry"][0]["changes"][0]["value"]["messages"][0]
     message_body = message["text"]["body"]
     print(f"nombre: {name}")
-    from app.services.openai_service import generate_response  # Add this import
     print(message_body)
 
     msg_id = message["id"]
 
-    # antes de generate_response debo verificar que msg_id no exista, si ya existe debo hacer nada.
-    from backend.db import check_duplicated
-    is_duplicated = check_duplicated(wa_id, msg_id)
+    from app.services.dispatcher import dispatcher
 
-    if is_duplicated:
+    # El enqueue es idempotente por msg_id: si Meta re-entrega el mensaje no se procesa dos veces
+    if not dispatcher.queue.enqueue(msg_id, wa_id, message_body):
         return 'duplicado'
-    else:
-        print("no duplicado")
-        response = generate_response(message_body, wa_id,msg_id)
-        response = process_text_for_whatsapp(response)
-        # creo que aca en vez usar recipient waid tengo que ponerle yo un unique identifier. este unique tiene que ser el nro de telefeno.
-        # si no me equivoco puedo usar la variable wa_id
-        #data = get_text_message_input(current_app.config["RECIPIENT_WAID"], response)
-        #wa_id = "5491149276686"
-        remover = "54911"
-
-        input = wa_id.replace(remover, "")
-        input = "+541115" + input
-        print(f"wa_id: {wa_id}")
-        print(f"input: {input}")
-        data = get_text_message_input(input, response)
-        send_message(data)
+    print("no duplicado")
+    dispatcher.notify()
+
+
+async def handle_whatsapp_message(app, job):
+    """
+    Run one turn for a queued job: the consecutive messages of one user are answered together
+    with a single graph invocation, and the answer is sent back to the user.
+    If a send fails the job is retried, but a turn whose reply is already in chat_messages is not
+    generated again: the retry only sends the part of the reply that did not arrive
+    """
+    from app.services.openai_service import agenerate_response
+    from app.services.whatsapp_client import WhatsAppSendError
+    from app.services.dispatcher import dispatcher
+
+    wa_id = job["wa_id"]
+    last_msg_id = job["messages"][-1]["msg_id"]
+
+    # En un reintento algunos mensajes del usuario pueden haber quedado guardados en chat_messages
+    already_saved = set()
+    reply = None
+    if job["attempts"] > 1:
+        from backend.async_db import check_duplicated, load_reply
+        for message in job["messages"]:
+            if await check_duplicated(wa_id, message["msg_id"]):
+                already_saved.add(message["msg_id"])
+        if last_msg_id in already_saved:
+            reply = await load_reply(wa_id, last_msg_id)
+
+    if len(job["messages"]) > 1:
+        logging.info(f"Coalescing {len(job['messages'])} messages from {wa_id} into one turn")
+
+    recipient = get_recipient(wa_id)
+    # Caracteres de la respuesta guardada que ya le llegaron al usuario
+    delivered = job["delivered"] if reply is not None else 0
+
+    async def send(text):
+        body = process_text_for_whatsapp(text)
+        if body:
+            await asend_message(app, get_text_message_input(recipient, body))
+
+    try:
+        if reply is not None:
+            # El turno ya se generó y guardó en un intento anterior: solo falta mandar la respuesta
+            logging.info(f"Resending the reply to {last_msg_id} from {wa_id} ({delivered} characters already sent)")
+            await send(reply[delivered:])
+            return
+
+        if not streaming_enabled():
+            response = await agenerate_response(wa_id, job["messages"], already_saved)
+            await send(response)
+            return
+
+        # Modo streaming: "escribiendo..." enseguida y la respuesta por partes a medida que se genera
+        await asend_message(app, get_typing_indicator_input(last_msg_id), required=False)
+
+        chunker = SentenceChunker()
+        failed = None
+        current_run = None
+        sent_by_run = {}    # run_id de la llamada al modelo -> texto que ya se mandó
+
+        async def send_chunks(chunks, run_id):
+            nonlocal failed
+            for chunk in chunks:
+                if failed is not None:
+                    return
+                try:
+                    await send(chunk)
+                except WhatsAppSendError as e:
+                    # El grafo sigue hasta guardar la respuesta; el reintento manda lo que falta
+                    failed = e
+                    return
+                sent_by_run[run_id] = sent_by_run.get(run_id, "") + chunk
+
+        async def on_chunk(text, run_id):
+            nonlocal current_run
+            if run_id != current_run:
+                await send_chunks(chunker.flush(), current_run)
+                current_run = run_id
+            await send_chunks(chunker.feed(text), run_id)
+
+        response = await agenerate_response(wa_id, job["messages"], already_saved, on_chunk=on_chunk)
+        await send_chunks(chunker.flush(), current_run)
+
+        # Lo entregado se mide contra la respuesta guardada: el texto de llamadas que terminaron en
+        # tools no es parte de ella
+        delivered = delivered_length(response, sent_by_run.values())
+        if failed is not None:
+            raise failed
+
+        # Lo que no salió por streaming (p. ej. la respuesta se generó en modo especulativo)
+        await send(response[delivered:])
+    except WhatsAppSendError:
+        await asyncio.to_thread(dispatcher.queue.mark_delivered, job, delivered)
+        raise
+
+
+def delivered_length(reply, sent_texts):
+    """How much of the reply already reached the user: the longest prefix shared with a streamed run"""
+    return max((len(os.path.commonprefix([reply, text])) for text in sent_texts), default=0)
+
+
+def streaming_enabled():
+    return os.getenv('WHATSAPP_STREAMING', '0') == '1'
+
+
+async def asend_message(app, data, required=True):
+    """Send from the event loop without blocking it. Raises WhatsAppSendError if required"""
+    from app.services.whatsapp_client import get_whatsapp_client, WhatsAppSendError
+
+    try:
+        response = await get_whatsapp_client(app.config).asend(data)
+    except WhatsAppSendError as e:
+        logging.error(f"Request failed due to: {e}")
+        if required:
+            # se reintenta desde la cola
+            raise
+        return None
+    log_http_response(response)
+    return response
+
+
+class SentenceChunker:
+    """
+    Splits a streamed reply into sentence-sized WhatsApp messages.
+    A chunk is cut at the end of a sentence or line once it has at least min_chars characters,
+    never inside **bold** (process_text_for_whatsapp needs both asterisks in the same chunk).
+    """
+
+    # Fin de oración seguido de espacio (así no corta URLs ni precios como "$1.200") o salto de línea
+    BOUNDARY = re.compile(r"[.!?:](?=\s)|\n")
+
+    def __init__(self, min_chars=None):
+        self.min_chars = min_chars or int(os.getenv('WHATSAPP_STREAM_MIN_CHARS', 160))
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        cut = None
+        for match in self.BOUNDARY.finditer(self.buffer):
+            end = match.end()
+            if end >= self.min_chars and self.buffer.count("**", 0, end) % 2 == 0:
+                cut = end
+        if cut is None:
+            return []
+        chunk, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return [chunk]
+
+    def flush(self):
+        chunk, self.buffer = self.buffer, ""
+        return [chunk] if chunk.strip() else []
 
 
 def is_valid_whatsapp_message(body):
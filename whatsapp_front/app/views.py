@@ -23,6 +23,9 @@ def handle_message():
 
     Every message send will trigger 4 HTTP requests to your webhook: message, sent, delivered, read.
 
+    Messages are handed to the dispatcher (app/services/dispatcher.py) and answered in the
+    background, so the webhook returns 200 right away and Meta doesn't retry it.
+
     Returns:
         response: A tuple containing a JSON response and an HTTP status code.
     """
@@ -0,0 +1,59 @@
+"""
+Benchmark del cliente de WhatsApp contra el mock de la Graph API (sin red)
+
+Uso:
+    python bench_send.py --messages 500 --concurrency 20 --latency 0.05 --error-rate 0.02
+"""
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from app.services.mock_graph_api import MockGraphAPI
+from app.services.whatsapp_client import WhatsAppClient, WhatsAppSendError
+from app.utils.whatsapp_utils import get_text_message_input
+
+
+async def run(client, messages, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def send(i):
+        nonlocal errors
+        async with semaphore:
+            try:
+                await client.asend(get_text_message_input("+5491100000000", f"mensaje {i}"))
+            except WhatsAppSendError:
+                errors += 1
+
+    await asyncio.gather(*(send(i) for i in range(messages)))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per mock response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of 500 responses")
+    parser.add_argument('--server-rate-limit', type=float, default=None, help="mock 429s above this msg/s")
+    parser.add_argument('--rate-limit', type=float, default=80, help="client token bucket msg/s")
+    args = parser.parse_args()
+
+    with MockGraphAPI(latency=args.latency, error_rate=args.error_rate, rate_limit=args.server_rate_limit) as api:
+        client = WhatsAppClient("token", "v21.0", "123", base_url=api.url,
+                                rate_limit=args.rate_limit, pool_size=args.concurrency)
+        started = time.perf_counter()
+        errors = asyncio.run(run(client, args.messages, args.concurrency))
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.messages} messages in {elapsed:.2f}s ({args.messages / elapsed:.1f} msg/s), {errors} errors")
+    print(f"client: {client.stats()}")
+    print(f"server: {api.requests} requests, responses {api.responses}")
+
+
+if __name__ == '__main__':
+    main()
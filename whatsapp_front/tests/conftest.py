@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# Los tests importan el paquete app de whatsapp_front (en la raíz del repo hay un app.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    """SQLite inbound queue on a temp file, without coalescing window or retry backoff"""
+    from app.services.inbound_queue import SQLiteInboundQueue
+
+    monkeypatch.setenv('COALESCE_WINDOW_MS', '0')
+    monkeypatch.setenv('INBOUND_RETRY_BASE_SECONDS', '0')
+    return SQLiteInboundQueue(str(tmp_path / 'inbound_queue.sqlite3'))
@@ -0,0 +1,81 @@
+import time
+import asyncio
+
+from app.services.dispatcher import Dispatcher
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_processes_queued_messages(queue):
+    handled = []
+
+    async def handler(job):
+        handled.append(job['msg_id'])
+
+    dispatcher = Dispatcher(queue=queue, max_concurrency=2)
+    dispatcher.start(handler)
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.enqueue('m2', 'user2', 'chau')
+    dispatcher.notify()
+
+    wait_for(lambda: dispatcher.stats()['processed'] == 2)
+    assert sorted(handled) == ['m1', 'm2']
+    stats = dispatcher.stats()
+    assert stats['messages'] == 2
+    assert stats['errors'] == 0
+    assert stats['queue']['depth'] == 0
+
+
+def test_start_only_once(queue):
+    async def handler(job):
+        pass
+
+    dispatcher = Dispatcher(queue=queue, max_concurrency=1)
+    dispatcher.start(handler)
+    thread = dispatcher._thread
+    dispatcher.start(handler)
+    assert dispatcher._thread is thread
+
+
+def test_failed_handler_leaves_message_for_retry(queue, monkeypatch):
+    # Con backoff largo el reintento no se toma durante el test
+    monkeypatch.setenv('INBOUND_RETRY_BASE_SECONDS', '60')
+
+    async def handler(job):
+        raise RuntimeError("boom")
+
+    dispatcher = Dispatcher(queue=queue, max_concurrency=1)
+    dispatcher.start(handler)
+    queue.enqueue('m1', 'user1', 'hola')
+    dispatcher.notify()
+
+    wait_for(lambda: dispatcher.stats()['errors'] == 1)
+    wait_for(lambda: queue.metrics()['pending'] == 1)
+    assert dispatcher.stats()['processed'] == 0
+    assert queue.claim() is None
+
+
+def test_users_are_processed_concurrently(queue):
+    running = set()
+    overlapped = []
+
+    async def handler(job):
+        running.add(job['wa_id'])
+        if len(running) > 1:
+            overlapped.append(True)
+        await asyncio.sleep(0.1)
+        running.discard(job['wa_id'])
+
+    dispatcher = Dispatcher(queue=queue, max_concurrency=2)
+    dispatcher.start(handler)
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.enqueue('m2', 'user2', 'hola')
+    dispatcher.notify()
+
+    wait_for(lambda: dispatcher.stats()['processed'] == 2)
+    assert overlapped
@@ -0,0 +1,179 @@
+import time
+import sqlite3
+
+from app.services.inbound_queue import SQLiteInboundQueue, retry_delay
+
+
+def test_enqueue_is_idempotent_by_msg_id(queue):
+    assert queue.enqueue('m1', 'user1', 'hola')
+    assert not queue.enqueue('m1', 'user1', 'hola')
+    assert queue.metrics()['pending'] == 1
+
+
+def test_claim_leases_the_job(queue):
+    assert queue.claim() is None
+    queue.enqueue('m1', 'user1', 'hola')
+
+    job = queue.claim()
+    assert job['msg_id'] == 'm1'
+    assert job['wa_id'] == 'user1'
+    assert job['messages'] == [{'msg_id': 'm1', 'body': 'hola'}]
+    assert job['attempts'] == 1
+    assert job['delivered'] == 0
+    # Mientras dura el lease nadie más lo toma
+    assert queue.claim() is None
+    assert queue.metrics()['processing'] == 1
+
+
+def test_expired_lease_is_claimed_again(queue):
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.claim(lease=0.01)
+    time.sleep(0.02)
+
+    job = queue.claim()
+    assert job['msg_id'] == 'm1'
+    assert job['attempts'] == 2
+
+
+def test_messages_of_one_user_are_processed_in_order(queue, monkeypatch):
+    monkeypatch.setenv('COALESCE_MAX_MESSAGES', '1')
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.enqueue('m2', 'user1', 'necesito leche')
+    queue.enqueue('m3', 'user2', 'hola')
+
+    first = queue.claim()
+    assert first['msg_id'] == 'm1'
+    # m2 espera a que termine m1, pero otro usuario no
+    assert queue.claim()['msg_id'] == 'm3'
+    assert queue.claim() is None
+
+    queue.complete(first)
+    assert queue.claim()['msg_id'] == 'm2'
+
+
+def test_consecutive_messages_are_coalesced(queue):
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.enqueue('m2', 'user1', 'necesito leche')
+    queue.enqueue('m3', 'user1', 'y pan')
+
+    job = queue.claim()
+    assert [m['msg_id'] for m in job['messages']] == ['m1', 'm2', 'm3']
+    assert job['msg_id'] == 'm1'
+    assert len(job['seqs']) == 3
+    assert queue.claim() is None
+
+
+def test_coalescing_window_delays_the_claim(queue, monkeypatch):
+    monkeypatch.setenv('COALESCE_WINDOW_MS', '60000')
+    queue.enqueue('m1', 'user1', 'hola')
+    assert queue.claim() is None
+
+    # Pasado COALESCE_MAX_WAIT_MS se toma aunque sigan llegando mensajes
+    monkeypatch.setenv('COALESCE_MAX_WAIT_MS', '0')
+    assert queue.claim()['msg_id'] == 'm1'
+
+
+def test_messages_arriving_during_a_turn_form_the_next_job(queue):
+    queue.enqueue('m1', 'user1', 'hola')
+    first = queue.claim()
+    queue.enqueue('m2', 'user1', 'y pan')
+    assert queue.claim() is None
+
+    queue.complete(first)
+    second = queue.claim()
+    assert [m['msg_id'] for m in second['messages']] == ['m2']
+
+
+def test_fail_retries_with_backoff(queue, monkeypatch):
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.fail(queue.claim(), RuntimeError("boom"))
+    job = queue.claim()
+    assert job['attempts'] == 2
+
+    monkeypatch.setenv('INBOUND_RETRY_BASE_SECONDS', '60')
+    queue.fail(job, RuntimeError("boom"))
+    assert queue.claim() is None
+    assert queue.metrics()['pending'] == 1
+
+
+def test_retry_delay_is_exponential_and_capped(monkeypatch):
+    monkeypatch.setenv('INBOUND_RETRY_BASE_SECONDS', '2')
+    assert [retry_delay(n) for n in (1, 2, 3)] == [2, 4, 8]
+    assert retry_delay(20) == 300
+
+
+def test_failed_after_max_attempts_does_not_block_the_user(queue, monkeypatch):
+    monkeypatch.setenv('INBOUND_MAX_ATTEMPTS', '2')
+    monkeypatch.setenv('COALESCE_MAX_MESSAGES', '1')
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.enqueue('m2', 'user1', 'y pan')
+
+    queue.fail(queue.claim(), RuntimeError("boom"))
+    queue.fail(queue.claim(), RuntimeError("boom"))
+
+    assert queue.metrics()['failed'] == 1
+    assert queue.claim()['msg_id'] == 'm2'
+
+
+def test_mark_delivered_is_kept_across_retries(queue):
+    queue.enqueue('m1', 'user1', 'hola')
+    job = queue.claim()
+    queue.mark_delivered(job, 42)
+    queue.fail(job, RuntimeError("send failed"))
+
+    job = queue.claim()
+    assert job['delivered'] == 42
+    assert job['attempts'] == 2
+
+
+def test_purge_deletes_only_old_done_messages(queue):
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.enqueue('m2', 'user2', 'hola')
+    queue.complete(queue.claim())
+
+    assert queue.purge(older_than=3600) == 0
+    time.sleep(0.01)
+    assert queue.purge(older_than=0) == 1
+    assert queue.metrics()['pending'] == 1
+    # Una re-entrega de un mensaje purgado se vuelve a encolar
+    assert queue.enqueue('m1', 'user1', 'hola')
+
+
+def test_metrics(queue):
+    queue.enqueue('m1', 'user1', 'hola')
+    queue.enqueue('m2', 'user2', 'hola')
+    queue.complete(queue.claim())
+
+    metrics = queue.metrics()
+    assert metrics['depth'] == 1
+    assert metrics['pending'] == 1
+    assert metrics['processing'] == 0
+    assert metrics['oldest_open_age'] >= 0
+    assert metrics['avg_lag'] >= 0
+
+
+def test_adds_delivered_column_to_old_files(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE inbound_messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            msg_id TEXT NOT NULL UNIQUE,
+            wa_id TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            enqueued_at REAL NOT NULL,
+            available_at REAL NOT NULL,
+            lease_until REAL,
+            completed_at REAL
+        )
+    """)
+    conn.execute("INSERT INTO inbound_messages (msg_id, wa_id, body, enqueued_at, available_at) VALUES ('m1', 'user1', 'hola', 0, 0)")
+    conn.commit()
+    conn.close()
+
+    job = SQLiteInboundQueue(path).claim()
+    assert job['msg_id'] == 'm1'
+    assert job['delivered'] == 0
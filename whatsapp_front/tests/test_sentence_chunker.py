@@ -0,0 +1,67 @@
+from app.utils.whatsapp_utils import SentenceChunker, delivered_length
+
+
+def feed_all(chunker, pieces):
+    chunks = []
+    for piece in pieces:
+        chunks.extend(chunker.feed(piece))
+    return chunks + chunker.flush()
+
+
+def test_waits_for_min_chars():
+    chunker = SentenceChunker(min_chars=20)
+    assert chunker.feed("Hola. ") == []
+    assert chunker.feed("Tenemos leche entera. Y ") == ["Hola. Tenemos leche entera."]
+    assert chunker.flush() == [" Y "]
+
+
+def test_cuts_at_the_last_boundary():
+    chunker = SentenceChunker(min_chars=5)
+    assert chunker.feed("Uno. Dos. Tres") == ["Uno. Dos."]
+    assert chunker.flush() == [" Tres"]
+
+
+def test_cuts_at_new_lines():
+    chunker = SentenceChunker(min_chars=5)
+    assert chunker.feed("- Leche entera\n- Pan") == ["- Leche entera\n"]
+
+
+def test_does_not_cut_prices_or_urls():
+    chunker = SentenceChunker(min_chars=5)
+    assert chunker.feed("Cuesta $1.200 en https://www.coto.com.ar/leche") == []
+    assert chunker.flush() == ["Cuesta $1.200 en https://www.coto.com.ar/leche"]
+
+
+def test_does_not_cut_inside_bold():
+    chunker = SentenceChunker(min_chars=5)
+    assert chunker.feed("**Leche. Entera") == []
+    assert chunker.feed("** y pan. Listo") == ["**Leche. Entera** y pan."]
+
+
+def test_pieces_add_up_to_the_reply():
+    reply = "Agregué **Leche Entera** al carrito.\nEl total es $1.200. ¿Algo más? Avisame!"
+    pieces = [reply[i:i + 7] for i in range(0, len(reply), 7)]
+    chunks = feed_all(SentenceChunker(min_chars=10), pieces)
+    assert len(chunks) > 1
+    assert "".join(chunks) == reply
+
+
+def test_flush_skips_whitespace():
+    chunker = SentenceChunker(min_chars=5)
+    chunker.feed("  \n")
+    assert chunker.flush() == []
+    assert chunker.buffer == ""
+
+
+def test_min_chars_from_env(monkeypatch):
+    monkeypatch.setenv('WHATSAPP_STREAM_MIN_CHARS', '42')
+    assert SentenceChunker().min_chars == 42
+
+
+def test_delivered_length():
+    reply = "Agregué la leche. Algo más?"
+    # Texto de una llamada que terminó en tools no cuenta
+    assert delivered_length(reply, ["Busco la leche...", "Agregué la leche."]) == len("Agregué la leche.")
+    assert delivered_length(reply, [reply]) == len(reply)
+    assert delivered_length(reply, ["Busco la leche..."]) == 0
+    assert delivered_length(reply, []) == 0
@@ -0,0 +1,118 @@
+import json
+import time
+import socket
+import asyncio
+
+import pytest
+
+from app.services.mock_graph_api import MockGraphAPI
+from app.services.whatsapp_client import WhatsAppClient, WhatsAppSendError, TokenBucket
+
+MESSAGE = json.dumps({"messaging_product": "whatsapp", "to": "5491100000000", "type": "text",
+                      "text": {"body": "hola"}})
+
+
+@pytest.fixture
+def graph_api():
+    """Start a MockGraphAPI with the given settings, stopped at the end of the test"""
+    servers = []
+
+    def start(**kwargs):
+        servers.append(MockGraphAPI(**kwargs).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def make_client(url, **kwargs):
+    client = WhatsAppClient("token", "v21.0", "123", base_url=url, rate_limit=1000, **kwargs)
+    # Sin esperas entre reintentos (Retry-After del mock incluido)
+    client.backoff = lambda attempt, retry_after=None: 0
+    return client
+
+
+def test_send(graph_api):
+    api = graph_api()
+    response = make_client(api.url).send(MESSAGE)
+    assert response.json()["contacts"][0]["wa_id"] == "5491100000000"
+    assert api.requests == 1
+
+
+def test_server_error_is_not_retried(graph_api):
+    # El POST no es idempotente: un 500 puede haber mandado el mensaje
+    api = graph_api(error_rate=1.0, error_status=500)
+    client = make_client(api.url, max_retries=3)
+    with pytest.raises(WhatsAppSendError) as e:
+        client.send(MESSAGE)
+    assert e.value.status_code == 500
+    assert api.requests == 1
+    assert client.stats()['failed'] == 1
+
+
+def test_rate_limited_is_retried(graph_api):
+    api = graph_api(rate_limit=0, retry_after=0)
+    client = make_client(api.url, max_retries=3)
+    with pytest.raises(WhatsAppSendError) as e:
+        client.send(MESSAGE)
+    assert e.value.status_code == 429
+    assert api.requests == 4
+    assert client.stats() == {'sent': 0, 'retries': 3, 'failed': 1, 'rate_limited': 4}
+
+
+def test_unavailable_with_retry_after_is_retried(graph_api):
+    api = graph_api(error_rate=1.0, error_status=503, retry_after=0)
+    client = make_client(api.url, max_retries=2)
+    with pytest.raises(WhatsAppSendError):
+        client.send(MESSAGE)
+    assert api.requests == 3
+
+
+def test_unavailable_without_retry_after_is_not_retried(graph_api):
+    api = graph_api(error_rate=1.0, error_status=503, retry_after=None)
+    client = make_client(api.url, max_retries=2)
+    with pytest.raises(WhatsAppSendError) as e:
+        client.send(MESSAGE)
+    assert e.value.status_code == 503
+    assert api.requests == 1
+
+
+def test_read_timeout_is_not_retried(graph_api):
+    api = graph_api(latency=0.5)
+    client = make_client(api.url, max_retries=2, timeout=0.1)
+    with pytest.raises(WhatsAppSendError):
+        client.send(MESSAGE)
+    assert client.stats()['retries'] == 0
+
+
+def test_connection_refused_is_retried():
+    # Un puerto sin servidor: el request no llegó, se puede reintentar
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = make_client(f"http://127.0.0.1:{port}", max_retries=2)
+    with pytest.raises(WhatsAppSendError) as e:
+        client.send(MESSAGE)
+    assert e.value.status_code is None
+    assert client.stats()['retries'] == 2
+
+
+def test_asend(graph_api):
+    api = graph_api()
+    client = make_client(api.url)
+
+    async def send_many():
+        return await asyncio.gather(*(client.asend(MESSAGE) for _ in range(5)))
+
+    assert all(response.ok for response in asyncio.run(send_many()))
+    assert client.stats()['sent'] == 5
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # El primero sale con el token inicial, los otros 5 esperan 1/50 s cada uno
+    assert time.monotonic() - started >= 0.09